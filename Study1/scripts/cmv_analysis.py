@@ -8,28 +8,36 @@ cmv_analysis.py
 This script will analyze rates of attitude change and evidence citation in ChangeMyView discussions on the website Reddit.
 
 To run this script, enter the directory where this file is saved on the terminal and run: python cmv_analysis.py
+Each post is saved to its own shard as it is collected. To merge the shards into 08_top_posts.csv, run: python cmv_analysis.py compact
 
 """
 
 import os
+import sys
+import csv
 import praw
 import pandas as pd
 from datetime import datetime
 import re
 import nltk
+
+#The index of collected posts and the comment tree walk are shared with Study 2. 
+#See Study2/collected_index.py and Study2/comment_tree.py.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Study2'))
+from collected_index import CollectedIndex
+from comment_tree import build_tree
+
+#get_evid_lang stems each comment as one string, so no two calls share a key and a memoizing stemmer
+#(Study2/stem_cache.py) would only fill with whole comments. The plain stemmer is used instead.
 snow = nltk.stem.SnowballStemmer('english')
 
 def get_comments(submission):
     
-    comments = []
     #may be a more elegant solution than submission.num_comments
     com = submission.comments.replace_more(limit = submission.num_comments)
-    com_tree = submission.comments[:]
 
-    while com_tree:
-        comment = com_tree.pop(0)                    
-        com_tree.extend(comment.replies)
-        comments.append(comment)
+    #walk the discussion breadth first, visiting each comment once. See Study2/comment_tree.py.
+    comments, tree = build_tree(submission.comments[:])
         
     return comments
 
@@ -45,32 +53,33 @@ def replace_sub_dicts(dic):
             dic[key] = sub_lot
     return dic
 
-def make_comment_df(comments):
-	
-	data = pd.DataFrame(columns = vars(comments[0]).keys())
+#comment_record turns a comment into a plain dictionary, with the ids of its replies rather than the reply objects.
+def comment_record(comment):
 
-	for comment in comments:
-		c = vars(comment)
-		comment_df = pd.DataFrame(columns = c.keys())
-		for key, item in c.items():
-		
-			if key is '_replies':
-				comment_df[key] = c[key]._comments
-			else:
-				comment_df[key] = pd.Series(c[key])
+	record = {}
+
+	for key, item in vars(comment).items():
+		if key == '_replies':
+			record[key] = [reply.id for reply in item._comments]
+		else:
+			record[key] = item
 
-		data = data.append(comment_df, ignore_index = True)
+	return record
+
+#make_comment_df collects every comment as a plain record first, and then builds the data frame once,
+#with one row per comment. (Appending to a data frame copies it, so appending comment by comment is quadratic.)
+def make_comment_df(comments):
+	
+	data = pd.DataFrame.from_records([comment_record(comment) for comment in comments])
 
 	data.columns = [c + '_comment' for c in list(data.columns) ]
 	return data
 
 
+#make_post_df makes a data frame with a single row for the post.
 def make_post_df(post):
 
-	data = pd.DataFrame(columns = post.keys())
-
-	for key, item in post.items():
-		data[key] = pd.Series(post[key])
+	data = pd.DataFrame([post])
 
 	data.columns = [c + '_post' for c in list(data.columns)]
 	return data
@@ -94,6 +103,25 @@ def get_deltas(dataframe):
 *** calculate the frequency and use of language representative of citing evidence. 
 """
 
+"""
+A word is a link if it contains one of the LINK_EXTENSIONS (and is not a link to reddit.com).  A word of a 
+stemmed comment is evidence language if it is one of the EVIDENCE_STEMS, and contains none of the EVIDENCE_EXTENSIONS. 
+"""
+LINK_EXTENSIONS = ['http://', 'https://', '.com', '.org', '.gov', '.pdf', '.net', 'www.']
+
+EVIDENCE_EXTENSIONS = ['http://', 'https://', '.com', '.org', '.gov', 'pdf', '.net', 'www.']
+
+EVIDENCE_STEMS = ['data', 'stat', 'statist', 'figur', '%', 'percent', 'averag', 'number', 'amount', 
+         'thousand', 'million', 'billion', '$', '€', '¥', '£', 'dollar', 'evid', 'info', 
+         'testimoni', 'conclus', 'document', 'experi', 'experi', 'measur', 'measur', 'report', 
+         'result', 'census', 'figur', 'plot', 'graph', 'sum', 'total', 'decim', 'digit', 'fraction',
+         'numer', 'half', 'share', 'proport', 'capit', 'cash', 'properti', 'salari', 'wage', 'wealth', 
+         'financ', 'resourc', 'roll', 'treasuri', 'bank', 'deposit', 'exchang', 'safe', 'estim', 'price', 
+         'price', 'merchandis', 'retail', 'sale', 'cartel', 'invest', 'market', 'deposit', 'document', 
+         'indic', 'wit', 'affirm', 'corrobor', 'declar', 'good', 'ground', 'token', 'signific', 'probabl', 
+         'p valu', '<', '=', 'greater', 'equal', 'less', 'rang', 'devi', 'sd', 'mode',
+         'median']
+
 """
 get_links will take a list of comments (passed as a column in a dataframe), and return a new column,
 where row values are the links used in each comment. 
@@ -109,7 +137,7 @@ def get_links(comments):
     for comment in comments:
         comment = str(comment)
         
-        extensions = ['http://', 'https://', '.com', '.org', '.gov', '.pdf', '.net', 'www.']
+        extensions = LINK_EXTENSIONS
         
         comment_links = []   
         for word in comment.lower().split():
@@ -137,18 +165,9 @@ def get_evid_lang(comments):
     for comment in comments:
         comment = str(comment)
         
-        extensions = ['http://', 'https://', '.com', '.org', '.gov', 'pdf', '.net', 'www.']
+        extensions = EVIDENCE_EXTENSIONS
         
-        stems = ['data', 'stat', 'statist', 'figur', '%', 'percent', 'averag', 'number', 'amount', 
-                 'thousand', 'million', 'billion', '$', '€', '¥', '£', 'dollar', 'evid', 'info', 
-                 'testimoni', 'conclus', 'document', 'experi', 'experi', 'measur', 'measur', 'report', 
-                 'result', 'census', 'figur', 'plot', 'graph', 'sum', 'total', 'decim', 'digit', 'fraction',
-                 'numer', 'half', 'share', 'proport', 'capit', 'cash', 'properti', 'salari', 'wage', 'wealth', 
-                 'financ', 'resourc', 'roll', 'treasuri', 'bank', 'deposit', 'exchang', 'safe', 'estim', 'price', 
-                 'price', 'merchandis', 'retail', 'sale', 'cartel', 'invest', 'market', 'deposit', 'document', 
-                 'indic', 'wit', 'affirm', 'corrobor', 'declar', 'good', 'ground', 'token', 'signific', 'probabl', 
-                 'p valu', '<', '=', 'greater', 'equal', 'less', 'rang', 'devi', 'sd', 'mode',
-                 'median']
+        stems = EVIDENCE_STEMS
         
         comment_evidence = [] 
         
@@ -163,14 +182,110 @@ def get_evid_lang(comments):
         
     return evidence, total_evidence
 
+
+"""
+get_links_column and get_evid_lang_column return the same lists and counts as get_links and get_evid_lang,
+but work on the whole column of comments at once: every comment is split into words with pandas .str methods,
+and the words are tested against a precompiled pattern of extensions and a set of stems, rather than word by 
+word in Python.  They return a column of lists and a column of counts, with the same index as comments. 
+"""
+LINK_PATTERN = re.compile('|'.join(re.escape(e) for e in LINK_EXTENSIONS))
+EVIDENCE_PATTERN = re.compile('|'.join(re.escape(e) for e in EVIDENCE_EXTENSIONS))
+EVIDENCE_STEM_SET = set(EVIDENCE_STEMS)
+
+#words_to_lists gathers the words that pass the mask back into one list per comment, and counts them. 
+def words_to_lists(words, mask, index):
+
+    lists = words[mask].groupby(level = 0).agg(list)
+    lists = lists.reindex(range(len(index)))
+    lists = pd.Series([l if isinstance(l, list) else [] for l in lists], index = index)
+
+    return lists, lists.str.len()
+
+def get_links_column(comments):
+
+    #number the comments 0, 1, 2, ... so each word knows which comment it came from (str, as in get_links, turns a missing comment into "nan")
+    index = comments.index
+    comments = pd.Series(comments.values, dtype = object)
+    words = comments.map(str).str.lower().str.split().explode()
+
+    mask = words.str.contains(LINK_PATTERN, na = False) & ~words.str.contains('reddit.com', regex = False, na = False)
+
+    return words_to_lists(words, mask, index)
+
+def get_evid_lang_column(comments):
+
+    index = comments.index
+    comments = pd.Series(comments.values, dtype = object)
+
+    #the comment is stemmed as a whole (as in get_evid_lang), once per comment. 
+    words = comments.map(str).str.lower().map(snow.stem).str.split().explode()
+
+    mask = words.isin(EVIDENCE_STEM_SET) & ~words.str.contains(EVIDENCE_PATTERN, na = False)
+
+    return words_to_lists(words, mask, index)
+
+#join_dfs repeats the post's row once for every comment, and puts the post and comment columns side by side.
 def join_dfs(post, comments):
-	new_post = pd.DataFrame()
+	new_post = post.loc[post.index.repeat(len(comments))].reset_index(drop = True)
+
+	return pd.concat([new_post, comments.reset_index(drop = True)], axis = 1)
+
+
+#The index of collected posts, the name of our crawl in the index, the directory each post's rows are saved to
+#while crawling, and the file the shards are merged into.
+INDEX = 'collected_posts.sqlite3'
+CRAWL = 'study1:top:1000'
+SHARDS = '08_top_posts_shards'
+OUTPUT = '08_top_posts.csv'
+
+"""
+Rather than rewriting the whole dataset after every post, each post's rows are saved to their own shard, 
+a small CSV file in the SHARDS directory. Shards are numbered in the order they are collected. A shard is written
+to a temporary file first and then renamed, so a crash never leaves half a shard behind, and saving a post costs
+the same no matter how far into the crawl we are. compact_shards merges the shards into the final table. 
+"""
+def write_shard(df, shard_dir, number, name):
+
+	os.makedirs(shard_dir, exist_ok = True)
+	shard = os.path.join(shard_dir, '%05d_%s.csv' % (number, name))
 
-	for row in range(len(comments)):
-		new_post = new_post.append(post, ignore_index = True)
+	df.to_csv(shard + '.tmp', na_rep = 'NA', index = False)
+	os.replace(shard + '.tmp', shard)
 
-	return pd.concat([new_post, comments], axis = 1)
+	return shard
 
+def list_shards(shard_dir):
+
+	if not os.path.exists(shard_dir):
+		return []
+
+	return sorted(os.path.join(shard_dir, f) for f in os.listdir(shard_dir) if f.endswith('.csv'))
+
+#compact_shards merges every shard into one CSV file, one shard at a time. Posts can have different columns,
+#so we first read the header of every shard, and then fill the columns a shard doesn't have with NA.
+def compact_shards(shard_dir, output):
+
+	csv.field_size_limit(2**31 - 1)
+	shards = list_shards(shard_dir)
+
+	columns = {}
+	for shard in shards:
+		with open(shard, newline = '') as f:
+			for column in next(csv.reader(f), []):
+				columns.setdefault(column, None)
+
+	with open(output + '.tmp', 'w', newline = '') as out:
+		writer = csv.DictWriter(out, fieldnames = list(columns), restval = 'NA')
+		writer.writeheader()
+		for shard in shards:
+			with open(shard, newline = '') as f:
+				writer.writerows(csv.DictReader(f))
+
+	os.replace(output + '.tmp', output)
+	print("Merged %d shards into %s" % (len(shards), output))
+
+	return True
 
 def main():
 
@@ -185,12 +300,17 @@ def main():
 	subreddit = reddit.subreddit('changemyview')
 
 
-	#if you have already collected some posts, and don't want them to be collected again, read in post ids from collected_posts.txt
-	f  = open('collected_posts.txt', 'r')
-	collected_posts = f.read().split('\n')
-	f.close()
+	#if you have already collected some posts, they are in the index of collected posts and won't be collected again.
+	#the first time the index is made, we add the post ids from the old collected_posts.txt.  See Study2/collected_index.py.
+	new_index = not os.path.exists(INDEX)
+	collected_posts = CollectedIndex(INDEX)
+	if new_index:
+		collected_posts.import_text('collected_posts.txt')
 
-	df = pd.DataFrame()
+	#If the last crawl stopped part way through, its posts are already saved as shards, and we continue from there. 
+	shards = len(list_shards(SHARDS))
+	if collected_posts.get_checkpoint(CRAWL) is not None:
+		print("Resuming crawl %s after %d posts" % (CRAWL, shards))
 
 	POST_TYPE = 'top'
 	for post in subreddit.top(limit = 1000):
@@ -205,21 +325,37 @@ def main():
 			
 			comments = get_comments(post)
 			com_df = make_comment_df(comments)	
-			com_df['Evidence_Lang_Use_com'], com_df['Total_Evidence_com'] = get_evid_lang(com_df['body_comment'])
-			com_df['Links_Use_com'], com_df['Total_Links_com'] = get_links(com_df['body_comment'])
+			com_df['Evidence_Lang_Use_com'], com_df['Total_Evidence_com'] = get_evid_lang_column(com_df['body_comment'])
+			com_df['Links_Use_com'], com_df['Total_Links_com'] = get_links_column(com_df['body_comment'])
 			
 			post_df['Total_Deltas_post'] = get_deltas(com_df)
 			post_df['Post_Type_post'] = POST_TYPE
 			
-			df = df.append(join_dfs(post_df, com_df))
-			df.to_csv('08_top_posts.csv', na_rep = 'NA', index = False)
+			shard = write_shard(join_dfs(post_df, com_df), SHARDS, shards, post.name)
+			shards += 1
+
+			#Only once the post's rows are saved do we add it to the index. 
+			collected_posts.add(post.name, shard)
+			collected_posts.checkpoint(CRAWL, SHARDS, shards)
 
 		else:
 
 			print("%s already collected" % post.name)
 
+	#The crawl is finished, so there is nothing to resume, and we merge the shards into our final table. 
+	collected_posts.finish(CRAWL)
+	collected_posts.close()
+
+	compact_shards(SHARDS, OUTPUT)
+
+
+#To merge the shards into the final table without crawling, run: python cmv_analysis.py compact
+if __name__ == '__main__':
 
-main()
+	if sys.argv[1:] == ['compact']:
+		compact_shards(SHARDS, OUTPUT)
+	else:
+		main()
 
 
 
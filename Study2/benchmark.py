@@ -0,0 +1,258 @@
+"""
+Project Name: Attitude Change on Change My View (Study 2)
+Name: benchmark.py
+
+Description of this script:
+
+    Time each stage of coding a dataset with discussion_analysis.py, and
+    report how many comments (or megabytes) each stage gets through per
+    second, so the speed of the code can be compared between commits.
+
+    The stages are timed one at a time, over every comment in the dataset:
+
+        json_write      writing the discussions to a .jsonl file
+        json_read       reading them back
+        prepare         lower casing, removing punctuation, and stemming
+        match           the term-by-term match of every term list (on a sample of comments)
+        classify_text   classifying evidence use with the compiled matcher
+        award_deltas    resolving every DeltaBot confirmation to the comment awarded the delta
+        get_links       finding the links in body_html
+
+    The stemmer forgets what it has stemmed before every stage (see
+    stem_cache.py), so no stage is sped up by the one before it.  Each stage
+    is run repeat times and the fastest run is reported.
+
+    By default the dataset is made with synthetic_data.py.  Run from Study2/:
+
+        python benchmark.py --posts 10 --comments 10 10000 --save benchmark.json
+        python benchmark.py --data data/20180815182030_posts.jsonl
+        python benchmark.py --save new.json --compare benchmark.json
+
+    With --startup, the benchmark instead times how long a fresh Python process
+    takes to import discussion_analysis.py, to start its command line (--help),
+    and to start a worker process (init_worker), checks each against its budget
+    in STARTUP_BUDGET, and lists any heavy module (e.g., NLTK) that was imported
+    before it was needed.  It exits with an error if a budget is exceeded:
+
+        python benchmark.py --startup
+
+Authors: J. Hunter Priniski & Zachary Horne
+"""
+
+#REQUIREMENTS
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import discussion_analysis
+from json_lines import read_posts, JsonLinesWriter
+import synthetic_data
+
+#best_time runs stage repeat times and returns the fastest run, in seconds.
+def best_time(stage, repeat):
+
+    times = []
+
+    for i in range(repeat):
+        discussion_analysis.stemmer.cache.clear()
+        start = time.perf_counter()
+        stage()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+#commit returns the git commit the benchmark is run on, or None outside of a git repository.
+def commit():
+
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+"""
+run_benchmark times every stage over posts (a list of discussions), and returns the results: for each
+stage, the best time in seconds, the number of items it went through, their unit, and the items per second.
+Only match_sample comments (picked at random) are matched term by term, since match is so slow.
+"""
+def run_benchmark(posts, repeat = 3, match_sample = 200, seed = 0):
+
+    comments = [comment for post in posts for comment in post['_comments']]
+    bodies = [comment['body'] for comment in comments]
+
+    topics, evidence, matcher = discussion_analysis.load_lexicons()
+
+    results = {}
+
+    def record(name, seconds, items, unit):
+        results[name] = {'seconds':seconds, 'items':items, 'unit':unit, 'per_second':items / max(seconds, 1e-9)}
+
+    with tempfile.TemporaryDirectory() as directory:
+
+        path = os.path.join(directory, 'posts.jsonl')
+
+        def write():
+            with JsonLinesWriter(path) as writer:
+                for post in posts:
+                    writer.write(post)
+
+        seconds = best_time(write, repeat)
+        megabytes = os.path.getsize(path) / 1e6
+        record('json_write', seconds, megabytes, 'MB')
+
+        seconds = best_time(lambda: sum(1 for post in read_posts(path)), repeat)
+        record('json_read', seconds, megabytes, 'MB')
+
+    seconds = best_time(lambda: [discussion_analysis.prepare(body) for body in bodies], repeat)
+    record('prepare', seconds, len(bodies), 'comments')
+
+    sample = random.Random(seed).sample(bodies, min(match_sample, len(bodies)))
+
+    def match():
+        for body in sample:
+            prepared = discussion_analysis.prepare(body)
+            for terms in evidence.values():
+                discussion_analysis.match(prepared, terms)
+
+    seconds = best_time(match, repeat)
+    record('match', seconds, len(sample), 'comments')
+
+    seconds = best_time(lambda: [discussion_analysis.classify_text(body, evidence, matcher) for body in bodies], repeat)
+    record('classify_text', seconds, len(bodies), 'comments')
+
+    seconds = best_time(lambda: [discussion_analysis.award_deltas(post['_comments']) for post in posts], repeat)
+    record('award_deltas', seconds, len(comments), 'comments')
+
+    #get_links only reads body_html, so it works on copies and leaves the discussions as they were.
+    links = [{'body_html':comment['body_html']} for comment in comments]
+    seconds = best_time(lambda: discussion_analysis.get_links(links), repeat)
+    record('get_links', seconds, len(comments), 'comments')
+
+    return results
+
+#The cold start budget: the most seconds (the median of repeat runs) a fresh Python process may take to start
+#the code each way. None of these needs NLTK, BeautifulSoup, or PRAW, which take a second or more to import.
+STARTUP_BUDGET = {'import':0.5, 'cli':0.5, 'worker':1.0}
+
+STARTUP = {
+    'import':['-c', 'import discussion_analysis'],
+    'cli':['discussion_analysis.py', '--help'],
+    'worker':['-c', 'import discussion_analysis; discussion_analysis.init_worker()'],
+}
+
+#Modules that should only be imported once they are needed.
+HEAVY_MODULES = ('nltk', 'bs4', 'praw', 'scipy', 'pandas')
+
+"""
+measure_startup starts each way of starting the code in STARTUP repeat times, in a fresh Python process,
+and returns the median seconds each took, its budget, and the heavy modules it imported.  Each is started 
+once before it is timed, so e.g. the compiled lexicons are saved (see lexicon_cache.py) as they would be 
+by any earlier run.
+"""
+def measure_startup(repeat = 5):
+
+    results = {}
+
+    for name, arguments in STARTUP.items():
+
+        command = [sys.executable] + arguments
+        subprocess.run(command, check = True, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+
+        times = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            subprocess.run(command, check = True, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+            times.append(time.perf_counter() - start)
+
+        #The command line can't tell us what it imported, so we only check the imports of the others.
+        heavy = None
+        if arguments[0] == '-c':
+            check = arguments[1] + '; import sys, json; print(json.dumps([name for name in %r if name in sys.modules]))' % (HEAVY_MODULES,)
+            output = subprocess.run([sys.executable, '-c', check], check = True, capture_output = True, text = True).stdout
+            heavy = json.loads(output.strip().splitlines()[-1])
+
+        results[name] = {'seconds':sorted(times)[len(times) // 2], 'budget':STARTUP_BUDGET[name], 'heavy_modules':heavy}
+
+    return results
+
+#report_startup prints the startup times, and returns False if any is over its budget.
+def report_startup(results):
+
+    print('%-10s %10s %10s %8s  %s' % ('start', 'seconds', 'budget', 'within', 'heavy modules imported'))
+
+    within = True
+
+    for name, result in results.items():
+
+        ok = result['seconds'] <= result['budget']
+        within = within and ok
+
+        heavy = 'not checked' if result['heavy_modules'] is None else ', '.join(result['heavy_modules']) or 'none'
+        print('%-10s %10.3f %10.3f %8s  %s' % (name, result['seconds'], result['budget'], 'yes' if ok else 'NO', heavy))
+
+    return within
+
+#report prints the results as a table. If baseline (the results of an earlier run) is given, the speedup is printed too.
+def report(results, baseline = None):
+
+    print('%-15s %10s %16s %16s %10s' % ('stage', 'seconds', 'items', 'per second', 'speedup'))
+
+    for name, result in results.items():
+
+        speedup = ''
+        if baseline is not None and name in baseline:
+            speedup = '%.2fx' % (result['per_second'] / max(baseline[name]['per_second'], 1e-9))
+
+        print('%-15s %10.4f %16s %16s %10s' % (name, result['seconds'], '%g %s' % (round(result['items'], 2), result['unit']),
+            '%.1f' % result['per_second'], speedup))
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Time each stage of coding a dataset, and report the throughput of each stage.')
+    parser.add_argument('--data', default = None, help = 'a data file to benchmark on (default: a synthetic dataset)')
+    parser.add_argument('--posts', type = int, default = 10, help = 'number of synthetic discussions (default: 10)')
+    parser.add_argument('--comments', type = int, nargs = 2, default = [10, 10000], metavar = ('MIN', 'MAX'),
+        help = 'fewest and most comments in a synthetic discussion (default: 10 10000)')
+    parser.add_argument('--seed', default = '0', help = 'seed of the synthetic dataset (default: 0)')
+    parser.add_argument('--repeat', type = int, default = 3, help = 'runs of each stage; the fastest is reported (default: 3)')
+    parser.add_argument('--match-sample', type = int, default = 200,
+        help = 'number of comments matched term by term in the match stage (default: 200)')
+    parser.add_argument('--save', default = None, help = 'save the results to this .json file')
+    parser.add_argument('--compare', default = None, help = 'the .json file of an earlier run to compare with')
+    parser.add_argument('--startup', action = 'store_true', 
+        help = 'time the cold start of the command line and of a worker process against their budgets instead')
+    args = parser.parse_args()
+
+    if args.startup:
+        within = report_startup(measure_startup(args.repeat))
+        sys.exit(0 if within else 1)
+
+    if args.data is not None:
+        posts = list(read_posts(args.data))
+        dataset = {'file':args.data}
+    else:
+        posts = list(synthetic_data.generate(args.posts, args.comments[0], args.comments[1], args.seed))
+        dataset = {'posts':args.posts, 'comments':args.comments, 'seed':args.seed}
+
+    dataset['num_posts'] = len(posts)
+    dataset['num_comments'] = sum(len(post['_comments']) for post in posts)
+    print("Benchmarking on %d discussions and %d comments" % (dataset['num_posts'], dataset['num_comments']))
+
+    results = run_benchmark(posts, repeat = args.repeat, match_sample = args.match_sample)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare, 'r') as json_file:
+            baseline = json.load(json_file)['stages']
+
+    report(results, baseline)
+
+    if args.save is not None:
+        with open(args.save, 'w') as outfile:
+            json.dump({'commit':commit(), 'python':platform.python_version(), 'dataset':dataset, 'stages':results}, outfile, indent = 2)
+        print("Results saved to file %s" % args.save)
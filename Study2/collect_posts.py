@@ -3,12 +3,29 @@ Project: Attitude Change on Change My View (Study 2)
 File: collect_posts.py
 Description: Connect to the Reddit API and save Reddit data as a JSON file.      
 Authors: J. Hunter Priniski & Zach Horne
-run: python collect_posts.py
+run: python collect_posts.py (python collect_posts.py --help for options)
 """
 
-import praw
+import os
 import json
+import time
 import datetime
+import argparse
+import threading
+import collections
+import concurrent.futures
+
+#To collect offline, we can use a fake Reddit that serves one of our data files. See fake_reddit.py.
+import fake_reddit
+
+#Discussions are written one per line, as they are collected. See json_lines.py.
+from json_lines import JsonLinesWriter, read_posts, truncate_partial_line
+
+#We save the structure of each discussion as a compact tree. See comment_tree.py.
+from comment_tree import build_tree, to_json
+
+#We keep an index of every submission we have collected, so we never collect one twice. See collected_index.py.
+from collected_index import CollectedIndex
 
 #get_replies turns the Object returned by the Reddit API into a list of replies by ID. 
 #This allows us to store the replies into a JSON object, and allows us to easily reconstruct
@@ -33,18 +50,9 @@ def get_replies(comment):
 	else:
 		return []
 
-#For some reason, the Reddit API doesn't like to provide you with all the comments in a discussion
-#right away.  You must iterate over MoreComment Objects to get to some of the lower-level comments. 
-#THis isn't a concern for discussions with few comments, but for large discussions, some of the comments
-#are stored in MoreComment objects. get_comments, then iterates over the MoreComments objects
-#and appends them to a list.  also, get_commetns removes useless REddit attributes that 
-#prohibit us from saving the comments list to a JSON file. dont worry about loosing discussion network
-#strucutre, we will save the ids of the replies in a replies attribute allowing us to reconstruct the network if needed
-def get_comments(submission, metadata = True):
-
-	#these are the fields (or attributes) we can save to a json object and store in local memory
-	#ie. attibutes that are connections to more data in the APi need to be removed or transcribed into a string. 
-	fields = ('_mod','subreddit_id', 'approved_at_utc', 'ups', 'mod_reason_by', 
+#these are the fields (or attributes) we can save to a json object and store in local memory
+#ie. attibutes that are connections to more data in the APi need to be removed or transcribed into a string. 
+COMMENT_FIELDS = ('_mod','subreddit_id', 'approved_at_utc', 'ups', 'mod_reason_by', 
 	'banned_by', 'removal_reason', 'link_id', 'author_flair_type',
 	'author_flair_template_id', 'likes', 'no_follow', 'user_reports', 
 	'saved', 'id', 'banned_at_utc', 'mod_reason_title', 'gilded', 
@@ -59,28 +67,39 @@ def get_comments(submission, metadata = True):
 	'depth', 'author_flair_background_color', 'mod_reports', 'mod_note', 
 	'distinguished', '_fetched', '_info_params')
 
+#For some reason, the Reddit API doesn't like to provide you with all the comments in a discussion
+#right away.  You must iterate over MoreComment Objects to get to some of the lower-level comments. 
+#THis isn't a concern for discussions with few comments, but for large discussions, some of the comments
+#are stored in MoreComment objects. get_comments, then iterates over the MoreComments objects
+#and appends them to a list.  also, get_commetns removes useless REddit attributes that 
+#prohibit us from saving the comments list to a JSON file. dont worry about loosing discussion network
+#strucutre, we will save the ids of the replies in a replies attribute allowing us to reconstruct the network if needed.
+#if tree is a dictionary, get_comments also saves the compact tree of the whole discussion in it (see comment_tree.py)
+#if a limiter is given (see RateLimiter), every request made for the MoreComments objects is charged to it. 
+def get_comments(submission, metadata = True, tree = None, limiter = None, reddit = None):
+
 	#if the comment was deleted or removed, we don't want to save it. 
 	REMOVE_COMMENTS = ['[deleted]', '[removed]', ]
 
-	#this will become our list of comments
-	comments = []
-
 	#we unpack all of the MoreComments objects.  turning the 
 	#returned discussion tree which is imcomplete into the complete discussion
-	com = submission.comments.replace_more(limit=submission.num_comments)
+	if limiter is None:
+		com = submission.comments.replace_more(limit=submission.num_comments)
 
-	#we make our submission comments object iterable, this allows us to go over each comment
-	#in the discussion
-	com_tree = submission.comments[:]
+	#unpacking a MoreComments object is one request, so we unpack them one at a time, 
+	#and wait on the limiter before each one. 
+	else:
+		for i in range(max(submission.num_comments, 1)):
+			if not limiter.call(lambda: submission.comments.replace_more(limit = 1), reddit):
+				break
+
+	#we walk the discussion tree breadth first, starting from the top-level comments. every comment is visited once,
+	#and as we go, we record the structure of the tree in a few compact arrays. see comment_tree.py
+	comments, comment_tree = build_tree(submission.comments[:])
 
-	#while there are still more comments to be appended to our comment list, we will stay in this loop
-	while com_tree:
-		#our next comment will be popped off the tree
-		comment = com_tree.pop(0)                    
-		#if this comment as anny replies, we append them to our comment tree
-		com_tree.extend(comment.replies)
-		#append the comment's metadata to our list of comments
-		comments.append(comment)
+	#if we were given a tree, we save the tree we recorded in it
+	if tree is not None:
+		tree.update(to_json(comment_tree))
 
 
 	#if we want all of the metadata the reddit api has to offer, we enter this branch
@@ -101,7 +120,7 @@ def get_comments(submission, metadata = True):
 				#Try and catch will continue on with the program if the Reddit API happens to not return one of our desired fields. 
 				try:
 
-					data_dict = {field:comment_dict[field] for field in fields}	
+					data_dict = {field:comment_dict[field] for field in COMMENT_FIELDS}	
 				
 				except KeyError:
 				
@@ -121,84 +140,387 @@ def get_comments(submission, metadata = True):
 	else:
 		return comments
 
-def main():
+#these are the fields (or attributes) we can save to a json object and store in local memory
+#ie. attibutes that are connections to more data in the APi need to be removed or transcribed into a string. 
+SUBMISSION_FIELDS = ('approved_at_utc','selftext','user_reports','saved',
+	'mod_reason_title','gilded','clicked','title','link_flair_richtext',
+	'subreddit_name_prefixed','hidden','pwls','link_flair_css_class',
+	'downs','parent_whitelist_status','hide_score','name','quarantine',
+	'link_flair_text_color','author_flair_background_color','subreddit_type',
+	'ups','domain','media_embed','author_flair_template_id','is_original_content',
+	'secure_media','is_reddit_media_domain','is_meta','category','secure_media_embed',
+	'link_flair_text','can_mod_post','score','approved_by','thumbnail','edited',
+	'author_flair_css_class','author_flair_richtext','content_categories','is_self',
+	'mod_note','created','link_flair_type','wls','banned_by','author_flair_type',
+	'contest_mode','selftext_html','likes','suggested_sort','banned_at_utc',
+	'view_count','archived','no_follow','is_crosspostable','pinned','over_18',
+	'media_only','link_flair_template_id','can_gild','spoiler','locked',
+	'author_flair_text','visited','num_reports','distinguished',
+	'subreddit_id','mod_reason_by','removal_reason','link_flair_background_color','id',
+	'report_reasons','author','num_crossposts','num_comments','send_replies','mod_reports',
+	'author_flair_text_color','permalink','whitelist_status','stickied','url','subreddit_subscribers',
+	'created_utc','media','is_video','_fetched','_info_params','comment_limit','comment_sort','_flair','_mod')
+
+#collect_submission turns a submission returned by the Reddit API into a dictionary of the discussion's data,
+#with all of its comments. If the discussion was deleted, or is missing some of our fields, we return None.
+#limiter and reddit are passed on to get_comments. 
+def collect_submission(submission, limiter = None, reddit = None):
+
+	print("Collecting data for %s" % submission.title[0:50])
+	#turn the Reddit Object returned by the api into a dictionary.  This makes it easy to work with and we don't need to make additional api calls to see attributes of the data. 
+	submission_dict = vars(submission)
+
+	#get the author of the discussion
+	author = submission_dict['author']
+
+	#if the author is None, then the discussion was deleted.  We will skip over collecting the data. 
+	#If the author is None, well, just print that we can't collect the data. 
+	if author == None:
+		print('Could not collect post data.')
+		return None
+
+	#create a dictionary of data that we wish to write to local memory
+	#Try and catch will continue on with the program if the Reddit API happens to not return one of our desired fields. 
+	try:
+	
+		data_dict = {field:submission_dict[field] for field in SUBMISSION_FIELDS}
+	
+	except KeyError:
+	
+		return None
+
+	#replace the CommentForest object with a list of comment metadata dictionaries, and save the discussion tree next to them
+	tree = {}
+	data_dict['_comments'] = get_comments(submission, metadata = True, tree = tree, limiter = limiter, reddit = reddit)
+	data_dict['_tree'] = tree
+
+	#Replace the author Reddit object with the name of the author
+	data_dict['author'] = vars(data_dict['author'])['name']
+
+	return data_dict
+
+"""
+RateLimiter is the scheduler shared by all of the threads that collect submissions at the same time. 
+Reddit tells us how many requests we have left before our rate limit resets (PRAW keeps this in 
+reddit.auth.limits).  Before a thread makes a request (fetching a submission, or unpacking one of its 
+MoreComments objects), it waits on the limiter, which counts the request against our budget.  When fewer 
+than reserve requests are left, the limiter holds every thread back until the limit resets. 
+"""
+class RateLimiter:
+
+	def __init__(self, reserve = 10, clock = time.time, sleep = time.sleep):
+
+		self.reserve = reserve
+		self.clock = clock
+		self.sleep = sleep
+		self.lock = threading.Lock()
+
+		#We know nothing about our budget until Reddit tells us. 
+		self.remaining = None
+		self.reset = None
+
+	def wait(self):
+
+		while True:
+
+			with self.lock:
+
+				#If the limit has reset, we have a fresh budget. 
+				if self.reset is not None and self.clock() >= self.reset:
+					self.remaining = None
+					self.reset = None
+
+				if self.remaining is None or self.remaining > self.reserve:
+					#Count the request against our budget until Reddit tells us the real number.
+					if self.remaining is not None:
+						self.remaining -= 1
+					return
+
+				delay = self.reset - self.clock()
+
+			print("Rate limit almost spent, waiting %.1f seconds" % delay)
+			self.sleep(max(delay, 0))
+
+	#call makes one request with request(): it waits on the limiter first, and records the budget reddit reports after it. 
+	def call(self, request, reddit):
+
+		self.wait()
+
+		try:
+			return request()
+		finally:
+			self.update(reddit.auth.limits)
+
+	#update records the budget Reddit reported after a request. 
+	def update(self, limits):
+
+		if limits.get('remaining') is None or limits.get('reset_timestamp') is None:
+			return
+
+		with self.lock:
+			self.remaining = limits['remaining']
+			self.reset = limits['reset_timestamp']
+
+#with_retries calls request (after waiting on the limiter) and retries it when it fails with one of 
+#the retry_on errors, waiting backoff seconds, then twice as long, and so on.
+def with_retries(request, limiter, retry_on = (), retries = 5, backoff = 2.0, sleep = time.sleep):
+
+	for attempt in range(retries + 1):
+
+		limiter.wait()
+
+		try:
+			return request()
+
+		except retry_on as error:
+
+			if attempt == retries:
+				raise
+
+			delay = backoff * 2 ** attempt
+			print("Request failed (%s), retrying in %.1f seconds" % (error, delay))
+			sleep(delay)
+
+"""
+collect_concurrently collects the submissions with the given ids using a pool of worker threads, 
+and yields the data of each discussion in the same order as submission_ids.  PRAW is not thread 
+safe, so every thread makes its own client with make_reddit.  At most 2 * workers submissions are 
+collected (or waiting to be yielded) at a time, so submission_ids can be a lazy listing.  If a 
+submission still fails after its retries, we yield None for it, and it is collected again on the 
+next run.  See #FN:1#.
+"""
+def collect_concurrently(submission_ids, make_reddit, workers = 8, limiter = None, retry_on = (), backoff = 2.0):
+
+	if limiter is None:
+		limiter = RateLimiter(reserve = 2 * workers)
+
+	local = threading.local()
+
+	def collect(submission_id):
+
+		if not hasattr(local, 'reddit'):
+			local.reddit = make_reddit()
+
+		reddit = local.reddit
+
+		#Every attempt starts from a fresh submission, so a failed attempt leaves nothing half collected.
+		def request():
+			try:
+				return collect_submission(reddit.submission(id = submission_id), limiter, reddit)
+			finally:
+				limiter.update(reddit.auth.limits)
+
+		return with_retries(request, limiter, retry_on, backoff = backoff)
+
+	#result waits for a submission, and returns its data (or None if it could not be collected).
+	def result(submission_id, future):
+
+		try:
+			return future.result()
+		except Exception as error:
+			print("Could not collect %s (%r), it will be collected on the next run" % (submission_id, error))
+			return None
+
+	with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as executor:
+
+		#The window holds the submissions being collected, in the order of submission_ids, however the threads finish.
+		window = collections.deque()
+
+		for submission_id in submission_ids:
+
+			window.append((submission_id, executor.submit(collect, submission_id)))
+
+			if len(window) >= 2 * workers:
+				yield result(*window.popleft())
+
+		while window:
+			yield result(*window.popleft())
+
+#make_client returns a function that makes a new Reddit API client. If replay is the path to a
+#data file, the clients are a fake Reddit that serves the discussions in that file. See fake_reddit.py.
+def make_client(replay = None, latency = 0.05):
+
+	if replay is not None:
+		fake = fake_reddit.FakeReddit.from_file(replay, latency = latency)
+		return lambda: fake, (fake_reddit.TooManyRequests,)
+
+	import praw
+	from prawcore.exceptions import ServerError, TooManyRequests, RequestException
 
 	#this our where we input our credentials. you need to have these attributes filled out in order to collect data. 
-	reddit = praw.Reddit(client_id='',
-                         client_secret='',
-                         password='',
-                         user_agent='',
-                         username='')
+	def make_reddit():
+		return praw.Reddit(client_id='',
+						 client_secret='',
+						 password='',
+						 user_agent='',
+						 username='')
+
+	return make_reddit, (ServerError, TooManyRequests, RequestException)
+
+#limited_listing yields the submissions of a listing, and charges the limiter for every page of the listing. A listing
+#fetches page_size submissions with one request, when the first submission of the page is asked for, as on Reddit.
+def limited_listing(listing, limiter, reddit, page_size = 100):
+
+	listing = iter(listing)
+	position = 0
+
+	while True:
+
+		if position % page_size == 0:
+			submission = limiter.call(lambda: next(listing, None), reddit)
+		else:
+			submission = next(listing, None)
+
+		if submission is None:
+			return
+
+		position += 1
+		yield submission
 
-  	#connect directly to the subreddit. 
+#not_collected yields the submissions in a listing that are not in our index of collected submissions.
+def not_collected(submissions, index):
+
+	for submission in submissions:
+
+		if submission.id in index:
+			print("%s already collected" % submission.id)
+		else:
+			yield submission
+
+#limit is the number of top posts to collect, and workers is the number of submissions to collect at the same time.
+#Submissions already in the index of collected submissions are skipped, unless recollect is True.  If resume is True, 
+#and a crawl of the top limit posts was stopped before it finished, we continue it into the same data file. See #FN:2#.
+def main(limit = 30, workers = 1, replay = None, latency = 0.05, index = 'collected.sqlite3', resume = True, recollect = False):
+
+	make_reddit, retry_on = make_client(replay, latency)
+	reddit = make_reddit()
+
+	#The listing and the collection of submissions share one budget. See #FN:1#.
+	limiter = RateLimiter(reserve = 2 * max(workers, 1))
+
+	#connect directly to the subreddit (this makes no request: the subreddit is only fetched when its listing is). 
 	subreddit = reddit.subreddit('changemyview')
 
-	#we will be appending the data of each disscussion/post to this list
-	list_of_posts = []
-	#these are the fields (or attributes) we can save to a json object and store in local memory
-	#ie. attibutes that are connections to more data in the APi need to be removed or transcribed into a string. 
-	fields = ('approved_at_utc','selftext','user_reports','saved',
-		'mod_reason_title','gilded','clicked','title','link_flair_richtext',
-		'subreddit_name_prefixed','hidden','pwls','link_flair_css_class',
-		'downs','parent_whitelist_status','hide_score','name','quarantine',
-		'link_flair_text_color','author_flair_background_color','subreddit_type',
-		'ups','domain','media_embed','author_flair_template_id','is_original_content',
-		'secure_media','is_reddit_media_domain','is_meta','category','secure_media_embed',
-		'link_flair_text','can_mod_post','score','approved_by','thumbnail','edited',
-		'author_flair_css_class','author_flair_richtext','content_categories','is_self',
-		'mod_note','created','link_flair_type','wls','banned_by','author_flair_type',
-		'contest_mode','selftext_html','likes','suggested_sort','banned_at_utc',
-		'view_count','archived','no_follow','is_crosspostable','pinned','over_18',
-		'media_only','link_flair_template_id','can_gild','spoiler','locked',
-		'author_flair_text','visited','num_reports','distinguished',
-		'subreddit_id','mod_reason_by','removal_reason','link_flair_background_color','id',
-		'report_reasons','author','num_crossposts','num_comments','send_replies','mod_reports',
-		'author_flair_text_color','permalink','whitelist_status','stickied','url','subreddit_subscribers',
-		'created_utc','media','is_video','_fetched','_info_params','comment_limit','comment_sort','_flair','_mod')
+	#the index of every submission we have collected. See collected_index.py.
+	index = CollectedIndex(index)
+	crawl = 'top:%d' % limit
+	checkpoint = index.get_checkpoint(crawl) if resume else None
+
+	#If the data file of the last crawl was moved or deleted, there is nothing to continue, so we start a new file. 
+	if checkpoint is not None and not os.path.isfile(checkpoint[0]):
+		print("Data file %s of crawl %s is gone, starting a new data file" % (checkpoint[0], crawl))
+		index.finish(crawl)
+		checkpoint = None
+
+	#If the last crawl stopped part way through, we continue writing to its data file. 
+	if checkpoint is not None:
+
+		output = checkpoint[0]
+
+		#a crash may have left a half written line at the end of the file, and discussions that were written 
+		#but not yet added to the index. 
+		truncate_partial_line(output)
+		written = [post['id'] for post in read_posts(output)]
+		index.add_many(written, output)
+
+		#the writer counts the discussions already in the file, so the checkpoint counts every discussion of the crawl. 
+		writer = JsonLinesWriter(output, 'a')
+		writer.count = len(written)
+		print("Resuming crawl %s into %s (%d discussions already collected)" % (crawl, output, writer.count))
+
+	else:
+
+		#we will save all of the discussion data to local memory, and time stamp the file for when we started collecting the data. 
+		stamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+
+		#we will be writing the data of each disscussion/post to this file in the data/ folder, one discussion per line, 
+		#as soon as it is collected. To get the legacy .json list format, run: python json_lines.py export <file.jsonl> <file.json>
+		output = 'data/'+ stamp +'_posts.jsonl'
+		writer = JsonLinesWriter(output)
+
+	index.checkpoint(crawl, output, writer.count)
 
 	#here we specify the type of post we want, the number of posts we want to collect, and then
 	#iterate over them... collecting the data we need
-	for submission in subreddit.top(limit = 30):
+	submissions = limited_listing(subreddit.top(limit = limit), limiter, reddit)
+	if not recollect:
+		submissions = not_collected(submissions, index)
 
+	#A submission of the listing fetches its comments when they are first read, which is one more request.
+	if workers <= 1:
+		collected = (limiter.call(lambda: collect_submission(submission, limiter, reddit), reddit) for submission in submissions)
 
-		print("Collecting data for %s" % submission.title[0:50])
-		#turn the Reddit Object returned by the api into a dictionary.  This makes it easy to work with and we don't need to make additional api calls to see attributes of the data. 
-		submission_dict = vars(submission)
+	#If we collect several submissions at the same time, we list the submissions as we go, and 
+	#the threads fetch each submission and its comments. 
+	else:
+		submission_ids = (submission.id for submission in submissions)
+		collected = collect_concurrently(submission_ids, make_reddit, workers, limiter, retry_on = retry_on)
 
-		#get the author of the discussion
-		author = submission_dict['author']
+	for data_dict in collected:
 
-		#if the author is None, then the discussion was deleted.  We will skip over collecting the data. 
-		if not(author == None):
-			
-			#create a dictionary of data that we wish to write to local memory
-			#Try and catch will continue on with the program if the Reddit API happens to not return one of our desired fields. 
-			try:
-			
-				data_dict = {field:submission_dict[field] for field in fields}
-			
-			except KeyError:
-			
-				continue
-
-			#replace the CommentForest object with a list of comment metadata dictionaries
-			data_dict['_comments'] = get_comments(submission, metadata = True)
-
-			#Replace the author Reddit object with the name of the author
-			data_dict['author'] = vars(data_dict['author'])['name']
-
-			#append our data for the given discussion to our list of discussions
-			list_of_posts.append(data_dict)
-		
-		#If the author is None, well, just print that we can't collect the data. 
-		if author == None:
-			print('Could not collect post data.')
+		#write our data for the given discussion to our file of discussions, and only then add it to the index
+		if data_dict is not None:
+			writer.write(data_dict)
+			index.add(data_dict['id'], output)
+			index.checkpoint(crawl, output, writer.count)
 	
-	#we will save all of the discussion data to local memory, and time stamp the file for when we collected the data. 
-	stamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-
-	#Write the data into the data/ folder. 
-	with open('data/'+ stamp +'_posts.json', 'w') as outfile:
-		json.dump(list_of_posts, outfile)
-		
-main()
\ No newline at end of file
+	writer.close()
+
+	#The crawl is finished, so there is nothing to resume. 
+	index.finish(crawl)
+	index.close()
+
+	print("Data succesfully written to file %s" % output)
+
+	return output
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(description = 'Collect Change My View discussions from the Reddit API.')
+	parser.add_argument('--limit', type = int, default = 30, 
+		help = 'number of top posts to collect (default: 30)')
+	parser.add_argument('--workers', type = int, default = 1, 
+		help = 'number of submissions to collect at the same time (default: 1)')
+	parser.add_argument('--replay', default = None, 
+		help = 'collect from a fake Reddit that serves the discussions in this data file')
+	parser.add_argument('--latency', type = float, default = 0.05, 
+		help = 'seconds each request to the fake Reddit takes (default: 0.05)')
+	parser.add_argument('--index', default = 'collected.sqlite3', 
+		help = 'index of the submissions already collected (default: collected.sqlite3)')
+	parser.add_argument('--no-resume', action = 'store_true', 
+		help = 'start a new data file, even if the last crawl was stopped part way through')
+	parser.add_argument('--recollect', action = 'store_true', 
+		help = 'collect submissions even if they are already in the index')
+	args = parser.parse_args()
+
+	main(limit = args.limit, workers = args.workers, replay = args.replay, latency = args.latency,
+		index = args.index, resume = not args.no_resume, recollect = args.recollect)
+
+
+"""                         ***FOOTNOTES***
+
+#FN:1#
+Most of the time spent collecting a discussion is spent waiting on Reddit,
+so we collect several discussions at once.  All of the threads share one
+RateLimiter, which holds them back when our rate-limit budget is almost
+spent, and with_retries waits longer and longer before trying a request
+that failed again.  Every request counts against the budget: each page of
+the listing of top posts, each submission, and each MoreComments object that
+is unpacked, since a large discussion takes many of them.  The threads finish in any order, but we hand on the discussions in the
+order of the listing, so the data file is written in the same order as a
+serial run.  Only a window of 2 * workers submissions is collected at a time,
+so memory stays bounded however many posts we collect, and a discussion that
+could not be collected is skipped (and left out of the index, so the next run
+collects it) instead of stopping the whole crawl.  To try this offline, collect from a data
+file we already have with --replay.
+
+#FN:2#
+Every submission we collect is added to an index (collected_index.py), but
+only after it is written to the data file, and the index keeps a checkpoint
+naming the data file the crawl is writing to.  If the crawl crashes, or is
+banned by the rate limit, running the collector again lists the same top
+posts, skips every submission in the index, and appends the rest to the
+data file of the stopped crawl.  A crash between writing a discussion and
+indexing it is caught on resume, since every discussion already in the data
+file is added to the index before we continue.
+"""
@@ -0,0 +1,125 @@
+"""
+Project Name: Attitude Change on Change My View (Study 2)
+Name: collected_index.py
+
+Description of this script:
+
+    A persistent index of the submissions we have already collected, shared
+    by the collectors of both studies (Study1/scripts/cmv_analysis.py and
+    Study2/collect_posts.py).
+
+    The index is a small SQLite database, so checking whether a submission
+    was collected is a single indexed lookup, and each submission is added in
+    its own transaction: if the collector crashes or is banned by the rate
+    limit, every submission added before the crash is still in the index,
+    and the index is never left half written.  It scales to millions of ids
+    without reading a text file into a list.
+
+    The index also keeps a checkpoint for each crawl (e.g., the top 1000
+    posts), recording the data file the crawl is writing to, so a crawl that
+    stopped can be resumed into the same file.
+
+    Submissions are indexed by their id (e.g., 96ffrx).  Names with the t3_
+    prefix that Reddit gives submissions (e.g., t3_96ffrx) are accepted too.
+
+Authors: J. Hunter Priniski & Zachary Horne
+"""
+
+#REQUIREMENTS
+import os
+import time
+import sqlite3
+
+#A submission's name is its id with the t3_ prefix. We index submissions by id.
+def submission_key(post_id):
+
+    if post_id.startswith('t3_'):
+        return post_id[3:]
+
+    return post_id
+
+class CollectedIndex:
+
+    def __init__(self, directory = 'collected.sqlite3'):
+
+        self.directory = directory
+        self.connection = sqlite3.connect(directory, check_same_thread = False)
+
+        #A write-ahead log keeps the index readable while we write to it, and safe if we crash mid-write.
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = FULL')
+
+        with self.connection:
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS collected
+                (id TEXT PRIMARY KEY, output TEXT, collected_utc REAL) WITHOUT ROWID''')
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS checkpoint
+                (crawl TEXT PRIMARY KEY, output TEXT, collected INTEGER, updated_utc REAL)''')
+
+    def __contains__(self, post_id):
+
+        row = self.connection.execute('SELECT 1 FROM collected WHERE id = ?', (submission_key(post_id),)).fetchone()
+        return row is not None
+
+    def __len__(self):
+
+        return self.connection.execute('SELECT COUNT(*) FROM collected').fetchone()[0]
+
+    #add records that a submission was collected (and the data file it was written to).
+    #Each submission is committed on its own, so it is on disk as soon as add returns.
+    def add(self, post_id, output = None):
+
+        with self.connection:
+            self.connection.execute('INSERT OR IGNORE INTO collected VALUES (?, ?, ?)',
+                (submission_key(post_id), output, time.time()))
+
+        return True
+
+    #add_many adds many submissions in a single transaction.
+    def add_many(self, post_ids, output = None):
+
+        now = time.time()
+
+        with self.connection:
+            self.connection.executemany('INSERT OR IGNORE INTO collected VALUES (?, ?, ?)',
+                ((submission_key(post_id), output, now) for post_id in post_ids))
+
+        return True
+
+    #import_text adds the ids in a text file with one id per line, like the collected_posts.txt
+    #file Study 1 used to keep. The file is read one line at a time.
+    def import_text(self, directory):
+
+        if not os.path.exists(directory):
+            return False
+
+        with open(directory, 'r') as text_file:
+            self.add_many(line.strip() for line in text_file if line.strip())
+
+        return True
+
+    #checkpoint records that the crawl named crawl is writing to the data file output,
+    #and has collected this many submissions so far.
+    def checkpoint(self, crawl, output, collected):
+
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO checkpoint VALUES (?, ?, ?, ?)',
+                (crawl, output, collected, time.time()))
+
+        return True
+
+    #get_checkpoint returns the (output, collected) of an unfinished crawl, or None.
+    def get_checkpoint(self, crawl):
+
+        return self.connection.execute('SELECT output, collected FROM checkpoint WHERE crawl = ?', (crawl,)).fetchone()
+
+    #finish removes the checkpoint of a crawl that collected everything it set out to.
+    def finish(self, crawl):
+
+        with self.connection:
+            self.connection.execute('DELETE FROM checkpoint WHERE crawl = ?', (crawl,))
+
+        return True
+
+    def close(self):
+
+        self.connection.close()
@@ -0,0 +1,453 @@
+"""
+Project Name: Attitude Change on Change My View (Study 2)
+Name: columnar.py
+
+Description of this script:
+
+    Export coded discussions (the output of discussion_analysis.py) to a
+    columnar store, and read the store back one column at a time.
+
+    Coded data is nested JSON: every comment has about 55 fields plus the
+    Delta, evidence_use, and links data, so any analysis has to load and walk
+    the whole dataset, even to compare a single column like score with
+    Delta.count.  The columnar store flattens the discussions into two tables,
+    posts and comments, where each field is stored as its own column:
+
+        - topic and evidence_use become a boolean column for each category
+          (e.g., evidence_use.stats.match) and a column of the terms matched
+          (e.g., evidence_use.stats.terms);
+        - Delta becomes Delta.count and Delta.from (a JSON string);
+        - links are kept with the normalized URL and the domain of each link
+          (links.url and links.domain, see link_extractor.py);
+        - lists of strings (links and the matched terms) and all strings are
+          dictionary encoded, so repeated values are stored once;
+        - every comment has a post_id column to join it to its post.
+
+    The tables are saved as Parquet files (posts.parquet and comments.parquet)
+    when pyarrow is installed, and as NumPy .npz files otherwise.  Either way,
+    a single column can be loaded without reading the rest of the table.
+
+    To export a coded data file, run:
+
+        python columnar.py data/coded/20180815182030_posts.json
+
+    which writes the tables to data/columnar/20180815182030_posts/.  Then, e.g.:
+
+        from columnar import read_column
+        scores = read_column('data/columnar/20180815182030_posts', 'comments', 'score')
+        deltas = read_column('data/columnar/20180815182030_posts', 'comments', 'Delta.count')
+
+Authors: J. Hunter Priniski & Zachary Horne
+"""
+
+#REQUIREMENTS
+import os
+import json
+import argparse
+from array import array
+
+import numpy as np
+
+from json_lines import read_posts
+from link_extractor import link_url, normalize_url, link_domain
+
+#pyarrow is optional. Without it, we save the tables as .npz files.
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+#The classification fields that are flattened into a match and a terms column per category.
+CLASSIFICATIONS = ('topic', 'evidence_use')
+
+#Fields of a post that are not columns of the posts table.
+POST_SKIP = ('_comments', '_tree')
+
+#A list of strings that is stored dictionary encoded, as a list column.
+class StringList(list):
+    pass
+
+#A matched term is a list of stemmed tokens. We store it as a single string.
+def term_string(term):
+
+    if isinstance(term, list):
+        return ' '.join(str(token) for token in term)
+
+    return str(term)
+
+#flatten turns a post or comment into a flat dictionary of column names and values.
+def flatten(record, skip = ()):
+
+    row = {}
+
+    for key, val in record.items():
+
+        if key in skip:
+            continue
+
+        if key in CLASSIFICATIONS and isinstance(val, dict):
+            for category, classification in val.items():
+                row[key + '.' + category + '.match'] = bool(classification['match'])
+                #Note that terms can be None (see classify_text), which we store as no terms.
+                row[key + '.' + category + '.terms'] = StringList(term_string(term) for term in (classification['terms'] or []))
+
+        elif key == 'Delta' and isinstance(val, dict):
+            row['Delta.count'] = val['count']
+            row['Delta.from'] = json.dumps(val['from'])
+
+        #The URL and domain of each link are kept alongside the links, for per-domain analysis.
+        elif key == 'links' and isinstance(val, list):
+            row['links'] = StringList(val)
+            urls = [link_url(link) for link in val]
+            row['links.url'] = StringList(normalize_url(url) for url in urls if url is not None)
+            row['links.domain'] = StringList(link_domain(url) for url in urls if url is not None)
+
+        #Other nested fields (e.g., author_flair_richtext) are stored as JSON strings.
+        elif isinstance(val, (dict, list)):
+            row[key] = json.dumps(val)
+
+        else:
+            row[key] = val
+
+    return row
+
+#In a .npz file, a list of strings is saved as one array of UTF-8 bytes and the offset of each string,
+#so the file can be loaded without pickle.
+def pack_strings(strings):
+
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype = np.int64)
+    offsets[1:] = np.cumsum([len(string) for string in encoded])
+
+    return np.frombuffer(b''.join(encoded), dtype = np.uint8), offsets
+
+def unpack_strings(data, offsets):
+
+    data = data.tobytes()
+    strings = np.empty(len(offsets) - 1, dtype = object)
+
+    for i in range(len(offsets) - 1):
+        strings[i] = data[offsets[i]:offsets[i + 1]].decode('utf-8')
+
+    return strings
+
+#PackedStrings is a list of strings saved with pack_strings, read one string at a time from a memory map
+#(e.g., an index file loaded with np.load(..., mmap_mode = 'r')).
+class PackedStrings:
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+"""
+column_kind decides how to store a column from the types of its values, and returns one of:
+    bool, int, float    a single NumPy array (None is stored as NaN in a float column)
+    string              codes (-1 for None) and the list of distinct strings, the vocabulary
+    string_list         offsets, codes, and vocabulary: the strings of row i are codes[offsets[i]:offsets[i+1]]
+"""
+def column_kind(types):
+
+    if StringList in types:
+        return 'string_list'
+
+    has_none = type(None) in types
+    types = types - set([type(None)])
+
+    if types == set([bool]) and not has_none:
+        return 'bool'
+
+    if types == set([int]) and not has_none:
+        return 'int'
+
+    if types and types <= set([int, float]):
+        return 'float'
+
+    #Anything else (strings, columns of mixed types, and columns that are always None) is stored as strings.
+    return 'string'
+
+#ColumnEncoder fills in the arrays of a column (see column_kind) one row at a time.
+class ColumnEncoder:
+
+    def __init__(self, kind, length):
+
+        self.kind = kind
+        self.vocabulary = {}
+
+        if kind == 'bool':
+            self.values = np.zeros(length, dtype = bool)
+        elif kind == 'int':
+            self.values = np.zeros(length, dtype = np.int64)
+        elif kind == 'float':
+            self.values = np.full(length, np.nan, dtype = np.float64)
+        elif kind == 'string':
+            self.codes = np.full(length, -1, dtype = np.int32)
+        else:
+            #The number of strings in the column isn't known until the end, so their codes are collected in an array.
+            self.counts = np.zeros(length, dtype = np.int64)
+            self.codes = array('i')
+
+    #code returns the code of a string, in the order the strings are first seen.
+    def code(self, val):
+        return self.vocabulary.setdefault(val, len(self.vocabulary))
+
+    def set(self, row, val):
+
+        if val is None:
+            return
+
+        if self.kind == 'string':
+            self.codes[row] = self.code(val if isinstance(val, str) else json.dumps(val))
+
+        elif self.kind == 'string_list':
+            self.codes.extend(self.code(string) for string in val)
+            self.counts[row] = len(val)
+
+        else:
+            self.values[row] = val
+
+    def finish(self):
+
+        if self.kind in ('bool', 'int', 'float'):
+            return self.kind, {'values':self.values}
+
+        if self.kind == 'string':
+            return self.kind, {'codes':self.codes, 'vocabulary':list(self.vocabulary)}
+
+        offsets = np.zeros(len(self.counts) + 1, dtype = np.int64)
+        offsets[1:] = np.cumsum(self.counts)
+
+        return self.kind, {'offsets':offsets, 'codes':np.array(self.codes, dtype = np.int32), 'vocabulary':list(self.vocabulary)}
+
+"""
+TableEncoder turns flat rows into columns in two passes over the rows, so the rows are never all held in
+memory: scan every row to find the columns and the types of their values, then add every row again, in
+the same order, to encode it, and finish returns the columns.  Rows without a column get None.
+"""
+class TableEncoder:
+
+    def __init__(self):
+
+        self.length = 0
+        self.types = {}
+        self.present = {}
+        self.columns = None
+        self.row = 0
+
+    def scan(self, row):
+
+        for key, val in row.items():
+            self.types.setdefault(key, set()).add(type(val))
+            self.present[key] = self.present.get(key, 0) + 1
+
+        self.length += 1
+
+    def add(self, row):
+
+        if self.columns is None:
+            for name, types in self.types.items():
+                if self.present[name] < self.length:
+                    types.add(type(None))
+            self.columns = {name:ColumnEncoder(column_kind(types), self.length) for name, types in self.types.items()}
+
+        for key, val in row.items():
+            self.columns[key].set(self.row, val)
+
+        self.row += 1
+
+    def finish(self):
+
+        if self.row != self.length:
+            raise ValueError('%d rows were scanned, but %d were added' % (self.length, self.row))
+
+        return {name:column.finish() for name, column in (self.columns or {}).items()}
+
+#make_table turns a list of flat rows into columns.
+def make_table(rows):
+
+    table = TableEncoder()
+
+    for row in rows:
+        table.scan(row)
+
+    for row in rows:
+        table.add(row)
+
+    return table.finish()
+
+#to_arrow turns an encoded column into a pyarrow array.
+def to_arrow(kind, arrays):
+
+    if kind in ('bool', 'int', 'float'):
+        return pyarrow.array(arrays['values'])
+
+    codes = pyarrow.array(arrays['codes'], mask = arrays['codes'] < 0)
+    dictionary = pyarrow.DictionaryArray.from_arrays(codes, pyarrow.array(arrays['vocabulary'], type = pyarrow.string()))
+
+    if kind == 'string':
+        return dictionary
+
+    return pyarrow.ListArray.from_arrays(pyarrow.array(arrays['offsets'], type = pyarrow.int32()), dictionary)
+
+#The file extensions of a table saved as Parquet, and as NumPy arrays.
+EXTENSIONS = ('.parquet', '.npz')
+
+#remove_table removes the files of a table, except the one with extension keep.
+def remove_table(directory, name, keep = None):
+
+    for extension in EXTENSIONS:
+        path = os.path.join(directory, name + extension)
+        if extension != keep and os.path.exists(path):
+            os.remove(path)
+
+#write_table saves a table as a .parquet file, or as a .npz file if we don't have pyarrow (or use_parquet is False).
+#A file of the table in the other format (e.g., from an export before pyarrow was installed) is removed, so it is never read instead.
+def write_table(table, directory, name, use_parquet = True):
+
+    if use_parquet and pyarrow is not None:
+
+        columns = {column:to_arrow(kind, arrays) for column, (kind, arrays) in table.items()}
+        pyarrow.parquet.write_table(pyarrow.table(columns), os.path.join(directory, name + '.parquet'))
+        remove_table(directory, name, keep = '.parquet')
+
+        return True
+
+    #In a .npz file, each array of a column is saved as <column>.<array>, and the kinds of the columns in __columns__.
+    saved = {'__columns__':np.array(json.dumps({column:kind for column, (kind, arrays) in table.items()}))}
+    for column, (kind, arrays) in table.items():
+        for key, val in arrays.items():
+            if key == 'vocabulary':
+                saved[column + '.vocabulary'], saved[column + '.vocabulary_offsets'] = pack_strings(val)
+            else:
+                saved[column + '.' + key] = val
+
+    np.savez(os.path.join(directory, name + '.npz'), **saved)
+    remove_table(directory, name, keep = '.npz')
+
+    return True
+
+#flat_rows lazily yields the table ('posts' or 'comments') and the flat row of every discussion and comment in a data file.
+def flat_rows(source):
+
+    for post in read_posts(source):
+
+        yield 'posts', flatten(post, POST_SKIP)
+
+        for comment in post['_comments']:
+            row = {'post_id':post['id']}
+            row.update(flatten(comment))
+            yield 'comments', row
+
+"""
+export_columnar flattens the coded discussions in a data file into a posts and a comments table, and saves
+them in the directory destination.  The data file is read twice (see TableEncoder), one discussion at a
+time, so only the encoded columns are held in memory, not every flattened row.
+"""
+def export_columnar(source, destination, use_parquet = True):
+
+    tables = {'posts':TableEncoder(), 'comments':TableEncoder()}
+
+    for table, row in flat_rows(source):
+        tables[table].scan(row)
+
+    for table, row in flat_rows(source):
+        tables[table].add(row)
+
+    os.makedirs(destination, exist_ok = True)
+
+    for name, table in tables.items():
+        write_table(table.finish(), destination, name, use_parquet)
+
+    return True
+
+#table_path returns the file a table was saved to. If the table was saved in both formats (by an older
+#version of columnar.py, which left the other file in place), the newer file is the table.
+def table_path(directory, table):
+
+    paths = [os.path.join(directory, table + extension) for extension in EXTENSIONS]
+    paths = [path for path in paths if os.path.exists(path)]
+
+    if not paths:
+        raise FileNotFoundError('no %s table in %s' % (table, directory))
+
+    return max(paths, key = os.path.getmtime)
+
+#list_columns returns the names of the columns in a table.
+def list_columns(directory, table):
+
+    path = table_path(directory, table)
+
+    if path.endswith('.parquet'):
+        return pyarrow.parquet.read_schema(path).names
+
+    with np.load(path) as saved:
+        return list(json.loads(str(saved['__columns__'])))
+
+#decode_strings turns codes back into strings, with None for -1.
+def decode_strings(codes, vocabulary):
+
+    strings = np.empty(len(codes), dtype = object)
+    present = codes >= 0
+    strings[present] = vocabulary[codes[present]]
+
+    return strings
+
+"""
+read_column loads a single column of a table ('posts' or 'comments').  Numbers and booleans are
+returned as NumPy arrays, strings as a NumPy array of objects (with None for missing values), and
+lists of strings (links and the matched terms) as a list of lists.
+"""
+def read_column(directory, table, name):
+
+    path = table_path(directory, table)
+
+    if path.endswith('.parquet'):
+
+        column = pyarrow.parquet.read_table(path, columns = [name]).column(name)
+
+        if pyarrow.types.is_list(column.type):
+            return column.to_pylist()
+
+        if pyarrow.types.is_dictionary(column.type):
+            return np.array(column.to_pylist(), dtype = object)
+
+        return column.to_numpy()
+
+    #np.load only reads the arrays we ask for from the .npz file.
+    with np.load(path) as saved:
+
+        kind = json.loads(str(saved['__columns__']))[name]
+
+        if kind in ('bool', 'int', 'float'):
+            return saved[name + '.values']
+
+        vocabulary = unpack_strings(saved[name + '.vocabulary'], saved[name + '.vocabulary_offsets'])
+        strings = decode_strings(saved[name + '.codes'], vocabulary)
+
+        if kind == 'string':
+            return strings
+
+        offsets = saved[name + '.offsets']
+        return [list(strings[offsets[i]:offsets[i + 1]]) for i in range(len(offsets) - 1)]
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Export coded discussions to a columnar store.')
+    parser.add_argument('source', help = 'a coded data file, e.g. data/coded/20180815182030_posts.json')
+    parser.add_argument('--destination', default = None,
+        help = 'directory to save the tables in (default: data/columnar/<name of the data file>)')
+    parser.add_argument('--npz', action = 'store_true', help = 'save .npz files even if pyarrow is installed')
+    args = parser.parse_args()
+
+    destination = args.destination
+    if destination is None:
+        destination = os.path.join('data', 'columnar', os.path.basename(args.source).split('.')[0])
+
+    export_columnar(args.source, destination, use_parquet = not args.npz)
+    print("Data succesfully written to directory %s" % destination)
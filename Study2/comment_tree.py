@@ -0,0 +1,149 @@
+"""
+Project Name: Attitude Change on Change My View (Study 2)
+Name: comment_tree.py
+
+Description of this script:
+
+    A compact representation of the tree of comments in a discussion.
+
+    The collector walks every discussion breadth first (top-level comments,
+    then their replies, then the replies to those, and so on).  While it
+    walks, build_tree numbers the comments in the order they are visited and
+    records three arrays:
+
+        parent[i]         the number of comment i's parent (-1 for a top-level comment)
+        depth[i]          how deep comment i is in the tree (0 for a top-level comment)
+        child_offsets[i]  where comment i's replies start
+
+    Because replies are visited right after each other, the replies of comment
+    i are exactly the comments numbered child_offsets[i] to child_offsets[i+1] - 1
+    (this is the compressed sparse row, or CSR, layout).  ids[i] is the Reddit
+    id of comment i.  The tree is saved with the discussion as post['_tree'],
+    so analysis code can find parents, walk threads, and compute subtree sizes
+    without rebuilding the tree from parent_id strings.
+
+    Note that the tree holds every comment in the discussion, including the
+    deleted and removed comments that are not saved in post['_comments'].
+
+Authors: J. Hunter Priniski & Zachary Horne
+"""
+
+#REQUIREMENTS
+from array import array
+from collections import deque
+
+"""
+build_tree walks a discussion breadth first, starting from its top-level comments.  replies(comment)
+returns the replies of a comment, and key(comment) its id.  It returns the comments in the order
+they were visited, and the tree of the discussion.  Every comment is visited once, so a discussion
+of n comments is walked in O(n) time.
+"""
+def build_tree(top_level, replies = lambda comment: comment.replies, key = lambda comment: comment.id):
+
+    comments = []
+    ids = []
+    parent = array('i')
+    depth = array('i')
+    child_offsets = array('i')
+
+    #The queue holds (comment, number of its parent, its depth).
+    queue = deque((comment, -1, 0) for comment in top_level)
+
+    #The replies of the first comment are numbered right after the top-level comments.
+    next_number = len(queue)
+
+    while queue:
+
+        comment, comment_parent, comment_depth = queue.popleft()
+        number = len(comments)
+
+        comments.append(comment)
+        ids.append(key(comment))
+        parent.append(comment_parent)
+        depth.append(comment_depth)
+        child_offsets.append(next_number)
+
+        for reply in replies(comment):
+            queue.append((reply, number, comment_depth + 1))
+            next_number += 1
+
+    child_offsets.append(next_number)
+
+    return comments, {'ids':ids, 'parent':parent, 'depth':depth, 'child_offsets':child_offsets}
+
+#tree_from_comments rebuilds the tree of a discussion saved without one, from each comment's parent_id.
+def tree_from_comments(comments):
+
+    children = {comment['name']:[] for comment in comments}
+    top_level = []
+
+    for comment in comments:
+        if comment['parent_id'] in children:
+            children[comment['parent_id']].append(comment)
+        else:
+            top_level.append(comment)
+
+    visited, tree = build_tree(top_level, replies = lambda comment: children[comment['name']], key = lambda comment: comment['id'])
+
+    return tree
+
+#to_json turns the arrays of a tree into lists, so the tree can be saved in a JSON file.
+def to_json(tree):
+
+    return {key:list(val) for key, val in tree.items()}
+
+#get_tree returns the tree saved with a discussion, or rebuilds it if the discussion has none.
+def get_tree(post):
+
+    if '_tree' in post:
+        return post['_tree']
+
+    return tree_from_comments(post['_comments'])
+
+#node_index maps the id of each comment to its number in the tree.
+def node_index(tree):
+
+    return {comment_id:number for number, comment_id in enumerate(tree['ids'])}
+
+#children returns the numbers of the replies to comment number.
+def children(tree, number):
+
+    offsets = tree['child_offsets']
+    return range(offsets[number], offsets[number + 1])
+
+#thread returns the numbers of the comments from comment number up to its top-level comment.
+def thread(tree, number):
+
+    parent = tree['parent']
+    path = [number]
+
+    while parent[number] >= 0:
+        number = parent[number]
+        path.append(number)
+
+    return path
+
+#subtree_sizes returns the number of comments in the subtree of every comment (counting the comment itself).
+#Replies are always numbered after their parent, so one pass from the last comment to the first is enough.
+def subtree_sizes(tree):
+
+    parent = tree['parent']
+    sizes = array('i', [1]) * len(parent)
+
+    for number in range(len(parent) - 1, -1, -1):
+        if parent[number] >= 0:
+            sizes[parent[number]] += sizes[number]
+
+    return sizes
+
+#descendants yields the numbers of every comment in the subtree below comment number, breadth first.
+def descendants(tree, number):
+
+    offsets = tree['child_offsets']
+    queue = deque([number])
+
+    while queue:
+        current = queue.popleft()
+        for child in range(offsets[current], offsets[current + 1]):
+            yield child
+            queue.append(child)
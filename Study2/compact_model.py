@@ -0,0 +1,415 @@
+"""
+Project Name: Attitude Change on Change My View (Study 2)
+Name: compact_model.py
+
+Description of this script:
+
+    Load discussions for analysis in a fraction of the memory that json.load
+    takes.  Loaded as JSON, every comment is a dictionary of about 55 fields,
+    and the same author, subreddit, and flair strings (and the same empty
+    lists and unmatched classifications) are stored again for every comment,
+    so a few million comments take tens of gigabytes.
+
+    load_posts reads a data file (coded or not, .json or .jsonl) one
+    discussion at a time and stores the comments of each discussion as a
+    CommentTable, a column for each field:
+
+        - a field with the same value in every comment (e.g., subreddit_id, or
+          the many fields that are always None) is stored once;
+        - whole numbers and decimal numbers (e.g., score, created_utc) are
+          stored in arrays, 1 to 8 bytes a comment;
+        - values that repeat (e.g., authors, flair, and empty lists) are
+          interned: each distinct value is stored once for the whole file, and
+          a comment only holds its code;
+        - strings that don't repeat (e.g., bodies and ids) are stored as one
+          block of UTF-8 per discussion, compressed with zlib, with the offset
+          of each string (a block is decompressed when it is read, and the
+          last few blocks read are kept decompressed);
+        - lists and dictionaries (e.g., Delta, evidence_use, links) are stored
+          as JSON strings (interned or not, as above), and decoded when they
+          are read.
+
+    Each comment is read through a Comment, which works like the comment's
+    dictionary: comment['body'], comment.get('Delta'), 'links' in comment,
+    comment.keys(), and comment['Delta'] = {...} all work, so award_deltas,
+    classify_text, and test.py take compact discussions as they are.  The
+    one difference: a list or dictionary loaded from the file is decoded anew
+    each time it is read, so changing it in place (e.g., comment['Delta']['count'] += 1)
+    only sticks if it was assigned first, as award_deltas does.  A post is
+    an ordinary dictionary whose _comments is a CommentTable.
+
+    Only some fields can be loaded, to save even more memory:
+
+        from compact_model import load_posts
+        posts = list(load_posts('data/coded/20180815182030_posts.json',
+            comment_fields = ('id', 'author', 'body', 'Delta', 'evidence_use')))
+
+    To measure the memory of loading a data file both ways, run:
+
+        python compact_model.py data/coded/20180815182030_posts.json
+
+Authors: J. Hunter Priniski & Zachary Horne
+"""
+
+#REQUIREMENTS
+import zlib
+import json
+import argparse
+import functools
+import tracemalloc
+from array import array
+
+from json_lines import read_posts
+
+#Marks a field a comment doesn't have.
+MISSING = object()
+
+#The kinds of column:
+#   CONSTANT    the same value in every row, stored once
+#   INTS        whole numbers, in an array of the smallest integers that hold them (see int_array)
+#   FLOATS      numbers with a decimal point, in an array of 8 byte floats
+#   CODES       values that repeat (e.g., authors, flair, None), as codes into the Interner's table
+#   TEXT        strings that don't repeat (e.g., bodies and ids), as one block of UTF-8 (compressed,
+#               if it is large enough to be worth it) and the offset of each string in the block
+#   VALUES      a Python list of values, once a column has been assigned to (see CommentTable.set)
+CONSTANT = 0
+INTS = 1
+FLOATS = 2
+CODES = 3
+TEXT = 4
+VALUES = 5
+
+#A block of text at least this long is compressed. Smaller blocks barely shrink.
+COMPRESS_SIZE = 256
+
+#The types of value that are stored as they are. Anything else (lists and dictionaries) is stored as JSON.
+SCALARS = (str, int, float, bool, type(None))
+
+"""
+An Interner numbers each distinct value, and keeps one copy of it in its table.  Strings are kept by value,
+and other values by type and value, so True, 1, and 1.0 stay different values.  One Interner is shared by
+every discussion of a file, so e.g. an author's name is stored once however many comments they wrote.
+"""
+class Interner:
+
+    def __init__(self):
+        self.table = [MISSING]
+        self.codes = {MISSING:0}
+
+    #code returns the number of a value in the table.
+    def code(self, value):
+
+        key = value if type(value) is str or value is MISSING else (type(value), value)
+        code = self.codes.get(key)
+
+        if code is None:
+            code = self.codes[key] = len(self.table)
+            self.table.append(value)
+
+        return code
+
+    #Calling the Interner returns its copy of a value.
+    def __call__(self, value):
+        return self.table[self.code(value)]
+
+def encode(value):
+    return json.dumps(value, separators = (',', ':'))
+
+#int_array stores whole numbers in an array of the smallest integers (1, 2, 4, or 8 bytes) that hold all of them.
+def int_array(values):
+
+    low, high = min(values, default = 0), max(values, default = 0)
+
+    for typecode in ('b', 'h', 'i', 'q'):
+        limit = 1 << (8 * array(typecode).itemsize - 1)
+        if -limit <= low and high < limit:
+            return array(typecode, values)
+
+    raise OverflowError('integers too large for an array')
+
+#pack_text stores strings as one block of UTF-8, and the offset of each string in the block.
+#A large block is compressed, and returned with compressed set to True.
+def pack_text(strings):
+
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = [0]
+
+    for string in encoded:
+        offsets.append(offsets[-1] + len(string))
+
+    block = b''.join(encoded)
+    compressed = len(block) >= COMPRESS_SIZE
+
+    if compressed:
+        block = zlib.compress(block)
+
+    return block, int_array(offsets), compressed
+
+#inflate returns a compressed block of text. Comments are mostly read one after another, so the last
+#few blocks are kept decompressed, and reading a column row by row decompresses its block once.
+@functools.lru_cache(maxsize = 16)
+def inflate(block):
+    return zlib.decompress(block)
+
+#make_column stores a value per row as compactly as it can, and returns the kind of the column, its data,
+#and whether its values are JSON (lists and dictionaries) that is decoded when it is read.
+def make_column(values, intern):
+
+    first = values[0]
+
+    if isinstance(first, SCALARS) and all(type(value) is type(first) and value == first for value in values):
+        return CONSTANT, intern(first), False
+
+    types = set(map(type, values))
+
+    if types == {int}:
+        try:
+            return INTS, int_array(values), False
+        except OverflowError:
+            pass
+
+    if types == {float}:
+        return FLOATS, array('d', values), False
+
+    encoded = not all(value is MISSING or isinstance(value, SCALARS) for value in values)
+    if encoded:
+        values = [value if value is MISSING else encode(value) for value in values]
+
+    #Strings that mostly differ from row to row are cheaper as text than as codes into the table.
+    if all(type(value) is str for value in values) and len(set(values)) > len(values) // 2:
+        return TEXT, pack_text(values), encoded
+
+    return CODES, int_array([intern.code(value) for value in values]), encoded
+
+"""
+A CommentTable holds the comments of a discussion, a column per field (see make_column).  comments is a
+list of comment dictionaries; if fields is given, only those fields are kept.
+"""
+class CommentTable:
+
+    __slots__ = ('length', 'fields', 'kinds', 'columns', 'encoded', 'table')
+
+    def __init__(self, comments, intern, fields = None):
+
+        self.length = len(comments)
+        self.fields = []
+        self.kinds = {}
+        self.columns = {}
+        self.encoded = set()
+        self.table = intern.table
+
+        if fields is None:
+            fields = {}
+            for comment in comments:
+                fields.update(dict.fromkeys(comment))
+
+        for field in fields:
+
+            values = [comment.get(field, MISSING) for comment in comments]
+
+            if not values or all(value is MISSING for value in values):
+                continue
+
+            field = intern(field)
+            self.fields.append(field)
+            self.kinds[field], self.columns[field], encoded = make_column(values, intern)
+
+            if encoded:
+                self.encoded.add(field)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, row):
+
+        if isinstance(row, slice):
+            return [Comment(self, i) for i in range(*row.indices(self.length))]
+
+        if row < 0:
+            row += self.length
+
+        if not 0 <= row < self.length:
+            raise IndexError('comment index out of range')
+
+        return Comment(self, row)
+
+    def __iter__(self):
+        for row in range(self.length):
+            yield Comment(self, row)
+
+    def get(self, row, field):
+
+        kind = self.kinds.get(field)
+
+        if kind is None:
+            return MISSING
+
+        column = self.columns[field]
+
+        if kind == CONSTANT:
+            return column
+
+        if kind == CODES:
+            value = self.table[column[row]]
+        elif kind == TEXT:
+            block, offsets, compressed = column
+            if compressed:
+                block = inflate(block)
+            value = block[offsets[row]:offsets[row + 1]].decode('utf-8')
+        else:
+            return column[row]
+
+        if field in self.encoded and value is not MISSING:
+            return json.loads(value)
+
+        return value
+
+    #set stores a value in one row. The column then holds values as they are, so a list or dictionary that
+    #is assigned is stored itself (not as JSON), and changing it in place changes the comment.
+    def set(self, row, field, value):
+
+        kind = self.kinds.get(field)
+
+        if kind is None:
+            self.fields.append(field)
+            self.columns[field] = [MISSING] * self.length
+
+        elif kind != VALUES:
+            self.columns[field] = [self.get(i, field) for i in range(self.length)]
+            self.encoded.discard(field)
+
+        self.kinds[field] = VALUES
+        self.columns[field][row] = value
+
+    #to_list returns the comments as ordinary dictionaries.
+    def to_list(self):
+        return [comment.to_dict() for comment in self]
+
+"""
+A Comment is one row of a CommentTable, read like the comment's dictionary.  It only holds its table and
+its row, so Comments are made when they are needed and cost almost nothing.
+"""
+class Comment:
+
+    __slots__ = ('table', 'row')
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    def __getitem__(self, field):
+
+        value = self.table.get(self.row, field)
+
+        if value is MISSING:
+            raise KeyError(field)
+
+        return value
+
+    def __setitem__(self, field, value):
+        self.table.set(self.row, field, value)
+
+    def get(self, field, default = None):
+
+        value = self.table.get(self.row, field)
+        return default if value is MISSING else value
+
+    def __contains__(self, field):
+        return self.table.get(self.row, field) is not MISSING
+
+    def keys(self):
+        return [field for field in self.table.fields if field in self]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def values(self):
+        return [self[field] for field in self.keys()]
+
+    def items(self):
+        return [(field, self[field]) for field in self.keys()]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+
+        if isinstance(other, Comment):
+            other = other.to_dict()
+
+        return self.to_dict() == other
+
+    def __repr__(self):
+        return 'Comment(%r)' % self.to_dict()
+
+#compact_post stores a discussion compactly: its comments in a CommentTable and its other fields interned.
+def compact_post(post, intern, fields = None, comment_fields = None):
+
+    compact = {}
+
+    for field, value in post.items():
+
+        if field == '_comments':
+            compact[field] = CommentTable(value, intern, comment_fields)
+
+        elif fields is None or field in fields:
+            compact[intern(field)] = intern(value) if isinstance(value, SCALARS) else value
+
+    return compact
+
+"""
+load_posts lazily yields the discussions in a data file, stored compactly (see compact_post).  If fields
+or comment_fields is given, only those fields of each discussion or comment are loaded.  Only one
+discussion is held as JSON at a time.
+"""
+def load_posts(directory, fields = None, comment_fields = None):
+
+    intern = Interner()
+
+    for post in read_posts(directory):
+        yield compact_post(post, intern, fields, comment_fields)
+
+#to_json returns a compact discussion as ordinary dictionaries, e.g. to write it with json.dump.
+def to_json(post):
+
+    data = dict(post)
+
+    if isinstance(data.get('_comments'), CommentTable):
+        data['_comments'] = data['_comments'].to_list()
+
+    return data
+
+#measure returns the memory (in bytes) held after loading a data file as JSON, and compactly.
+def measure(directory, fields = None, comment_fields = None):
+
+    sizes = {}
+
+    for name, load in (('json', lambda: list(read_posts(directory))),
+                       ('compact', lambda: list(load_posts(directory, fields, comment_fields)))):
+
+        tracemalloc.start()
+        posts = load()
+        sizes[name] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        del posts
+
+    sizes['comments'] = sum(len(post['_comments']) for post in read_posts(directory))
+
+    return sizes
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Measure the memory of loading a data file as JSON and compactly.')
+    parser.add_argument('source', help = 'a data file, e.g. data/coded/20180815182030_posts.json')
+    parser.add_argument('--comment-fields', nargs = '+', default = None, help = 'only load these fields of each comment')
+    args = parser.parse_args()
+
+    sizes = measure(args.source, comment_fields = args.comment_fields)
+    print('%d comments' % sizes['comments'])
+    for name in ('json', 'compact'):
+        print('%-8s %10.1f MB %8.0f bytes per comment' % (name, sizes[name] / 1e6, sizes[name] / max(sizes['comments'], 1)))
+    print('%.1fx less memory' % (sizes['json'] / max(sizes['compact'], 1)))
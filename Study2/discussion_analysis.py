@@ -32,21 +32,44 @@ footnote in the list.
 
 #REQUIREMENTS
 import os
-import praw
 import re
-import nltk
 import json
 import itertools
 import string
-from bs4 import BeautifulSoup
+import argparse
+import hashlib
+import collections
+import multiprocessing
 
 #Multiple methods requires word stemming, so we will declare it right away. 
-from nltk.stem.snowball import SnowballStemmer
-stemmer = SnowballStemmer('english')
+#The stemmer remembers the stems of words it has already seen. See stem_cache.py.
+#It is our usual SnowballStemmer, which is only made (and NLTK only imported) once it is needed. See #FN:12#.
+from stem_cache import CachedStemmer
+stemmer = CachedStemmer()
+
+#Stems are saved to this file at the end of a run, and used to warm the stemmer on the next run. 
+STEM_CACHE = 'stem_cache.json'
+
+#Discussions can also be saved one per line in the JSON Lines format. See json_lines.py.
+from json_lines import read_posts, JsonLinesWriter, truncate_partial_line
+
+#Datasets can also be saved as compressed shards, with an index of the discussions. See sharded.py.
+from sharded import is_sharded, read_meta, ShardWriter
+from link_extractor import extract_links
+
+#The compiled term lists are saved between runs. See lexicon_cache.py.
+import lexicon_cache
+
+#Each stage of coding can be timed and measured. See instrumentation.py and #FN:10#.
+from instrumentation import instruments, summary
 
 #We save Reddit discussions as JSON objects. json_reader and json_writer are
 #two functions making it easier to work with the data strucutre.  
 def json_reader(directory):
+
+    #A sharded dataset (see sharded.py) is read one discussion at a time, as a list of the same discussions.
+    if is_sharded(directory):
+        return list(read_posts(directory))
     
     with open(directory, 'r') as json_file:
 
@@ -64,20 +87,42 @@ def json_writer(directory, data):
 
 """
 THE FOLLOWING METHODS 
+    index_comments()
     get_parent()
     get_delta_awards() 
     award_deltas()
+    award_all_deltas()
 
 ARE USED TO DENOTE THE NUMBER OF DELTAS AWARDED TO EACH COMMENT. 
 
+index_comments maps the name of every comment in a discussion (e.g., t1_e4b2x9q) to the comment itself.
+Building this index once per discussion lets us find the parent of any comment with a single 
+dictionary lookup, instead of walking the full list of comments every time. 
+"""
+def index_comments(comments):
+
+    index = {}
+
+    for comment in comments:
+        #If two comments share a name, keep the first one (this is what get_parent used to return).
+        index.setdefault(comment['name'], comment)
+
+    return index
+
+"""
 get_parent will return the parent comment's metadata of a given comment
 comments is the list of comments in a discussion, and current is the comment for which 
-you wish to find the parent"""
-def get_parent(comments, current):
+you wish to find the parent. If an index made by index_comments is passed, the parent is 
+looked up in the index rather than searched for in the list of comments."""
+def get_parent(comments, current, index = None):
     
     #parent_id is an attribute returned by the Reddit API.  So we first save this id to a new variable
     parent_id = current['parent_id']
 
+    #If we have an index of the discussion, the parent is a single lookup away. 
+    if index is not None:
+        return index.get(parent_id)
+
     #We iterate over all the comments in the discussion
     for comment in comments:
 
@@ -122,10 +167,14 @@ def get_delta_awards(comments, as_id = False):
 """
 This method sets the comment's data to the number of deltas it recieved 
 and provides the info on the user who awarded the delta along with that user's reason for awarding that delta. 
+It returns the number of deltas it could attribute to a comment in the discussion. See #FN:6# for
+how the chain DeltaBot -> !delta -> DAC is resolved. 
 """
-def award_deltas(comments):
+def award_deltas(comments, index = None):
 
-    delta_awards = get_delta_awards(comments, as_id = True)
+    #Index the discussion once, so every parent lookup below is a dictionary lookup. 
+    if index is None:
+        index = index_comments(comments)
 
     #Iterate over each comment
     for comment in comments:
@@ -143,32 +192,50 @@ def award_deltas(comments):
         #Put the emtpy delta data dictionary into each commnent's metadata. 
         comment['Delta'] = delta
 
-    #Iterate over comments again. 
-    for comment in comments:    
-        #If the comment was awarded a delta, then we will update the relevant Delta data. 
-        if comment['id'] in delta_awards:
+    awarded = 0
 
-            #The comment where the delta is signified (that is, a user says "!delta")
-            #is the parent of the DeltaBot's awarding of a Delta.  
-            delta_sig = get_parent(comments, comment)
+    #Iterate over the DeltaBot confirmations, in the order they appear in the discussion. 
+    for comment in get_delta_awards(comments):
 
-            #If the comment has no parent, there is nothing we can do. So we will just return.
-            if delta_sig is None:
-                return
-            
-            #the parent of the delta_sig reply is the DAC. so we will get the parent of the 
-            #delta sig comment
-            dac = get_parent(comments, delta_sig)
+        #The comment where the delta is signified (that is, a user says "!delta")
+        #is the parent of the DeltaBot's awarding of a Delta.  
+        delta_sig = get_parent(comments, comment, index)
 
-            #If the comment has no parent, there is nothing we can do. So we will just return. 
-            if dac is None:
-                return
+        #If the comment has no parent, there is nothing we can do for this delta. 
+        #We skip it and move on to the rest of the discussion. 
+        if delta_sig is None:
+            continue
+        
+        #the parent of the delta_sig reply is the DAC. so we will get the parent of the 
+        #delta sig comment
+        dac = get_parent(comments, delta_sig, index)
+
+        #If the comment has no parent, there is nothing we can do for this delta either. 
+        if dac is None:
+            continue
+
+        #We will update the delta count for this comment by 1. 
+        dac['Delta']['count'] += 1
 
-            #We will update the delta count for this comment by 1. 
-            dac['Delta']['count'] += 1
+        #We will add the author and reason to the Delta's 'from' data. 
+        dac['Delta']['from'].update({delta_sig['author']:delta_sig['body']})
 
-            #We will add the author and reason to the Delta's 'from' data. 
-            dac['Delta']['from'].update({delta_sig['author']:delta_sig['body']})
+        awarded += 1
+
+    return awarded
+
+"""
+award_all_deltas awards the deltas in every discussion of a dataset (e.g., every post in a 
+data/*.json file) in one pass, and returns the total number of deltas awarded. 
+"""
+def award_all_deltas(posts):
+
+    awarded = 0
+
+    for post in posts:
+        awarded += award_deltas(post['_comments'])
+
+    return awarded
 
 """
 THE FOLLOWING METHODS
@@ -177,6 +244,8 @@ THE FOLLOWING METHODS
     prepare
     get_ngrams
     match
+    compile_terms
+    match_compiled
     classify_text
 
 ARE USED TO PREPARE THE TEXT OF POST AND COMMENT FOR TEXTUAL ANALYSIS
@@ -336,17 +405,93 @@ def match(text, terms):
     
     return len(matches) > 0, matches
 
+"""
+compile_terms builds one matcher for every category of terms we classify text with (for example,
+the topics and the evidence language together). The matcher is a trie over stemmed tokens: each
+token of a phrase is one level of nested dictionaries, and the node where a phrase ends records
+the categories (and the position in each category's term list) the phrase belongs to. 
+See #FN:7# for why this is faster than match. 
+"""
+def compile_terms(*categories):
+
+    #The root of the trie. The key None marks the end of a phrase, since tokens are always strings.
+    trie = {}
+
+    #We keep each category's list of terms so that matches are returned as the same term lists
+    #that read_terms made (and that match returns). 
+    terms = {}
+
+    for category_terms in categories:
+        for key, val in category_terms.items():
+            terms[key] = val
+
+            #Add each phrase in the category to the trie, one token at a time. 
+            for position, term in enumerate(val):
+
+                #An empty line in a term file is never matched by match, so we skip it here too. 
+                if len(term) == 0:
+                    continue
+
+                node = trie
+                for token in term:
+                    node = node.setdefault(token, {})
+
+                node.setdefault(None, []).append((key, position))
+
+    return {'trie':trie, 'terms':terms}
+
+"""
+match_compiled finds every phrase of every category in a single left-to-right pass over the 
+tokens of a prepared text. It returns a dictionary that maps each category to the same 
+(bool, matches) pair that match returns for that category. 
+"""
+def match_compiled(text, matcher):
+
+    trie = matcher['trie']
+    terms = matcher['terms']
+
+    #The positions (in the category's list of terms) of the terms found in the text
+    found = {key:set() for key in terms}
+
+    for start in range(len(text)):
+
+        #Walk down the trie as long as the following tokens continue a phrase. 
+        node = trie
+        for i in range(start, len(text)):
+            node = node.get(text[i])
+            if node is None:
+                break
+            for key, position in node.get(None, ()):
+                found[key].add(position)
+
+    matches = {}
+    for key, positions in found.items():
+        val = terms[key]
+        #match returns the shortest phrases first, and phrases of the same length in the 
+        #order of the term list, so we sort our matches the same way. 
+        ordered = sorted(positions, key = lambda position: (len(val[position]), position))
+        matches[key] = (len(ordered) > 0, [val[position] for position in ordered])
+
+    return matches
+
 """
 classify_text will classify a piece of text (in our case a discussion title and selftext or the body of a comment)
 and return the topics that the piece of text relates to. 
 """
-def classify_text(text, topics):
+def classify_text(text, topics, matcher = None):
     
     #Create a empty dictionary, we will add our classifications to this dictionary as we iterate over every topic
     classifications = {} 
 
     #Prepare the text (i.e., remove whitespace, puncuation, stem, and tokenize)
-    prepared_text = prepare(text)
+    with instruments.stage('prepare'):
+        prepared_text = prepare(text)
+
+    #If we have a compiled matcher (see compile_terms), we find the matches for every category in one pass. 
+    compiled = {}
+    if matcher is not None:
+        with instruments.stage('match'):
+            compiled = match_compiled(prepared_text, matcher)
     
     #We will iterate the dictionary of topics. That is, iterate each topic, then iterate over each word in the topic list. 
     
@@ -354,7 +499,11 @@ def classify_text(text, topics):
 
         #See if there is a match with the prepared text and any of the words in the topic list. 
         #text_match is boolean value
-        text_match, matches = match(prepared_text, val)
+        if key in compiled and (matcher['terms'][key] is val or matcher['terms'][key] == val):
+            text_match, matches = compiled[key]
+        else:
+            with instruments.stage('match'):
+                text_match, matches = match(prepared_text, val)
 
         #If there is a match with the text and one of the values in the list
         #of terms associated with a topic, we will set the topic value equal to 1.
@@ -375,43 +524,459 @@ def classify_text(text, topics):
     #We will return out list of topic classifications for the given text. 
     return classifications
 
+#get_links saves the links in each comment's body_html as comment['links']. The links are the same ones
+#BeautifulSoup finds, but most comments are scanned with a precompiled pattern instead. See link_extractor.py.
 def get_links(comments):
 
-    for comment in comments:
-        html_doc = comment['body_html']
-        soup = BeautifulSoup(html_doc, 'html.parser')
-        link_list_tag = soup.findAll('a', attrs={'href': re.compile("^https?://")})
-        link_list_str = []
+    with instruments.stage('get_links', len(comments)):
+        for comment in comments:
+            comment['links'] = extract_links(comment['body_html'])
+
+"""
+THE FOLLOWING METHODS
+    load_lexicons
+    code_post
+    code_posts
+
+ARE USED TO CODE DISCUSSIONS, EITHER ONE AFTER ANOTHER OR SPREAD ACROSS A POOL OF PROCESSES. 
+
+load_lexicons reads in our topics and evidence language, and compiles them into a single matcher
+(or loads them, already compiled, from the last run).
+"""
+#Our topics and the files their terms are read from. See #FN4# for details. 
+TOPICS = {
+    'gender' : 'topics/gender.txt',
+    'hot_topics' : 'topics/hot_topics.txt',
+    'lgbt' : 'topics/lgbt.txt',
+    'moral' : 'topics/moral.txt',
+    'politics' : 'topics/politics.txt',
+    'race' : 'topics/race.txt',
+    'religion' : 'topics/religion.txt'
+}
+
+#Our evidence language and the files its terms are read from. See #FN5# for details.
+EVIDENCE = {
+    'data' : 'evidence-language/data.txt',
+    'economics' : 'evidence-language/economics.txt',
+    'evidence' : 'evidence-language/evidence.txt',
+    'numbers' : 'evidence-language/numbers.txt',
+    'stats' : 'evidence-language/stats.txt',
+    'values' : 'evidence-language/values.txt',
+    'explanations': 'evidence-language/explanatory.txt'
+}
+
+#The compiled lexicons are saved to this file, and loaded from it while the term lists are unchanged. See #FN:11#.
+LEXICON_CACHE = 'lexicons.cache'
+
+def load_lexicons(cache = LEXICON_CACHE):
+
+    #If no term list (and not the stemmer) changed since the lexicons were saved, we load the saved lexicons. 
+    if cache is not None:
+        key = lexicon_version()
+        lexicons = lexicon_cache.load(cache, key)
+        if lexicons is not None:
+            return lexicons
+
+    #Load in our topics. 
+    topics = {key:read_terms(directory) for key, directory in TOPICS.items()}
+
+    #Load in our evidence language.
+    evidence = {key:read_terms(directory) for key, directory in EVIDENCE.items()}
+
+    #Compile the topics and the evidence language into a single matcher. See #FN:7#.
+    matcher = compile_terms(topics, evidence)
+
+    #Save the lexicons for the next run (and for our worker processes). If we can't, we just compile them again next time. 
+    if cache is not None:
+        try:
+            lexicon_cache.save(cache, key, (topics, evidence, matcher))
+        except OSError:
+            pass
+
+    return topics, evidence, matcher
+
+"""
+code_post classifies a discussion's topic, finds the links in its comments, awards its deltas, 
+and classifies the evidence use of every comment. 
+"""
+def code_post(post, lexicons):
+
+    topics, evidence, matcher = lexicons
+
+    #We will classify each discussion with respect to the title and selftext.
+    #Therefore, we will concatenate these two strings for classification.
+    title = post['title']
+    body = post['selftext']
+    
+    #Firstly, we will classify each post with respect to the topic. 
+    #The topic attribute in the post JSON object will denote what the discussion's classification is. 
+    post['topic'] = classify_text(title + ' ' + body, topics, matcher)
+    
+    get_links(post['_comments'])
+
+    #Secondly, we will first denote how many deltas each comment recieved
+    with instruments.stage('award_deltas', len(post['_comments'])):
+        award_deltas(post['_comments'])
+
+    #Thirdly, we will calculate use of evidence
+    #Pull out all of the comments in the discussion. 
+    post_comments = post['_comments']
+
+    #Iterate over every comment in the list of comments. 
+    for comment in post_comments:
+
+        #Create an atribute in the comment JSON obbject that specifies the types of evidence used in the comment body.
+        comment['evidence_use'] = classify_text(comment['body'], evidence, matcher)
+
+    return post
+
+#Each worker process in the pool loads its own copy of the lexicons once, when the worker starts. 
+worker_lexicons = None
+
+def init_worker():
+
+    global worker_lexicons
+
+    #A forked worker must not measure its stages into a copy of the parent's instruments. 
+    instruments.disable()
+
+    stemmer.load(STEM_CACHE)
+    worker_lexicons = load_lexicons()
+
+#code_chunk is run by a worker process.  It finds the links and evidence use of a chunk of comments, 
+#passed as (body, body_html) pairs, and returns a (links, evidence_use) pair for each comment. 
+def code_chunk(chunk):
+
+    topics, evidence, matcher = worker_lexicons
+
+    comments = [{'body_html':body_html} for body, body_html in chunk]
+    get_links(comments)
+
+    return [(comment['links'], classify_text(body, evidence, matcher)) for comment, (body, body_html) in zip(comments, chunk)]
+
+#finish_post puts the results of a post's chunks back into the post, in the same order code_post would. 
+#The stages the workers run are not measured; the time spent waiting for them is measured as pool_wait. 
+def finish_post(post, chunks, lexicons):
+
+    topics, evidence, matcher = lexicons
+
+    with instruments.post(post['id'], len(post['_comments'])):
+
+        post['topic'] = classify_text(post['title'] + ' ' + post['selftext'], topics, matcher)
 
-        for link in link_list_tag:
-            link_list_str.append(str(link))
+        with instruments.stage('pool_wait', len(post['_comments'])):
+            results = [result for chunk in chunks for result in chunk.get()]
 
-        comment['links'] = link_list_str
+        for comment, (links, evidence_use) in zip(post['_comments'], results):
+            comment['links'] = links
+
+        with instruments.stage('award_deltas', len(post['_comments'])):
+            award_deltas(post['_comments'])
+
+        for comment, (links, evidence_use) in zip(post['_comments'], results):
+            comment['evidence_use'] = evidence_use
+
+    return post
+
+"""
+code_posts codes every discussion in posts, and yields the coded discussions in the same order. 
+If a pool of worker processes is given (see init_worker), the comments of each discussion are 
+sent to the pool in chunks of chunk_size comments, so both many small discussions and a few 
+very large ones are spread across the workers. At most max_in_flight chunks are waiting in the 
+pool at any time. See #FN:8#.
+
+If reuse is given, it is called with each discussion before it is coded.  If it returns True, 
+the discussion already holds its coding (see copy_coding) and is yielded without being coded again. 
+"""
+def code_posts(posts, lexicons, pool = None, chunk_size = 500, max_in_flight = 64, reuse = None):
+
+    if pool is None:
+        for post in posts:
+            if reuse is not None and reuse(post):
+                yield post
+            else:
+                with instruments.post(post['id'], len(post['_comments'])):
+                    post = code_post(post, lexicons)
+                yield post
+        return
+
+    #The posts we have sent to the pool, in order, with their chunks of comments. 
+    pending = collections.deque()
+    in_flight = 0
+
+    for post in posts:
+
+        #A reused discussion has nothing to send to the pool, but it still waits its turn in pending. 
+        if reuse is not None and reuse(post):
+            pending.append((post, None))
+            continue
+
+        comments = post['_comments']
+        chunks = []
+        for i in range(0, len(comments), chunk_size):
+            chunk = [(comment['body'], comment['body_html']) for comment in comments[i:i + chunk_size]]
+            chunks.append(pool.apply_async(code_chunk, (chunk,)))
+
+        pending.append((post, chunks))
+        in_flight += len(chunks)
+
+        #We only keep max_in_flight chunks in the pool, so we never hold the whole dataset in memory. 
+        while len(pending) > 1 and in_flight > max_in_flight:
+            post, chunks = pending.popleft()
+            if chunks is None:
+                yield post
+            else:
+                in_flight -= len(chunks)
+                yield finish_post(post, chunks, lexicons)
+
+    while pending:
+        post, chunks = pending.popleft()
+        if chunks is None:
+            yield post
+        else:
+            yield finish_post(post, chunks, lexicons)
+
+"""
+THE FOLLOWING METHODS
+    lexicon_version
+    post_hash
+    read_manifest
+    read_coding
+    copy_coding
+    code_file
+
+ARE USED TO CODE A DATA FILE INCREMENTALLY: ONLY DISCUSSIONS THAT CHANGED SINCE THE LAST RUN 
+ARE CODED AGAIN, AND A RUN THAT WAS KILLED PICKS UP WHERE IT STOPPED.  SEE #FN:9#.
+
+lexicon_version returns a hash of every term list we code with (and of the stemmer), so that 
+editing a term list invalidates every coding made with the old list. 
+"""
+def lexicon_version():
+
+    digest = hashlib.sha256(stemmer.version().encode())
+
+    for directory in sorted(list(TOPICS.values()) + list(EVIDENCE.values())):
+        with open(directory, 'rb') as text_file:
+            digest.update(directory.encode())
+            digest.update(text_file.read())
+
+    return digest.hexdigest()
+
+#post_hash returns a hash of everything the coding of a discussion depends on: its title and 
+#selftext, the text and place in the discussion of every comment, and the term lists. 
+def post_hash(post, version):
+
+    content = [post['title'], post['selftext'], 
+        [[comment['id'], comment['name'], comment['parent_id'], comment['author'], comment['body'], comment['body_html']]
+            for comment in post['_comments']]]
+
+    digest = hashlib.sha256(version.encode())
+    digest.update(json.dumps(content).encode())
+
+    return digest.hexdigest()
+
+#The stamp of a data file lets us skip a file that has not changed without reading it. 
+def file_stamp(directory, version):
+
+    #A sharded dataset is written all at once, and its description is written last. 
+    if is_sharded(directory):
+        directory = os.path.join(directory, 'shards.json')
+
+    info = os.stat(directory)
+    return {'size':info.st_size, 'mtime':info.st_mtime, 'lexicons':version}
+
+#read_manifest reads the hashes of the discussions coded in previous runs, and the stamp of 
+#the data file when it was last coded completely (or None if it never was).
+def read_manifest(directory):
+
+    hashes = {}
+    stamp = None
+
+    if not os.path.exists(directory):
+        return hashes, stamp
+
+    for entry in read_posts(directory):
+        if 'file' in entry:
+            stamp = entry['file']
+        else:
+            hashes[entry['id']] = entry['hash']
+
+    return hashes, stamp
+
+#read_coding reads the coding of every discussion in a coded data file: the topic of the
+#discussion and the links, Delta, and evidence_use of each comment. 
+def read_coding(directory):
+
+    coding = {}
+
+    for post in read_posts(directory):
+        coding[post['id']] = (post['topic'], 
+            [(comment['links'], comment['Delta'], comment['evidence_use']) for comment in post['_comments']])
+
+    return coding
+
+#copy_coding puts a previous coding back into a discussion, in the same order code_post adds it.
+def copy_coding(post, coding):
+
+    topic, comments = coding
+
+    if len(comments) != len(post['_comments']):
+        return False
+
+    post['topic'] = topic
+
+    for comment, (links, delta, evidence_use) in zip(post['_comments'], comments):
+        comment['links'] = links
+        comment['Delta'] = delta
+        comment['evidence_use'] = evidence_use
+
+    return True
+
+#post_writer returns a writer for the coded discussions of the data file source: a sharded dataset 
+#compressed like source if source is one (see sharded.py), and a .jsonl file otherwise.
+def post_writer(source, destination):
+
+    if is_sharded(source):
+        return ShardWriter(destination, read_meta(source)['codec'])
+
+    return JsonLinesWriter(destination)
+
+"""
+code_file codes every discussion in the data file data/filename and writes the coded discussions
+to data/coded/filename.  If incremental is True, discussions that are unchanged since the last 
+run reuse their previous coding, and the file is skipped altogether if it has not changed.
+"""
+def code_file(filename, lexicons, pool = None, chunk_size = 500, max_in_flight = 64, incremental = False):
+
+    source = 'data/' + filename
+    destination = 'data/coded/' + filename
+
+    #A .jsonl file holds one discussion per line (see json_lines.py), and a sharded dataset holds
+    #compressed discussions (see sharded.py). Both are coded one discussion at a time. 
+    streamed = filename.endswith(".jsonl") or is_sharded(source)
+
+    if not incremental:
+
+        #We read, code, and write one discussion at a time, so we never hold the whole file in memory.
+        if streamed:
+
+            with post_writer(source, destination) as writer:
+                for post in code_posts(instruments.iterate('json_read', read_posts(source)), lexicons, pool, chunk_size, max_in_flight):
+                    with instruments.stage('json_write'):
+                        writer.write(post)
+
+            return True
+
+        #Read in our CMV data as a list of JSON objects
+        with instruments.stage('json_read'):
+            data = json_reader(source)  
+         
+        #Code each discussion in our dataset.
+        data = list(code_posts(data, lexicons, pool, chunk_size, max_in_flight))
+    
+        #Write our discussion JSON objects to a new file in the directory /coded. 
+        with instruments.stage('json_write', len(data)):
+            return json_writer(destination, data)
+
+    version = lexicon_version()
+    manifest = destination + '.manifest.jsonl'
+    partial = destination + '.partial.jsonl'
+
+    #A run that was killed may have left a half written line at the end of the partial file and
+    #of the manifest. We cut both back to their last complete line before reading them. 
+    for directory in (manifest, partial):
+        if os.path.exists(directory):
+            truncate_partial_line(directory)
+
+    hashes, stamp = read_manifest(manifest)
+
+    #If neither the data file nor the term lists changed since the file was last coded, we are done. 
+    if stamp == file_stamp(source, version) and os.path.exists(destination) and not os.path.exists(partial):
+        print("Data file %s is unchanged, skipping it" % filename)
+        return False
+
+    #The previous coding of each discussion, from the last complete run and from a run that was killed. 
+    previous = {}
+    for directory in (destination, partial):
+        if os.path.exists(directory):
+            with instruments.stage('read_coding'):
+                previous.update(read_coding(directory))
+
+    current = {}
+    reused = []
+
+    def reuse(post):
+
+        with instruments.stage('post_hash'):
+            current[post['id']] = post_hash(post, version)
+
+        if hashes.get(post['id']) == current[post['id']] and post['id'] in previous:
+            reused.append(copy_coding(post, previous.pop(post['id'])))
+            return reused[-1]
+
+        return False
+
+    coded = []
+
+    #Each discussion is written to the partial file before its hash is added to the manifest, 
+    #so the manifest never lists a coding we do not have. 
+    with JsonLinesWriter(partial) as writer, JsonLinesWriter(manifest, 'a') as journal:
+
+        for post in code_posts(instruments.iterate('json_read', read_posts(source)), lexicons, pool, chunk_size, max_in_flight, reuse):
+
+            with instruments.stage('json_write'):
+                writer.write(post)
+                journal.write({'id':post['id'], 'hash':current[post['id']]})
+
+            if not streamed:
+                coded.append(post)
+
+    #The file is coded completely, so we move the coded discussions into place...
+    if is_sharded(source):
+        with post_writer(source, destination) as writer:
+            for post in read_posts(partial):
+                writer.write(post)
+        os.remove(partial)
+    elif streamed:
+        os.replace(partial, destination)
+    else:
+        with instruments.stage('json_write', len(coded)):
+            json_writer(destination, coded)
+        os.remove(partial)
+
+    #...and rewrite the manifest with only the discussions in this file, and the file's stamp. 
+    with JsonLinesWriter(manifest + '.tmp') as journal:
+        for post_id, digest in current.items():
+            journal.write({'id':post_id, 'hash':digest})
+        journal.write({'file':file_stamp(source, version)})
+
+    os.replace(manifest + '.tmp', manifest)
+
+    print("Reused the previous coding of %d of %d discussions in %s" % (sum(reused), len(current), filename))
+
+    return True
 
 #This is the main method.  This is where the script starts and essentially runs from.
-def main():    
-
-    #Load in our topics. See #FN4# for details. 
-    topics = {
-        'gender' : read_terms('topics/gender.txt'),
-        'hot_topics' : read_terms('topics/hot_topics.txt'),
-        'lgbt' : read_terms('topics/lgbt.txt'),
-        'moral' : read_terms('topics/moral.txt'),
-        'politics' : read_terms('topics/politics.txt'),
-        'race' : read_terms('topics/race.txt'),
-        'religion' : read_terms('topics/religion.txt')
-    }
-
-    #Load in our evidence language. See #FN5# for details.
-    evidence = {
-        'data' : read_terms('evidence-language/data.txt'),
-        'economics' : read_terms('evidence-language/economics.txt'),
-        'evidence' : read_terms('evidence-language/evidence.txt'),
-        'numbers' : read_terms('evidence-language/numbers.txt'),
-        'stats' : read_terms('evidence-language/stats.txt'),
-        'values' : read_terms('evidence-language/values.txt'),
-        'explanations': read_terms('evidence-language/explanatory.txt')
-    }
+#workers is the number of processes to code with, and chunk_size is the number of comments 
+#each process codes at a time. If incremental is True, only discussions that changed since the 
+#last run are coded (see code_file). If report is a file name, every stage of the run is measured
+#and a report is saved to the file (and trace_memory also measures the memory each stage allocates).
+def main(workers = 1, chunk_size = 500, incremental = False, report = None, trace_memory = False):    
+
+    if report is not None:
+        instruments.enable(trace_memory)
+
+    #Warm the stemmer with the stems saved by the last run. 
+    with instruments.stage('stem_cache'):
+        stemmer.load(STEM_CACHE)
+
+    with instruments.stage('load_lexicons'):
+        lexicons = load_lexicons()
+
+    #If we code with more than one process, each worker loads the lexicons once when it starts. 
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializer = init_worker)
 
     #Encode our directory where our discussion data is as a directory object.
     #Since we may have multiple files in our data directory (this would occur if we collected
@@ -419,54 +984,59 @@ def main():
     #data file and execute the same code on each file.  
     directory = os.fsencode('data')     
 
-    #Iterate over files in our data folder.
-    for file in os.listdir(directory): 
+    #Iterate over files in our data folder, in the same order on every run.
+    for file in sorted(os.listdir(directory)): 
 
         #Get a string representation of a file in our folder
         filename = os.fsdecode(file)    
 
-        #If the file ends in .json, it's a data file we want to classify
-        if filename.endswith(".json"):  
+        #If the file ends in .json or .jsonl, or is a sharded dataset, it's a data file we want to classify
+        if filename.endswith(".json") or filename.endswith(".jsonl") or is_sharded(os.path.join('data', filename)):  
             
-            #Read in our CMV data as a list of JSON objects
-            data = json_reader('data/' + filename)  
-             
-            #Iterate over each discussion in our dataset.
-            for post in data:   
-
-                #We will classify each discussion with respect to the title and selftext.
-                #Therefore, we will concatenate these two strings for classification.
-                title = post['title']
-                body = post['selftext']
-                
-                #Firstly, we will classify each post with respect to the topic. 
-                #The topic attribute in the post JSON object will denote what the discussion's classification is. 
-                post['topic'] = classify_text(title + ' ' + body, topics)
-                
-                get_links(post['_comments'])
-
-                #Secondly, we will first denote how many deltas each comment recieved
-                award_deltas(post['_comments'])
-
-                #Thirdly, we will calculate use of evidence
-                #Pull out all of the comments in the discussion. 
-                post_comments = post['_comments']
-
-                #Iterate over every comment in the list of comments. 
-                for comment in post_comments:
-
-                    #Create an atribute in the comment JSON obbject that specifies the types of evidence used in the comment body.
-                    comment['evidence_use'] = classify_text(comment['body'], evidence)
-        
-            #Write our discussion JSON objects to a new file in the directory /coded. 
-            written = json_writer('data/coded/'+ filename, data)
+            with instruments.file(filename):
+                written = code_file(filename, lexicons, pool, chunk_size, 4 * workers, incremental)
             
-            #If data is succesfully written to file, json_writer return True.
+            #If data is succesfully written to file, code_file return True (and False if the file was skipped).
             #We print a success message to confirm our data is saved. 
             if written:
                 print("Data succesfully written to file %s" % filename)
 
-main()
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    #Save our stems for the next run, and report how much work the stem cache saved. 
+    with instruments.stage('stem_cache'):
+        stemmer.save(STEM_CACHE)
+    info = stemmer.cache_info()
+    print("Stem cache: %d hits, %d misses (%.1f%% hit rate)" % (info['hits'], info['misses'], info['hit_rate'] * 100))
+
+    #Save the report of the run, and print a summary of it. 
+    if report is not None:
+        settings = {'workers':workers, 'chunk_size':chunk_size, 'incremental':incremental}
+        run = instruments.save(report, {'settings':settings, 'stem_cache':info})
+        instruments.disable()
+        print(summary(run))
+        print("Report written to file %s" % report)
+
+#The __main__ guard keeps worker processes (which import this script) from running main themselves. 
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Code CMV discussions for topic, deltas, and evidence use.')
+    parser.add_argument('--workers', type = int, default = 1, 
+        help = 'number of processes to code with (default: 1, no pool)')
+    parser.add_argument('--chunk-size', type = int, default = 500, 
+        help = 'number of comments sent to a worker at a time (default: 500)')
+    parser.add_argument('--incremental', action = 'store_true', 
+        help = 'only code discussions that changed since the last run, and resume a killed run')
+    parser.add_argument('--report', default = None, 
+        help = 'measure each stage of the run and save a JSON report to this file')
+    parser.add_argument('--trace-memory', action = 'store_true', 
+        help = 'with --report, also measure the memory each stage allocates (slower)')
+    args = parser.parse_args()
+
+    main(workers = args.workers, chunk_size = args.chunk_size, incremental = args.incremental, 
+        report = args.report, trace_memory = args.trace_memory)
 
 
 """                         ***FOOTNOTES***
@@ -531,4 +1101,82 @@ gender, hot topics, lgbt, morality, politics, race, and religion.
 #FN:5#
 We will be classifying comments with repsect to the their use of the following
 types of evidence use: data, economics, evidence, numbers, stats, and values.
+
+#FN:6#
+A delta is awarded in three steps.  A user replies to a comment that changed
+their view (the DAC, or delta awarded comment) with "!delta" and a reason, and
+DeltaBot replies to that user confirming the delta.  So for every DeltaBot
+confirmation, the parent is the !delta signal, and the parent of the signal
+is the DAC.  Each parent is found with index_comments, so the whole discussion
+is resolved in a single linear pass.  If either parent was removed from the
+discussion, that one delta cannot be attributed, but we still award every
+other delta in the discussion.
+
+#FN:7#
+match rebuilds every n-gram of the text for each n up to the longest term,
+and then searches those lists for every term, once for every topic.  The
+matcher made by compile_terms holds the terms of all topics and all types of
+evidence in a trie, so a text is matched against every category at once:
+from each token we follow the trie only as far as the following tokens
+continue some phrase.  The classifications are exactly the same as with match.
+
+#FN:8#
+Finding links and classifying evidence use is done separately for every
+comment, so those are the steps we spread across the pool.  Awarding deltas
+needs the whole discussion, but after index_comments it is a single cheap
+pass, so it stays in the main process along with the topic of each post.
+finish_post puts the results back in the same order code_post adds them
+(links, then Delta, then evidence_use), and pool results are collected in
+the order the posts were sent, so a parallel run writes exactly the same
+files as a serial run.
+
+#FN:9#
+With --incremental, every coded file data/coded/<file> has a manifest,
+data/coded/<file>.manifest.jsonl, that lists the id of every discussion
+and a hash of the content its coding depends on (see post_hash), including
+a hash of the term lists.  On the next run, a discussion whose hash is
+unchanged reuses its previous coding instead of being coded again; only the
+coding is reused, so metadata like score is always taken from the data file.
+While a file is being coded, the coded discussions are written one at a time
+to data/coded/<file>.partial.jsonl and appended to the manifest, so if the
+run is killed, the next run reuses everything coded so far.  When a file is
+finished, its manifest also records the size and modification time of the
+data file, so an unchanged data file is skipped without even being read.
+
+#FN:10#
+With --report report.json, every stage of the run is measured (see
+instrumentation.py): reading and writing the JSON, preparing text, matching
+terms, finding links, awarding deltas, loading the lexicons and the stem
+cache, and (with --incremental) hashing discussions and reading their previous
+coding.  For each stage we record the number of calls, the wall time, the
+number of items, and the peak memory, added up for the run, for each data file,
+and for each post.  The report is saved as JSON, and a summary is printed:
+
+    python discussion_analysis.py --report report.json
+
+With --workers, the stages run by the worker processes are not measured; the
+time spent waiting for them is reported as pool_wait (run with one worker to
+see every stage).  --trace-memory also measures the memory Python allocates in
+each stage, which makes the run noticeably slower.  Without --report, the
+stages are not measured, and cost almost nothing.
+
+#FN:11#
+load_lexicons saves the stemmed term lists and the compiled matcher to
+lexicons.cache (see lexicon_cache.py), under a key made from the content of
+every term list and the version of the stemmer (lexicon_version).  The next run,
+and every worker process, loads them from the file in a few milliseconds
+instead of stemming and compiling every term list again.  If a term list is
+edited, the key changes, and the lexicons are compiled and saved again
+automatically; deleting lexicons.cache is always safe.
+
+#FN:12#
+Importing this script does no work (main only runs under the __main__ guard),
+and imports nothing heavy: NLTK is only imported when the stemmer first meets
+a word that is not in the stem cache, and BeautifulSoup only when a comment's
+links can't be found without it (see link_extractor.py).  So a notebook can
+import the helpers, and a worker process can start, in about a tenth of a
+second instead of the second or more it takes to import NLTK.  To check the
+cold start of the command line and of a worker against their budgets, run:
+
+    python benchmark.py --startup
 """
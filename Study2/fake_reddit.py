@@ -0,0 +1,175 @@
+"""
+Project Name: Attitude Change on Change My View (Study 2)
+Name: fake_reddit.py
+
+Description of this script:
+
+    A stand-in for the Reddit API client (praw.Reddit) that serves discussions
+    from one of our own data files instead of from Reddit.  It lets us run and
+    time collect_posts.py offline: every request sleeps for a simulated round
+    trip, and the client keeps a rate-limit budget that is reported the same
+    way PRAW reports it (reddit.auth.limits).  When the budget is spent before
+    the rate-limit window resets, requests fail with TooManyRequests, just like
+    the real API.
+
+    Only the parts of the API that collect_posts.py uses are implemented.  To
+    replay a data file through the collector, run:
+
+        python collect_posts.py --replay data/20180815182030_posts.jsonl --workers 8
+
+Authors: J. Hunter Priniski & Zachary Horne
+"""
+
+#REQUIREMENTS
+import time
+import threading
+
+from json_lines import read_posts
+
+#Raised when a request is made after the rate-limit budget is spent.
+class TooManyRequests(Exception):
+    pass
+
+#Reddit returns authors as Redditor objects. The collector only reads their name.
+class FakeRedditor:
+
+    def __init__(self, name):
+        self.name = name
+
+#The replies of a comment are kept in a CommentForest, whose _comments are the reply objects.
+class FakeForest:
+
+    def __init__(self, reddit, comments):
+        self._reddit = reddit
+        self._comments = comments
+
+    #Unpacking the MoreComments objects of a discussion costs a request on Reddit.
+    def replace_more(self, limit = 32):
+        self._reddit._request()
+        return []
+
+    def __getitem__(self, key):
+        return self._comments[key]
+
+    def __len__(self):
+        return len(self._comments)
+
+class FakeComment:
+
+    def __init__(self, data):
+        self.__dict__.update(data)
+
+    @property
+    def replies(self):
+        return self._replies._comments
+
+class FakeSubmission:
+
+    def __init__(self, reddit, data):
+
+        self.__dict__.update({key:val for key, val in data.items() if key != '_comments'})
+        self.author = FakeRedditor(data['author']) if data.get('author') is not None else None
+
+        #Rebuild the discussion tree from each comment's parent_id.
+        comments = [FakeComment(comment) for comment in data.get('_comments', [])]
+        by_name = {comment.name:comment for comment in comments}
+        children = {comment.name:[] for comment in comments}
+        top_level = []
+
+        for comment in comments:
+            comment.author = FakeRedditor(comment.author)
+            if comment.parent_id in children:
+                children[comment.parent_id].append(comment)
+            else:
+                top_level.append(comment)
+
+        for comment in comments:
+            comment._replies = FakeForest(reddit, children[comment.name])
+
+        self.comments = FakeForest(reddit, top_level)
+        self.num_comments = len(comments)
+
+class FakeSubreddit:
+
+    def __init__(self, reddit):
+        self._reddit = reddit
+
+    #A listing of submissions costs one request for every 100 submissions, as on Reddit.
+    def top(self, limit = 100):
+
+        for i, post in enumerate(self._reddit._posts[:limit]):
+            if i % 100 == 0:
+                self._reddit._request()
+            yield FakeSubmission(self._reddit, post)
+
+class FakeAuth:
+
+    def __init__(self, reddit):
+        self._reddit = reddit
+
+    @property
+    def limits(self):
+        return self._reddit._limits()
+
+"""
+FakeReddit serves the discussions in posts (a list of discussions in the collect_posts format).
+Every request sleeps for latency seconds.  budget requests are allowed in every window of
+window seconds; the remaining budget and the time of the next reset are in reddit.auth.limits.
+One FakeReddit can be shared by many threads.
+"""
+class FakeReddit:
+
+    def __init__(self, posts, latency = 0.05, budget = 600, window = 600.0, clock = time.time, sleep = time.sleep):
+
+        self._posts = list(posts)
+        self._by_id = {post['id']:post for post in self._posts}
+        self.latency = latency
+        self.budget = budget
+        self.window = window
+        self.clock = clock
+        self.sleep = sleep
+
+        self._lock = threading.Lock()
+        self._reset = clock() + window
+        self._used = 0
+
+        #The total number of requests made, and how many were refused.
+        self.requests = 0
+        self.refused = 0
+
+        self.auth = FakeAuth(self)
+
+    @classmethod
+    def from_file(cls, directory, **kwargs):
+        return cls(read_posts(directory), **kwargs)
+
+    def _request(self):
+
+        with self._lock:
+
+            now = self.clock()
+            if now >= self._reset:
+                self._reset = now + self.window
+                self._used = 0
+
+            self.requests += 1
+
+            if self._used >= self.budget:
+                self.refused += 1
+                raise TooManyRequests('rate limit exceeded, resets in %.1f seconds' % (self._reset - now))
+
+            self._used += 1
+
+        self.sleep(self.latency)
+
+    def _limits(self):
+
+        with self._lock:
+            return {'remaining':self.budget - self._used, 'reset_timestamp':self._reset, 'used':self._used}
+
+    def subreddit(self, name):
+        return FakeSubreddit(self)
+
+    def submission(self, id):
+        self._request()
+        return FakeSubmission(self, self._by_id[id])
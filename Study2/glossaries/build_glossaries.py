@@ -0,0 +1,98 @@
+"""
+Project Name: Attitude Change on Change My View (Study 2)
+Name: build_glossaries.py
+
+Description of this script:
+    Build every glossary at once: clean each raw glossary in glossaries/raw (see clean_index.py)
+    into glossaries/cleaned, and grow each cleaned glossary with the lemmas of its terms
+    (see get_word_lemmas.py) into glossaries/grown.  The glossaries are built at the same time,
+    one per process, and each process lemmatizes with a single WordNetLemmatizer that remembers
+    every lemma it has found.
+
+    Some cleaned glossaries were corrected by hand after cleaning (e.g., 'type i error' became
+    'type one error', see readme.md), so a raw glossary is only cleaned if it has no cleaned
+    glossary yet, unless --clean is given.  Run from Study2/glossaries:
+
+        python build_glossaries.py
+        python build_glossaries.py --workers 4 --clean
+
+Authors: J. Hunter Priniski & Zachary Horne
+
+"""
+#REQUIRMENTS
+import os
+import time
+import argparse
+import multiprocessing
+
+from clean_index import clean_glossary
+from get_word_lemmas import grow_glossary, make_lemmatizer
+
+#The lemmatizer of this process, made the first time a glossary is grown.
+lemmatize = None
+
+#build_glossary cleans (if needed) and grows the glossary name, e.g. 'stats' for glossaries/raw/stats.txt,
+#and returns the number of terms in the cleaned and grown glossaries.
+def build_glossary(name, root = 'glossaries', clean = False):
+
+	global lemmatize
+
+	raw = os.path.join(root, 'raw', name + '.txt')
+	cleaned = os.path.join(root, 'cleaned', name + '-clean.txt')
+	grown = os.path.join(root, 'grown', name + '-clean-grown.txt')
+
+	start = time.perf_counter()
+
+	cleaned_now = clean or not os.path.exists(cleaned)
+	if cleaned_now:
+		clean_glossary(raw, cleaned)
+
+	if lemmatize is None:
+		lemmatize = make_lemmatizer()
+
+	terms = grow_glossary(cleaned, grown, lemmatize)
+
+	with open(cleaned, 'r') as text_file:
+		num_cleaned = sum(1 for term in text_file.read().split('\n') if len(term) > 1)
+
+	return {'name':name, 'cleaned':num_cleaned, 'grown':sum(1 for term in terms if len(term) > 1),
+		'cleaned_now':cleaned_now, 'seconds':time.perf_counter() - start}
+
+def build_one(arguments):
+	return build_glossary(*arguments)
+
+#main builds every glossary in root/raw, workers at a time.
+def main(root = 'glossaries', workers = None, clean = False):
+
+	names = sorted(filename[:-4] for filename in os.listdir(os.path.join(root, 'raw')) if filename.endswith('.txt'))
+
+	for directory in ('cleaned', 'grown'):
+		os.makedirs(os.path.join(root, directory), exist_ok = True)
+
+	start = time.perf_counter()
+	jobs = [(name, root, clean) for name in names]
+
+	if workers == 1 or len(names) <= 1:
+		results = [build_one(job) for job in jobs]
+	else:
+		with multiprocessing.Pool(min(workers or os.cpu_count() or 1, len(names))) as pool:
+			results = pool.map(build_one, jobs)
+
+	for result in results:
+		print('%-24s %6d cleaned terms%s, %6d grown terms (%.2f seconds)' % (result['name'], result['cleaned'],
+			'' if result['cleaned_now'] else ' (kept)', result['grown'], result['seconds']))
+
+	print('Built %d glossaries in %.2f seconds' % (len(results), time.perf_counter() - start))
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(description = 'Clean and grow every glossary in glossaries/raw.')
+	parser.add_argument('--root', default = 'glossaries',
+		help = 'directory with the raw, cleaned, and grown glossaries (default: glossaries)')
+	parser.add_argument('--workers', type = int, default = None,
+		help = 'number of glossaries to build at the same time (default: one per CPU)')
+	parser.add_argument('--clean', action = 'store_true',
+		help = 'clean every raw glossary again, replacing any corrections made by hand to the cleaned glossaries')
+	args = parser.parse_args()
+
+	main(root = args.root, workers = args.workers, clean = args.clean)
@@ -30,31 +30,32 @@ def make_clean_index(directory):
 	return new_lines
 
 #We want to remove duplicates, however, casting a list to a set looses the list's ordering. 
-#This function removes duplicates and perserves order. 
+#This function removes duplicates and perserves order. A dictionary keeps its keys in the order
+#they were added, and checks for a key in constant time, so this takes one pass over the list.
 def remove_dups(dup_list):
-    
-    seen = []
-    for x in dup_list:
-    	if not (x in seen):
-    		seen.append(x)
-  
-    return seen
 
-def main():
+	return list(dict.fromkeys(dup_list))
 
-	file = 'lists/american-government.txt'
-	terms = make_clean_index(file)
+#clean_glossary cleans the raw glossary in the file source, and writes the cleaned terms to the file destination.
+def clean_glossary(source, destination):
+
+	terms = make_clean_index(source)
 	terms = remove_dups(terms)
 
-	with open(file[:-4] + '-clean.txt', 'w') as the_file:
+	with open(destination, 'w') as the_file:
 		
 		for term in terms: 
 			if len(term) > 1:
 				the_file.write(term+'\n')
 
+	return terms
 
+def main():
 
-	
-
+	file = 'lists/american-government.txt'
+	clean_glossary(file, file[:-4] + '-clean.txt')
 
-main()
\ No newline at end of file
+#Only clean the glossary when the script is run, not when make_clean_index is imported.
+#To clean (and grow) every glossary in glossaries/raw at once, run build_glossaries.py.
+if __name__ == '__main__':
+	main()
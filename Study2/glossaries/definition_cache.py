@@ -0,0 +1,63 @@
+"""
+Project Name: Attitude Change on Change My View (Study 2)
+Name: definition_cache.py
+
+Description of this script:
+    A persistent cache of the definitions make_corpus.py has looked up, so each term is only
+    looked up once.  The cache is a small SQLite database, keyed by the term and the source
+    of the definition (e.g., wiki or wordnet).  A term the source has no definition for is
+    cached too, so it isn't looked up again on every run.  Deleting the database is always
+    safe: every definition is simply looked up again.
+
+Authors: J. Hunter Priniski & Zachary Horne
+
+"""
+#REQUIRMENTS
+import time
+import sqlite3
+
+class DefinitionCache:
+
+	def __init__(self, directory = 'definitions.sqlite3'):
+
+		self.directory = directory
+		self.connection = sqlite3.connect(directory)
+
+		with self.connection:
+			self.connection.execute('''CREATE TABLE IF NOT EXISTS definitions
+				(term TEXT, source TEXT, definition TEXT, fetched_utc REAL, PRIMARY KEY (term, source)) WITHOUT ROWID''')
+
+	def __len__(self):
+
+		return self.connection.execute('SELECT COUNT(*) FROM definitions').fetchone()[0]
+
+	#get_many returns the cached definitions of terms from source, as a dictionary of term to definition.
+	#A term the source has no definition for maps to None, and a term that was never looked up is left out.
+	def get_many(self, terms, source):
+
+		cached = {}
+		terms = list(terms)
+
+		#SQLite limits the number of parameters of a query, so we ask for the terms a batch at a time.
+		for start in range(0, len(terms), 500):
+			batch = terms[start:start + 500]
+			rows = self.connection.execute('SELECT term, definition FROM definitions WHERE source = ? AND term IN (%s)'
+				% ', '.join('?' * len(batch)), [source] + batch)
+			cached.update(rows)
+
+		return cached
+
+	#put_many caches the definitions (a dictionary of term to definition, or None) from source, in one transaction.
+	def put_many(self, definitions, source):
+
+		now = time.time()
+
+		with self.connection:
+			self.connection.executemany('INSERT OR REPLACE INTO definitions VALUES (?, ?, ?, ?)',
+				[(term, source, definition, now) for term, definition in definitions.items()])
+
+		return True
+
+	def close(self):
+
+		self.connection.close()
@@ -9,30 +9,62 @@ Authors: J. Hunter Priniski & Zachary Horne
 
 """
 #REQUIRMENTS
+import functools
 
-from nltk.stem.wordnet import WordNetLemmatizer
+#make_lemmatizer returns a function that lemmatizes a word as a part of speech ('v', 'n', or 'a'). 
+#Every call shares one WordNetLemmatizer, and each word is only lemmatized once for each part of speech.
+def make_lemmatizer():
+
+	#NLTK takes a second or more to import, so we only import it when we lemmatize. 
+	from nltk.stem.wordnet import WordNetLemmatizer
+
+	return functools.lru_cache(maxsize = None)(WordNetLemmatizer().lemmatize)
+
+#grow_terms adds the verb, noun, and adjective lemmas of each term to the list of terms. 
+#The lemmas added are themselves lemmatized, since they are appended to the list we are going through.
+#The set seen holds every term in the list, so checking for a lemma takes constant time.
+def grow_terms(lines, lemmatize):
+
+	lines = list(lines)
+	seen = set(lines)
 
-def main():
-	file = 'lists/american-government-clean.txt'
-	
-	text_file = open(file, "r")
-	lines = text_file.read().split('\n')
-	
-	
 	for word in lines:
 
 		#we will add the verb, noun, and adjective lemmas of each word in word bank
 		for w in ['v','n','a']:
 
-			lemma = WordNetLemmatizer().lemmatize(word, w)
+			lemma = lemmatize(word, w)
 			
-			if not (lemma in lines):
-					lines.append(lemma)
+			if not (lemma in seen):
+				seen.add(lemma)
+				lines.append(lemma)
+
+	return lines
+
+#grow_glossary grows the cleaned glossary in the file source, and writes the grown glossary to the file destination.
+def grow_glossary(source, destination, lemmatize = None):
+
+	if lemmatize is None:
+		lemmatize = make_lemmatizer()
 
-	with open(file[:-4] + '-grown.txt', 'w') as the_file:
+	with open(source, "r") as text_file:
+		lines = text_file.read().split('\n')
+
+	lines = grow_terms(lines, lemmatize)
+
+	with open(destination, 'w') as the_file:
 		
 		for term in lines: 
 			if len(term) > 1:
 				the_file.write(term+'\n')
-				
-main()
\ No newline at end of file
+
+	return lines
+
+def main():
+
+	file = 'lists/american-government-clean.txt'
+	grow_glossary(file, file[:-4] + '-grown.txt')
+
+#To grow every glossary in glossaries/cleaned at once, run build_glossaries.py.
+if __name__ == '__main__':
+	main()
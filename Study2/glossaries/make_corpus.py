@@ -1,64 +1,226 @@
-from nltk.corpus import wordnet
-import wikipedia
+"""
+Project Name: Attitude Change on Change My View (Study 2)
+Name: make_corpus.py
+
+Description of this script:
+    Build corpus.json: a definition of every term in our grown glossaries, from its Wikipedia
+    summary, or from WordNet if Wikipedia has none.  The Wikipedia summaries are looked up
+    several at a time (--workers), and every definition is saved in a cache (see
+    definition_cache.py), so a rerun only looks up terms it hasn't seen before.  With
+    --offline, only WordNet is used.  To build the corpus from a stand-in for Wikipedia
+    (see stub_definitions.py), give its address with --service.  Its definitions are cached
+    under --service-name (not its address), so the service can move to another port.
+
+        python make_corpus.py --workers 16
+        python make_corpus.py --offline
+
+Authors: J. Hunter Priniski & Zachary Horne
+
+"""
+#REQUIRMENTS
 import json
+import time
+import argparse
+import concurrent.futures
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from definition_cache import DefinitionCache
 
 # read in each seperate glossary
 bus = 'glossaries/grown/business-stats-clean-grown.txt'
-stats= 'glossaries/grown/business-stats-clean-grown.txt'
+stats= 'glossaries/grown/stats-clean-grown.txt'
 econ = 'glossaries/grown/economics-terms-clean-grown.txt'
 gov = 'glossaries/grown/american-government-clean-grown.txt'
-	
-bus_file = open(bus, "r")
-bus_lines = bus_file.read().split('\n')
 
-stats_file = open(stats, "r")
-stats_lines = stats_file.read().split('\n')
+#Raised by a lookup when the source has no definition of a term. A term that isn't found is cached,
+#but any other error (e.g., a dropped connection) is not, so the term is looked up again on the next run.
+class NotFound(Exception):
+	pass
 
-econ_file = open(econ, "r")
-econ_lines = econ_file.read().split('\n')
+#wikipedia_lookup returns the Wikipedia summary of a term. wikipedia is slow to import, so we only import it when we look terms up.
+def wikipedia_lookup(term):
 
-gov_file = open(gov, "r")
-gov_lines = gov_file.read().split('\n')
+	import wikipedia
 
-# put all terms into a single corpus
-corpus = bus_lines + stats_lines + econ_lines + gov_lines
+	try:
+		return wikipedia.summary(term)
+	except (wikipedia.exceptions.PageError, wikipedia.exceptions.DisambiguationError):
+		raise NotFound(term)
+
+#service_lookup returns a lookup that asks the definition service at url (see stub_definitions.py) for a term's summary.
+def service_lookup(url, timeout = 30):
 
-# remove duplicate terms
-corpus =set(corpus)
+	def lookup(term):
 
-# add defintions for each term in our dictionary.
-defintions = {}
-count = 1
-for word in corpus: 
-	
-	# will print some progress statements
-	count+=1
-	if count % 50 == 0:
-		print('Count %4f percent complete' % ((count/len(corpus))*100)
+		try:
+			with urllib.request.urlopen('%s/summary/%s' % (url.rstrip('/'), urllib.parse.quote(term, safe = '')), timeout = timeout) as response:
+				return json.load(response)['extract']
+		except urllib.error.HTTPError as error:
+			if error.code == 404:
+				raise NotFound(term)
+			raise
+
+	return lookup
 
+#wordnet_lookup returns the definition of the first WordNet synset of a term. NLTK is slow to import, so we only import it when we look terms up.
+def wordnet_lookup(term):
 
-	# will try to get Wikipedia summary data for 
-	try:
-		summary = wikipedia.summary(word)
-		defintions.update({word:{'def':summary, 'source':'wiki'}})
+	from nltk.corpus import wordnet
+
+	syns = wordnet.synsets(term)
 
-	# if there is no wiki article for word, we will try to use wordnet to get a definition
-	except:
+	if len(syns) > 0:
+		return syns[0].definition()
 
-		syns = wordnet.synsets(word)
+	raise NotFound(term)
 
-		if len(syns) > 0:
-			defintions.update({word:{'def':syns[0].definition(), 'source':'wordnet'}})
-		else:
-			#defintions.update({word:''})
-			print('No defintion or wiki description found for %s ' % word)
+#read_glossaries puts all terms of the glossaries into a single corpus, without duplicates, in alphabetical order.
+def read_glossaries(glossaries = (bus, stats, econ, gov)):
+
+	corpus = set()
+
+	for directory in glossaries:
+		with open(directory, "r") as glossary_file:
+			corpus.update(glossary_file.read().split('\n'))
+
+	return sorted(term for term in corpus if term)
+
+"""
+resolve returns the definitions of terms from source, as a dictionary of term to definition (or None if the
+source has none).  Definitions are taken from the cache when they can be; every other term is looked up with
+lookup, workers terms at a time, and cached.  Terms that could not be looked up (e.g., the connection dropped)
+are left out, and are looked up again on the next run.
+"""
+def resolve(terms, source, lookup, cache, workers = 8):
+
+	definitions = cache.get_many(terms, source)
+	missing = [term for term in terms if term not in definitions]
+
+	if not missing:
+		return definitions
+
+	print('Looking up %d of %d terms from %s' % (len(missing), len(terms), source))
+
+	found = {}
+	unsaved = {}
+	failed = 0
 
-with open('corpus.json','w') as out_file:
-	json.dump(defintions, out_file)
+	def finish(term, future):
 
+		nonlocal failed
 
+		try:
+			found[term] = unsaved[term] = future.result()
+		except NotFound:
+			found[term] = unsaved[term] = None
+		#A missing resource (e.g., the WordNet data was never downloaded) would fail every lookup, so we stop.
+		except LookupError:
+			cache.put_many(unsaved, source)
+			raise
+		except Exception as error:
+			failed += 1
+			print('Could not look up %s (%r), it will be looked up again on the next run' % (term, error))
 
+		# will print some progress statements, and save what we have found so far
+		count = len(found) + failed
+		if count % 50 == 0:
+			print('Count %4f percent complete' % ((count/len(missing))*100))
+			cache.put_many(unsaved, source)
+			unsaved.clear()
 
+	#A lookup only waits on the network, so a pool of threads is enough to keep workers lookups going at once.
+	if workers > 1:
+		with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+			futures = {pool.submit(lookup, term):term for term in missing}
+			for future in concurrent.futures.as_completed(futures):
+				finish(futures[future], future)
+	else:
+		for term in missing:
+			future = concurrent.futures.Future()
+			try:
+				future.set_result(lookup(term))
+			except Exception as error:
+				future.set_exception(error)
+			finish(term, future)
 
+	cache.put_many(unsaved, source)
+	definitions.update(found)
 
+	if failed:
+		print('Could not look up %d terms from %s' % (failed, source))
 
+	return definitions
+
+"""
+build_corpus returns a definition of every term: its Wikipedia summary (from lookup, cached as source), or its
+WordNet definition if there is none.  If lookup is None (offline), only WordNet is used.
+"""
+def build_corpus(terms, cache, lookup = wikipedia_lookup, source = 'wiki', workers = 8, wordnet = wordnet_lookup):
+
+	wiki = {}
+	if lookup is not None:
+		wiki = resolve(terms, source, lookup, cache, workers)
+
+	#WordNet is on disk, so it is looked up one term at a time.
+	rest = [term for term in terms if wiki.get(term) is None]
+	synsets = resolve(rest, 'wordnet', wordnet, cache, workers = 1)
+
+	# add defintions for each term in our dictionary.
+	defintions = {}
+	for word in terms:
+
+		if wiki.get(word) is not None:
+			defintions[word] = {'def':wiki[word], 'source':'wiki'}
+
+		elif synsets.get(word) is not None:
+			defintions[word] = {'def':synsets[word], 'source':'wordnet'}
+
+		elif word in synsets:
+			print('No defintion or wiki description found for %s ' % word)
+
+	return defintions
+
+def main(output = 'corpus.json', cache = 'definitions.sqlite3', workers = 8, offline = False, service = None, service_name = 'service'):
+
+	start = time.perf_counter()
+
+	corpus = read_glossaries()
+	cache = DefinitionCache(cache)
+
+	#Summaries from a stand-in service are cached apart from the real Wikipedia summaries. They are cached under
+	#the service's name, not its address, so moving the service to another host or port keeps its cache.
+	lookup, source = wikipedia_lookup, 'wiki'
+	if offline:
+		lookup = None
+	elif service is not None:
+		lookup, source = service_lookup(service), 'service:' + service_name
+
+	try:
+		defintions = build_corpus(corpus, cache, lookup, source, workers)
+	finally:
+		cache.close()
+
+	with open(output,'w') as out_file:
+		json.dump(defintions, out_file)
+
+	print('Defined %d of %d terms in %.1f seconds, written to file %s' % (len(defintions), len(corpus), time.perf_counter() - start, output))
+
+# only build the corpus when the script is run, not when it is imported
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(description = 'Define every term of the grown glossaries, from Wikipedia or WordNet.')
+	parser.add_argument('--output', default = 'corpus.json', help = 'file to write the corpus to (default: corpus.json)')
+	parser.add_argument('--cache', default = 'definitions.sqlite3',
+		help = 'cache of the definitions looked up so far (default: definitions.sqlite3)')
+	parser.add_argument('--workers', type = int, default = 8, help = 'number of terms to look up at the same time (default: 8)')
+	parser.add_argument('--offline', action = 'store_true', help = 'only use WordNet, without looking anything up online')
+	parser.add_argument('--service', default = None,
+		help = 'address of a definition service to use instead of Wikipedia, e.g. http://127.0.0.1:8000 (see stub_definitions.py)')
+	parser.add_argument('--service-name', default = 'service',
+		help = 'name the definitions of --service are cached under; give each different service its own name (default: service)')
+	args = parser.parse_args()
+
+	main(output = args.output, cache = args.cache, workers = args.workers, offline = args.offline, service = args.service,
+		service_name = args.service_name)
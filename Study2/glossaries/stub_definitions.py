@@ -0,0 +1,87 @@
+"""
+Project Name: Attitude Change on Change My View (Study 2)
+Name: stub_definitions.py
+
+Description of this script:
+    A stand-in for Wikipedia that serves definitions from one of our own files, so make_corpus.py
+    can be run and timed offline.  The service answers GET /summary/<term> with the JSON
+    {"extract": "<definition>"}, or with 404 if it has no definition of the term, and every
+    request sleeps for a simulated round trip.  The definitions file is a JSON object of term to
+    definition (a corpus.json written by make_corpus.py works too).  To build a corpus from it, run:
+
+        python stub_definitions.py corpus.json --port 8000 --latency 0.05
+        python make_corpus.py --service http://127.0.0.1:8000
+
+Authors: J. Hunter Priniski & Zachary Horne
+
+"""
+#REQUIRMENTS
+import json
+import time
+import argparse
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StubHandler(BaseHTTPRequestHandler):
+
+	def do_GET(self):
+
+		time.sleep(self.server.latency)
+
+		prefix = '/summary/'
+		term = urllib.parse.unquote(self.path[len(prefix):]) if self.path.startswith(prefix) else None
+		definition = self.server.definitions.get(term)
+
+		if definition is None:
+			self.send_error(404)
+			return
+
+		body = json.dumps({'extract':definition}).encode()
+		self.send_response(200)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	#The service is quiet, so it doesn't print a line for every request.
+	def log_message(self, *args):
+		pass
+
+#read_definitions reads a file of term to definition (or a corpus.json, of term to {'def':..., 'source':...}).
+def read_definitions(directory):
+
+	with open(directory, 'r') as json_file:
+		definitions = json.load(json_file)
+
+	return {term:(value['def'] if isinstance(value, dict) else value) for term, value in definitions.items()}
+
+#serve starts the service on port (0 picks a free port) in a background thread, and returns the server.
+#Its address is 'http://127.0.0.1:%d' % server.server_port, and server.shutdown() stops it.
+def serve(definitions, port = 0, latency = 0.0):
+
+	server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+	server.daemon_threads = True
+	server.definitions = definitions
+	server.latency = latency
+
+	threading.Thread(target = server.serve_forever, daemon = True).start()
+
+	return server
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(description = 'Serve definitions from a file, as a stand-in for Wikipedia.')
+	parser.add_argument('definitions', help = 'a JSON file of term to definition, or a corpus.json')
+	parser.add_argument('--port', type = int, default = 8000, help = 'port to serve on (default: 8000)')
+	parser.add_argument('--latency', type = float, default = 0.05,
+		help = 'seconds each request takes (default: 0.05)')
+	args = parser.parse_args()
+
+	server = serve(read_definitions(args.definitions), args.port, args.latency)
+	print("Serving %d definitions at http://127.0.0.1:%d" % (len(server.definitions), server.server_port))
+
+	try:
+		threading.Event().wait()
+	except KeyboardInterrupt:
+		server.shutdown()
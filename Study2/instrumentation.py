@@ -0,0 +1,326 @@
+"""
+Project Name: Attitude Change on Change My View (Study 2)
+Name: instrumentation.py
+
+Description of this script:
+
+    Measure where the time (and memory) of a coding run goes.
+
+    discussion_analysis.py wraps each stage of coding (reading the JSON,
+    preparing and stemming text, matching terms, finding links, awarding
+    deltas, writing the JSON, ...) in instruments.stage(name).  When the
+    instruments are enabled, every stage records:
+
+        calls       how many times the stage ran
+        seconds     the wall time spent in the stage
+        items       how many items (posts, texts, or comments) it went through
+        peak memory the peak resident memory of the process by the end of the
+                    stage, and, if memory tracing is on, the peak memory
+                    allocated by Python while the stage ran (see tracemalloc)
+
+    The stages are added up for the whole run, for each data file, and for
+    each post.  At the end of the run, report() returns all of this as a
+    dictionary (save() writes it as JSON) and summary() as a short text.
+
+    When the instruments are disabled (the default), stage() returns the same
+    empty context every time, so instrumented code runs at almost full speed.
+    To write a report of a coding run, run:
+
+        python discussion_analysis.py --report report.json
+
+Authors: J. Hunter Priniski & Zachary Horne
+"""
+
+#REQUIREMENTS
+import sys
+import json
+import time
+import contextlib
+import tracemalloc
+
+#resource is not available on Windows, where we don't report the resident memory.
+try:
+    import resource
+except ImportError:
+    resource = None
+
+#The context stage() returns when the instruments are disabled. It does nothing, and can be reused.
+NULL = contextlib.nullcontext()
+
+#peak_rss_mb returns the peak resident memory of the process so far, in megabytes (or None).
+def peak_rss_mb():
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    #Linux reports kilobytes, macOS bytes.
+    if sys.platform == 'darwin':
+        return peak / 1e6
+
+    return peak / 1e3
+
+#A Scope is a stage, a file, or a post being measured. Scopes can be nested.
+class Scope:
+
+    __slots__ = ('instruments', 'kind', 'name', 'items', 'start', 'peak_traced', 'record')
+
+    def __init__(self, instruments, kind, name, items, record = None):
+
+        self.instruments = instruments
+        self.kind = kind
+        self.name = name
+        self.items = items
+        self.record = record
+        self.peak_traced = 0
+
+    def __enter__(self):
+
+        instruments = self.instruments
+
+        if instruments.trace_memory:
+            instruments.fold_peak()
+            instruments.open_scopes.append(self)
+
+        #Stages inside a file or a post are added to the file's or the post's stages too.
+        if self.kind == 'file':
+            instruments.current_file = self
+        elif self.kind == 'post':
+            instruments.current_post = self
+
+        self.start = time.perf_counter()
+
+        return self
+
+    def __exit__(self, *exc_info):
+
+        seconds = time.perf_counter() - self.start
+        instruments = self.instruments
+
+        if instruments.trace_memory:
+            instruments.fold_peak()
+            instruments.open_scopes.remove(self)
+
+        instruments.close(self, seconds)
+
+        if self.kind == 'file':
+            instruments.current_file = None
+        elif self.kind == 'post':
+            instruments.current_post = None
+
+        return False
+
+class Instruments:
+
+    def __init__(self, enabled = False, trace_memory = False):
+
+        self.enabled = False
+        self.trace_memory = False
+
+        if enabled:
+            self.enable(trace_memory)
+
+    #enable starts measuring, and forgets anything measured before.
+    def enable(self, trace_memory = False):
+
+        self.enabled = True
+        self.trace_memory = trace_memory
+        self.started = time.time()
+        self.start = time.perf_counter()
+
+        self.stages = {}
+        self.files = {}
+        self.posts = []
+
+        self.current_file = None
+        self.current_post = None
+        self.open_scopes = []
+
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+
+        self.enabled = False
+
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+        self.trace_memory = False
+
+    #stage measures the code in a with block as the stage name, which went through items items.
+    def stage(self, name, items = 1):
+
+        if not self.enabled:
+            return NULL
+
+        return Scope(self, 'stage', name, items)
+
+    #file measures the code in a with block as the coding of the data file filename.
+    def file(self, filename):
+
+        if not self.enabled:
+            return NULL
+
+        record = {'seconds':0.0, 'posts':0, 'comments':0, 'peak_rss_mb':None, 'stages':{}}
+        self.files[filename] = record
+
+        return Scope(self, 'file', filename, 0, record)
+
+    #post measures the code in a with block as the coding of the post post_id, with comments comments.
+    def post(self, post_id, comments = 0):
+
+        if not self.enabled:
+            return NULL
+
+        record = {'file':None if self.current_file is None else self.current_file.name, 'id':post_id,
+            'comments':comments, 'seconds':0.0, 'peak_rss_mb':None, 'stages':{}}
+
+        return Scope(self, 'post', post_id, comments, record)
+
+    #iterate yields the items of iterable, and measures the time spent getting each one as the stage name.
+    def iterate(self, name, iterable):
+
+        if not self.enabled:
+            return iterable
+
+        return self.iterate_measured(name, iter(iterable))
+
+    def iterate_measured(self, name, iterator):
+
+        while True:
+
+            with self.stage(name) as scope:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    scope.items = 0
+                    item = scope
+
+            if item is scope:
+                return
+
+            yield item
+
+    #fold_peak adds the peak traced memory since the last fold to every open scope, and starts a new peak.
+    def fold_peak(self):
+
+        peak = tracemalloc.get_traced_memory()[1]
+
+        for scope in self.open_scopes:
+            scope.peak_traced = max(scope.peak_traced, peak)
+
+        tracemalloc.reset_peak()
+
+    def close(self, scope, seconds):
+
+        rss = peak_rss_mb()
+        traced = scope.peak_traced / 1e6 if self.trace_memory else None
+
+        if scope.kind == 'stage':
+
+            for stages in self.stage_tables():
+                add_stage(stages, scope.name, seconds, scope.items, rss, traced)
+
+            return
+
+        record = scope.record
+        record['seconds'] += seconds
+        record['peak_rss_mb'] = rss
+        if traced is not None:
+            record['peak_traced_mb'] = traced
+
+        if scope.kind == 'post':
+            self.posts.append(record)
+            if self.current_file is not None:
+                self.current_file.record['posts'] += 1
+                self.current_file.record['comments'] += record['comments']
+
+    #stage_tables returns the tables a stage is added to: the whole run's, the current file's, and the current post's.
+    def stage_tables(self):
+
+        tables = [self.stages]
+
+        for scope in (self.current_file, self.current_post):
+            if scope is not None:
+                tables.append(scope.record['stages'])
+
+        return tables
+
+    """
+    report returns everything measured since the instruments were enabled: the wall time and peak memory
+    of the run, the stages of the run, and the stages of each file and each post.  extra (e.g., the
+    settings of the run, or the stem cache statistics) is added to the report as is.
+    """
+    def report(self, extra = None):
+
+        report = {'started':self.started,
+                  'seconds':time.perf_counter() - self.start,
+                  'peak_rss_mb':peak_rss_mb(),
+                  'stages':self.stages,
+                  'files':self.files,
+                  'posts':self.posts}
+
+        if self.trace_memory:
+            report['peak_traced_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+
+        if extra is not None:
+            report.update(extra)
+
+        return report
+
+    #save writes the report to a JSON file.
+    def save(self, directory, extra = None):
+
+        report = self.report(extra)
+
+        with open(directory, 'w') as outfile:
+            json.dump(report, outfile, indent = 2)
+
+        return report
+
+#add_stage adds one run of a stage to a table of stages.
+def add_stage(stages, name, seconds, items, rss, traced):
+
+    stage = stages.get(name)
+
+    if stage is None:
+        stage = stages[name] = {'calls':0, 'seconds':0.0, 'items':0, 'peak_rss_mb':None}
+
+    stage['calls'] += 1
+    stage['seconds'] += seconds
+    stage['items'] += items
+
+    if rss is not None:
+        stage['peak_rss_mb'] = max(stage['peak_rss_mb'] or 0, rss)
+
+    if traced is not None:
+        stage['peak_traced_mb'] = max(stage.get('peak_traced_mb', 0), traced)
+
+"""
+summary turns a report into a short text: the wall time and peak memory of the run, the stages from
+slowest to fastest (with their share of the run), and the slowest posts.
+"""
+def summary(report, slowest = 5):
+
+    lines = ['Run took %.2f seconds, peak memory %s' % (report['seconds'],
+        'unknown' if report['peak_rss_mb'] is None else '%.1f MB' % report['peak_rss_mb'])]
+
+    lines.append('%-16s %10s %8s %12s %12s' % ('stage', 'seconds', 'share', 'calls', 'items'))
+
+    for name, stage in sorted(report['stages'].items(), key = lambda item: -item[1]['seconds']):
+        lines.append('%-16s %10.3f %7.1f%% %12d %12d' % (name, stage['seconds'],
+            100.0 * stage['seconds'] / max(report['seconds'], 1e-9), stage['calls'], stage['items']))
+
+    posts = sorted(report['posts'], key = lambda post: -post['seconds'])[:slowest]
+
+    if posts:
+        lines.append('Slowest posts:')
+        for post in posts:
+            lines.append('  %s (%s): %.3f seconds, %d comments' % (post['id'], post['file'], post['seconds'], post['comments']))
+
+    return '\n'.join(lines)
+
+#The instruments shared by every module of a run. They are disabled until a run enables them.
+instruments = Instruments()
@@ -0,0 +1,164 @@
+"""
+Project Name: Attitude Change on Change My View (Study 2)
+Name: json_lines.py
+
+Description of this script:
+
+    Read and write Reddit discussion data in the JSON Lines format, where
+    every line of a .jsonl file is one discussion (a post and its comments).
+
+    Unlike a .json file, which holds the whole dataset as a single list, a
+    .jsonl file can be written one discussion at a time as the discussions are
+    collected or coded, and read back lazily one discussion at a time.  So we
+    only ever hold the largest single discussion in memory, and a crash half
+    way through a collection only loses the discussion being collected.
+
+    The legacy list format is kept as an import/export option.  To convert
+    between the two formats, run:
+
+        python json_lines.py export data/20180815182030_posts.jsonl data/20180815182030_posts.json
+        python json_lines.py import data/20180815182030_posts.json data/20180815182030_posts.jsonl
+
+    read_posts also reads sharded datasets (a directory of compressed shards,
+    see sharded.py).  To pack a data file into one, run:
+
+        python json_lines.py pack data/20180815182030_posts.jsonl data/20180815182030_posts.shards
+
+Authors: J. Hunter Priniski & Zachary Horne
+"""
+
+#REQUIREMENTS
+import os
+import json
+import argparse
+
+import sharded
+
+#read_posts lazily yields the discussions in a .jsonl file, one at a time.  A legacy .json
+#file (a single list of discussions) is read in whole and then yielded one at a time, and
+#a sharded dataset is read one discussion at a time, like a .jsonl file.
+def read_posts(directory):
+
+    if sharded.is_sharded(directory):
+        yield from sharded.read_posts(directory)
+        return
+
+    if not directory.endswith('.jsonl'):
+
+        with open(directory, 'r') as json_file:
+            data = json.load(json_file)
+
+        for post in data:
+            yield post
+
+        return
+
+    with open(directory, 'r') as json_file:
+
+        for line in json_file:
+
+            #Skip blank lines, e.g. a trailing newline.
+            if line.strip():
+                yield json.loads(line)
+
+#JsonLinesWriter writes discussions to a .jsonl file as they come, one discussion per line.
+#Each line is flushed as soon as it is written, so a crash never loses a finished discussion.
+class JsonLinesWriter:
+
+    def __init__(self, directory, mode = 'w'):
+
+        self.directory = directory
+        self.outfile = open(directory, mode)
+        self.count = 0
+
+    def write(self, post):
+
+        self.outfile.write(json.dumps(post) + '\n')
+        self.outfile.flush()
+        self.count += 1
+
+        return True
+
+    def close(self):
+
+        self.outfile.close()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc_info):
+
+        self.close()
+
+#If a writer crashed half way through a line, the last line of the file is incomplete.
+#truncate_partial_line cuts the file back to its last complete line, so we can append to it again.
+def truncate_partial_line(directory):
+
+    with open(directory, 'rb+') as json_file:
+
+        json_file.seek(0, os.SEEK_END)
+        size = json_file.tell()
+        end = size
+
+        #Walk back from the end of the file to the last newline.
+        while end > 0:
+            step = min(end, 65536)
+            json_file.seek(end - step)
+            block = json_file.read(step)
+            newline = block.rfind(b'\n')
+            if newline >= 0:
+                end = end - step + newline + 1
+                break
+            end -= step
+
+        if end < size:
+            json_file.truncate(end)
+
+    return size - end
+
+#Export a .jsonl file to the legacy .json format (a single list of discussions).
+def export_json(source, destination):
+
+    with open(destination, 'w') as outfile:
+        json.dump(list(read_posts(source)), outfile)
+
+    return True
+
+#Import a legacy .json file (a single list of discussions) into the .jsonl format.
+def import_json(source, destination):
+
+    with JsonLinesWriter(destination) as writer:
+        for post in read_posts(source):
+            writer.write(post)
+
+    return True
+
+#Pack a data file (.json, .jsonl, or another sharded dataset) into a sharded dataset (see sharded.py).
+def pack_shards(source, destination, codec = None, shard_size = sharded.SHARD_SIZE):
+
+    sharded.pack(read_posts(source), destination, codec, shard_size)
+
+    return True
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Convert discussion data between the .json, .jsonl, and sharded formats.')
+    parser.add_argument('command', choices = ['import', 'export', 'pack'],
+        help = 'import a .json file (or a sharded dataset) into .jsonl, export a .jsonl file to .json, or pack a data file into a sharded dataset')
+    parser.add_argument('source')
+    parser.add_argument('destination')
+    parser.add_argument('--codec', choices = sorted(sharded.EXTENSIONS), default = None,
+        help = 'compression of the shards of pack (default: zstd if the zstandard package is installed, gzip otherwise)')
+    parser.add_argument('--shard-size', type = int, default = sharded.SHARD_SIZE // (1024 * 1024),
+        help = 'megabytes of compressed discussions in each shard of pack (default: 64)')
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        import_json(args.source, args.destination)
+    elif args.command == 'export':
+        export_json(args.source, args.destination)
+    else:
+        pack_shards(args.source, args.destination, args.codec, args.shard_size * 1024 * 1024)
+
+    print("Data succesfully written to file %s" % os.path.basename(args.destination))
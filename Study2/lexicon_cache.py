@@ -0,0 +1,65 @@
+"""
+Project Name: Attitude Change on Change My View (Study 2)
+Name: lexicon_cache.py
+
+Description of this script:
+
+    Save the compiled lexicons (our stemmed topic and evidence language term
+    lists, and the matcher compiled from them) to a file, and load them back
+    on the next run instead of compiling them again.
+
+    Compiling the lexicons reads 14 term lists, stems every phrase, sorts and
+    removes duplicates, and builds the matcher, before a single comment is
+    coded.  Every run did this, and so did every worker process and every
+    notebook that imported discussion_analysis.py.  Loading the saved lexicons
+    takes a few milliseconds.
+
+    The saved lexicons are stored with a key: a hash of the content of every
+    term list and the version of the stemmer (see lexicon_version in
+    discussion_analysis.py), and the format of the file.  If a term list is
+    edited, or the stemmer changes, the key no longer matches, and the
+    lexicons are compiled and saved again.
+
+    The file is a pickle, since the matcher holds dictionaries keyed by None,
+    which JSON can't store.  Only load lexicons this script saved.
+
+Authors: J. Hunter Priniski & Zachary Horne
+"""
+
+#REQUIREMENTS
+import os
+import pickle
+
+#The format of the saved file. Changing what is saved (e.g., the layout of the matcher) must change this.
+FORMAT = 1
+
+#load returns the lexicons saved in the file directory under key, or None if there are none.
+def load(directory, key):
+
+    if not os.path.exists(directory):
+        return None
+
+    try:
+        with open(directory, 'rb') as cache_file:
+            saved = pickle.load(cache_file)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+        return None
+
+    if not isinstance(saved, dict) or saved.get('format') != FORMAT or saved.get('key') != key:
+        return None
+
+    return saved['lexicons']
+
+#save saves the lexicons to the file directory under key. The file is replaced in one step,
+#so a worker process loading the lexicons never sees a half written file.
+def save(directory, key, lexicons):
+
+    saved = {'format':FORMAT, 'key':key, 'lexicons':lexicons}
+
+    temporary = '%s.%d.tmp' % (directory, os.getpid())
+    with open(temporary, 'wb') as cache_file:
+        pickle.dump(saved, cache_file, protocol = pickle.HIGHEST_PROTOCOL)
+
+    os.replace(temporary, directory)
+
+    return True
@@ -0,0 +1,193 @@
+"""
+Project Name: Attitude Change on Change My View (Study 2)
+Name: link_extractor.py
+
+Description of this script:
+
+    Find the links in a comment without building a BeautifulSoup tree.
+
+    discussion_analysis.py codes a comment's links as every <a> tag in its
+    body_html whose href starts with http:// or https://, written out the way
+    BeautifulSoup writes the tag (e.g., <a href="https://www.cdc.gov/">CDC</a>).
+    Parsing the whole body_html of every comment just to find these tags was
+    the second biggest cost of coding a dataset.
+
+    Reddit renders markdown into very regular HTML, so almost every anchor is
+    a plain <a href="...">text</a>, which BeautifulSoup writes out exactly as
+    it appears in body_html (BeautifulSoup only puts the attributes in
+    alphabetical order).  extract_links finds these anchors with a single
+    precompiled pattern.  If a comment holds anything the pattern can't vouch
+    for (an anchor around other tags, unusual quoting or entities, script or
+    comment sections), the comment is handed to BeautifulSoup instead, so the
+    links are always the same as BeautifulSoup's.
+
+    link_url, normalize_url, and link_domain turn a link into its URL and the
+    domain it points to (e.g., cdc.gov), for per-domain citation analysis.
+
+    To check that extract_links finds the same links as BeautifulSoup in a
+    data file, and time the two, run:
+
+        python link_extractor.py data/20180815182030_posts.jsonl
+
+Authors: J. Hunter Priniski & Zachary Horne
+"""
+
+#REQUIREMENTS
+import re
+import sys
+import html
+import time
+import argparse
+from urllib.parse import urlsplit, urlunsplit
+
+from json_lines import read_posts
+
+#The text of an attribute value or an anchor: anything but quotes, tags, and entities, except &amp; &lt; and &gt;,
+#which BeautifulSoup writes back out unchanged.  Values are single words separated by single spaces, since
+#BeautifulSoup rewrites the whitespace in some attributes (e.g., rel and class).
+VALUE = r'(?:[^\s"<>&]|&(?:amp|lt|gt);)+(?: (?:[^\s"<>&]|&(?:amp|lt|gt);)+)*'
+TEXT = r'(?:[^<>&]|&(?:amp|lt|gt);)*'
+
+#A plain anchor: <a, then attributes written as name="value", then text with no tags inside, then </a>.
+ANCHOR = re.compile(r'<a((?: [a-z][a-z-]*="(?:%s)?")*)>(%s)</a>' % (VALUE, TEXT))
+ATTRIBUTE = re.compile(r' ([a-z][a-z-]*)="([^"]*)"')
+
+#Every opening <a> tag, in any case, whether or not it is a plain anchor.
+ANCHOR_START = re.compile(r'<a[\s/>]', re.IGNORECASE)
+
+#Sections whose text BeautifulSoup does not parse as tags (comments, CDATA, scripts, and styles),
+#and < inside a quoted attribute value.  A comment holding any of these is handed to BeautifulSoup.
+UNUSUAL = re.compile(r'<!|<\?|<script|<style|<textarea|<title|="[^"]*<|=\'[^\']*<', re.IGNORECASE)
+
+#soup_links finds the links with BeautifulSoup, as discussion_analysis always has.
+def soup_links(body_html):
+
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(body_html, 'html.parser')
+    link_list_tag = soup.find_all('a', attrs={'href': re.compile("^https?://")})
+
+    return [str(link) for link in link_list_tag]
+
+"""
+extract_links returns the links in the body_html of a comment: every <a> tag whose href starts with
+http:// or https://, as BeautifulSoup would write it.  If every anchor in body_html is a plain anchor,
+the links are cut straight out of body_html; otherwise they are found with BeautifulSoup.
+"""
+def extract_links(body_html):
+
+    if body_html is None or '<a' not in body_html.lower():
+        return []
+
+    if UNUSUAL.search(body_html):
+        return soup_links(body_html)
+
+    anchors = list(ANCHOR.finditer(body_html))
+
+    #Some anchor isn't plain (e.g., it holds a tag, or is never closed), so we can't vouch for it.
+    if len(anchors) != len(ANCHOR_START.findall(body_html)):
+        return soup_links(body_html)
+
+    links = []
+
+    for anchor in anchors:
+
+        attributes = ATTRIBUTE.findall(anchor.group(1))
+        values = dict(attributes)
+
+        #BeautifulSoup keeps only one of two attributes with the same name.
+        if len(values) != len(attributes):
+            return soup_links(body_html)
+
+        if not re.match('https?://', values.get('href', '')):
+            continue
+
+        #BeautifulSoup writes the attributes in alphabetical order.
+        if [name for name, value in attributes] == sorted(values):
+            links.append(anchor.group(0))
+        else:
+            links.append('<a%s>%s</a>' % (''.join(' %s="%s"' % (name, values[name]) for name in sorted(values)), anchor.group(2)))
+
+    return links
+
+#link_url returns the URL a link points to (the href of the anchor), or None.
+def link_url(link):
+
+    href = re.search(r'''href=(?:"([^"]*)"|'([^']*)')''', link)
+
+    if href is None:
+        return None
+
+    return html.unescape(href.group(1) if href.group(1) is not None else href.group(2))
+
+#The ports a scheme uses when the URL doesn't name one.
+DEFAULT_PORTS = {'http':80, 'https':443}
+
+"""
+normalize_url writes a URL the same way however it was typed: the scheme and host are lower case,
+the default port and the fragment (#...) are dropped, and an empty path is written as /.  So e.g.
+HTTPS://WWW.CDC.gov:443/flu#data and https://www.cdc.gov/flu are the same URL.
+"""
+def normalize_url(url):
+
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return url
+
+    host = (parts.hostname or '').rstrip('.')
+    if port is not None and port != DEFAULT_PORTS.get(parts.scheme.lower()):
+        host = '%s:%d' % (host, port)
+
+    return urlunsplit((parts.scheme.lower(), host, parts.path or '/', parts.query, ''))
+
+#link_domain returns the domain a URL points to, without www. (e.g., cdc.gov), or '' if it has none.
+def link_domain(url):
+
+    try:
+        host = urlsplit(url.strip()).hostname or ''
+    except ValueError:
+        return ''
+
+    host = host.rstrip('.')
+    if host.startswith('www.'):
+        host = host[4:]
+
+    return host
+
+"""
+compare_links checks that extract_links finds the same links as BeautifulSoup in every comment of
+a data file, and times the two.  It returns the number of comments, the comments whose links differ,
+and the seconds each took.
+"""
+def compare_links(directory):
+
+    bodies = [comment['body_html'] for post in read_posts(directory) for comment in post['_comments']]
+
+    start = time.perf_counter()
+    soup = [soup_links(body_html) for body_html in bodies]
+    soup_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fast = [extract_links(body_html) for body_html in bodies]
+    fast_time = time.perf_counter() - start
+
+    differ = [i for i in range(len(bodies)) if soup[i] != fast[i]]
+
+    return len(bodies), differ, soup_time, fast_time
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Check extract_links against BeautifulSoup on a data file, and time both.')
+    parser.add_argument('source', help = 'a data file, e.g. data/20180815182030_posts.jsonl')
+    args = parser.parse_args()
+
+    total, differ, soup_time, fast_time = compare_links(args.source)
+
+    print("%d comments, %d with different links" % (total, len(differ)))
+    print("BeautifulSoup: %.3f seconds" % soup_time)
+    print("extract_links: %.3f seconds (%.1fx faster)" % (fast_time, soup_time / max(fast_time, 1e-9)))
+
+    if differ:
+        sys.exit(1)
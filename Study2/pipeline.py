@@ -0,0 +1,624 @@
+"""
+Project Name: Attitude Change on Change My View (Study 2)
+Name: pipeline.py
+
+Description of this script:
+
+    Run the whole workflow with one command, and only redo the steps whose
+    inputs changed.  By hand, the workflow is: collect_posts.py, unzip the
+    data, discussion_analysis.py, test.py, and then the analysis, and every
+    step does all of its work again each time.  Here the steps are tasks in a
+    dependency graph:
+
+        collect                     collect_posts.py (only with --collect)
+        unzip:<file>.zip            unzip a zipped data file into data/
+        code:<file>                 code data/<file> (a data file or a sharded dataset,
+                                    see sharded.py) into data/coded/<file>
+        validate:<file>             run the checks of test.py on data/coded/<file>,
+                                    and save the results to data/validated/<name>.json
+        export:<file>               export data/coded/<file> to data/columnar/<name>/
+        matrix:<file>               write the document-term matrices of data/coded/<file>
+                                    to data/matrix/<name>/ (see term_matrix.py)
+
+    validate, export, and matrix only need the coded file, so they run at the same
+    time, and so do the tasks of different data files (with --jobs).
+
+    Every task has a key: a hash of the content of its input files, of the
+    scripts it runs (SCRIPTS, and the scripts they import), and of its settings.  The key of code includes the
+    version of the term lists (lexicon_version in discussion_analysis.py), and
+    the keys of validate and export are made from the content of the coded
+    file.  When a task finishes, its outputs are stored under its key in
+    .pipeline/objects/ (as hard links, so storing costs no extra space), and:
+
+        - if the outputs on disk are already the outputs stored under the key,
+          the task is skipped (cached);
+        - if the key was seen before but the outputs were deleted or are from
+          other inputs (e.g., a term list was edited and then put back), the
+          stored outputs are put back in place (restored);
+        - otherwise, the task is run.
+
+    So after editing one evidence list, collection is skipped, every data file
+    is coded again, and only the coded files whose coding actually changed are
+    validated and exported again.
+
+    To run the pipeline from Study2/:
+
+        python pipeline.py
+        python pipeline.py --jobs 4
+        python pipeline.py --collect 30 --jobs 4
+        python pipeline.py --dry-run
+
+    Deleting .pipeline/ is always safe: every task is simply run again.
+
+Authors: J. Hunter Priniski & Zachary Horne
+"""
+
+#REQUIREMENTS
+import os
+import ast
+import sys
+import json
+import shutil
+import hashlib
+import zipfile
+import argparse
+import functools
+import concurrent.futures
+
+from sharded import is_sharded
+
+#Everything the pipeline saves between runs: the stored outputs, and the hashes of the files it has seen.
+PIPELINE = '.pipeline'
+
+#The format of the keys and of the stored outputs. Changing either must change this.
+FORMAT = 1
+
+#The script each stage runs. The code of a stage is its script and every script it imports (see stage_code).
+SCRIPTS = {
+    'collect':('collect_posts.py',),
+    'unzip':(),
+    'code':('discussion_analysis.py',),
+    'validate':('test.py',),
+    'export':('columnar.py',),
+    'matrix':('term_matrix.py',),
+}
+
+#imported_scripts returns the scripts of this directory that a script imports, anywhere in it (an import
+#inside a function, e.g. of columnar in sharded.py, counts too).
+def imported_scripts(script):
+
+    with open(script, 'r') as infile:
+        tree = ast.parse(infile.read(), script)
+
+    modules = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            modules.add(node.module.split('.')[0])
+
+    return sorted(module + '.py' for module in modules if os.path.isfile(module + '.py'))
+
+#stage_code returns the scripts a stage runs: its script, and every script imported from it, directly or not.
+#If one of them is edited, the stage is run again.
+@functools.lru_cache(maxsize = None)
+def stage_code(stage):
+
+    found = []
+    pending = list(SCRIPTS[stage])
+
+    while pending:
+        script = pending.pop()
+        if script not in found:
+            found.append(script)
+            pending.extend(imported_scripts(script))
+
+    return tuple(sorted(found))
+
+#A Task is one step of the pipeline. action(*arguments) runs it, and returns True if it succeeded (collect
+#returns the files it wrote, since their names are only known once it runs). after lists the tasks whose
+#outputs are inputs of this one.
+class Task:
+
+    __slots__ = ('name', 'stage', 'action', 'arguments', 'inputs', 'outputs', 'params', 'after')
+
+    def __init__(self, name, stage, action, arguments = (), inputs = (), outputs = None, params = None, after = ()):
+
+        self.name = name
+        self.stage = stage
+        self.action = action
+        self.arguments = tuple(arguments)
+        self.inputs = list(inputs)
+        self.outputs = outputs
+        self.params = params or {}
+        self.after = list(after)
+
+#link_file hard links source to destination, or copies it where hard links are not possible.
+def link_file(source, destination):
+
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+#remove_path removes a file or a directory, if it exists.
+def remove_path(path):
+
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+#walk_files returns every file under path (or path itself, if it is a file), in the same order on every run.
+def walk_files(path):
+
+    if not os.path.isdir(path):
+        return [path]
+
+    files = []
+    for root, directories, names in os.walk(path):
+        directories.sort()
+        files.extend(os.path.join(root, name) for name in sorted(names))
+
+    return files
+
+#unshare gives every hard linked file under path a copy of its own, so a task that writes to the file in
+#place doesn't also change the outputs stored in .pipeline/objects/.
+def unshare(path):
+
+    if not os.path.exists(path):
+        return
+
+    for file in walk_files(path):
+        if os.stat(file).st_nlink > 1:
+            shutil.copy2(file, file + '.unshare')
+            os.replace(file + '.unshare', file)
+
+"""
+A Store holds the outputs of every task run so far, under the task's key, and remembers the hash of every
+file it has read, with the file's size and modification time, so an unchanged file is never read twice.
+"""
+class Store:
+
+    def __init__(self, directory = PIPELINE):
+
+        self.directory = directory
+        self.objects = os.path.join(directory, 'objects')
+        self.hashes_file = os.path.join(directory, 'hashes.json')
+        self.hashes = {}
+
+        if os.path.exists(self.hashes_file):
+            try:
+                with open(self.hashes_file, 'r') as json_file:
+                    saved = json.load(json_file)
+                if saved.get('format') == FORMAT:
+                    self.hashes = saved['hashes']
+            except (OSError, ValueError, KeyError):
+                self.hashes = {}
+
+    #hash returns the hash of the content of a file (or of every file in a directory), or None if it doesn't exist.
+    def hash(self, path):
+
+        if os.path.isdir(path):
+
+            digest = hashlib.sha256()
+            for file in walk_files(path):
+                digest.update(os.path.relpath(file, path).encode())
+                digest.update(self.hash(file).encode())
+
+            return digest.hexdigest()
+
+        try:
+            info = os.stat(path)
+        except OSError:
+            return None
+
+        stamp = [info.st_size, info.st_mtime_ns]
+        known = self.hashes.get(path)
+        if known is not None and known[:2] == stamp:
+            return known[2]
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as in_file:
+            for block in iter(lambda: in_file.read(1 << 20), b''):
+                digest.update(block)
+
+        self.hashes[path] = stamp + [digest.hexdigest()]
+
+        return digest.hexdigest()
+
+    def object_path(self, key):
+        return os.path.join(self.objects, key[:2], key)
+
+    #lookup returns the outputs stored under key (a dictionary of path to hash), or None if there are none.
+    def lookup(self, key):
+
+        try:
+            with open(os.path.join(self.object_path(key), 'outputs.json'), 'r') as json_file:
+                return json.load(json_file)
+        except (OSError, ValueError):
+            return None
+
+    #save stores the outputs of a task under key, and returns them (a dictionary of path to hash).
+    def save(self, key, outputs):
+
+        final = self.object_path(key)
+        temporary = '%s.%d.tmp' % (final, os.getpid())
+        remove_path(temporary)
+        os.makedirs(os.path.join(temporary, 'files'))
+
+        recorded = {}
+
+        for number, path in enumerate(outputs):
+
+            stored = os.path.join(temporary, 'files', str(number))
+
+            if os.path.isdir(path):
+                shutil.copytree(path, stored, copy_function = link_file)
+            else:
+                link_file(path, stored)
+
+            recorded[path] = self.hash(path)
+
+        with open(os.path.join(temporary, 'outputs.json'), 'w') as outfile:
+            json.dump(recorded, outfile)
+
+        remove_path(final)
+        os.replace(temporary, final)
+
+        return recorded
+
+    #restore puts the outputs stored under key back in place, and returns True if they are now as they were stored.
+    def restore(self, key, recorded):
+
+        stored = os.path.join(self.object_path(key), 'files')
+
+        for number, path in enumerate(recorded):
+
+            remove_path(path)
+
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok = True)
+
+            source = os.path.join(stored, str(number))
+
+            if os.path.isdir(source):
+                shutil.copytree(source, path, copy_function = link_file)
+            elif os.path.exists(source):
+                link_file(source, path)
+
+        return self.is_current(recorded)
+
+    #is_current returns True if every output on disk is the one that was stored.
+    def is_current(self, recorded):
+        return all(self.hash(path) == digest for path, digest in recorded.items())
+
+    def close(self):
+
+        os.makedirs(self.directory, exist_ok = True)
+
+        temporary = '%s.%d.tmp' % (self.hashes_file, os.getpid())
+        with open(temporary, 'w') as outfile:
+            json.dump({'format':FORMAT, 'hashes':self.hashes}, outfile)
+
+        os.replace(temporary, self.hashes_file)
+
+#task_key returns the key of a task: a hash of its stage, settings, outputs, and the content of its inputs and scripts.
+def task_key(task, store):
+
+    content = {'format':FORMAT, 'stage':task.stage, 'params':task.params, 'outputs':task.outputs,
+               'inputs':[[path, store.hash(path)] for path in task.inputs],
+               'code':[[path, store.hash(path)] for path in stage_code(task.stage)]}
+
+    return hashlib.sha256(json.dumps(content, sort_keys = True).encode()).hexdigest()
+
+"""
+THE ACTIONS BELOW RUN THE TASKS.  THEY ARE RUN IN WORKER PROCESSES (WITH --jobs), SO THEY IMPORT THE
+SCRIPTS THEY NEED THEMSELVES, AND ONLY TAKE ARGUMENTS THAT CAN BE SENT TO ANOTHER PROCESS.
+"""
+
+#run_collect collects the top limit posts of Change My View, and returns the data file it wrote.
+def run_collect(limit, workers, replay, recollect):
+
+    import collect_posts
+
+    return [collect_posts.main(limit = limit, workers = workers, replay = replay, recollect = recollect)]
+
+#run_unzip extracts the data files (.json and .jsonl) in a zip file into data/.
+def run_unzip(source, members):
+
+    with zipfile.ZipFile(source) as archive:
+        for member, destination in members.items():
+            with archive.open(member) as in_file, open(destination + '.tmp', 'wb') as outfile:
+                shutil.copyfileobj(in_file, outfile)
+            os.replace(destination + '.tmp', destination)
+
+    return True
+
+#run_code codes the data file data/filename, as discussion_analysis.py does.
+def run_code(filename, incremental):
+
+    import discussion_analysis
+
+    os.makedirs('data/coded', exist_ok = True)
+
+    discussion_analysis.stemmer.load(discussion_analysis.STEM_CACHE)
+    lexicons = discussion_analysis.load_lexicons()
+
+    discussion_analysis.code_file(filename, lexicons, incremental = incremental)
+
+    discussion_analysis.stemmer.save(discussion_analysis.STEM_CACHE)
+
+    return True
+
+#run_validate runs the checks of test.py on a coded data file, saves the results, and returns True if every check passed.
+def run_validate(source, destination):
+
+    import test
+    from json_lines import read_posts
+
+    results = test.run_tests(list(read_posts(source)), expected_posts = None)
+    passed = all(passed for description, passed in results)
+
+    os.makedirs(os.path.dirname(destination), exist_ok = True)
+    with open(destination, 'w') as outfile:
+        json.dump({'source':source, 'passed':passed,
+                   'tests':[{'test':description.strip(), 'passed':passed} for description, passed in results]}, outfile, indent = 2)
+
+    if not passed:
+        print("Validation of %s failed, see %s" % (source, destination))
+
+    return passed
+
+#run_export exports a coded data file to a columnar store (see columnar.py).
+def run_export(source, destination, use_parquet):
+
+    import columnar
+
+    #Tables left over from an earlier export (e.g., .npz files, when we now write .parquet) are removed first.
+    remove_path(destination)
+    return columnar.export_columnar(source, destination, use_parquet)
+
+#run_matrix writes the document-term matrices of a coded data file (see term_matrix.py).
+def run_matrix(source, destination):
+
+    import term_matrix
+    import discussion_analysis
+
+    discussion_analysis.stemmer.load(discussion_analysis.STEM_CACHE)
+    term_matrix.build_matrix(source, destination)
+    discussion_analysis.stemmer.save(discussion_analysis.STEM_CACHE)
+
+    return True
+
+#data_files returns the data files in data/ that are coded, in the same order as discussion_analysis.py codes them.
+def data_files():
+
+    if not os.path.isdir('data'):
+        return []
+
+    return [filename for filename in sorted(os.listdir('data'))
+        if filename.endswith('.json') or filename.endswith('.jsonl') or is_sharded(os.path.join('data', filename))]
+
+#first_tasks returns the tasks that make data files: collect (if limit is given) and unzipping every zip file in data/.
+def first_tasks(limit = None, collect_workers = 1, replay = None, recollect = False):
+
+    tasks = []
+
+    if limit is not None:
+
+        params = {'limit':limit}
+
+        #The same collection is reused unless --recollect is given; then the posts are collected again, into a new file.
+        if recollect:
+            params['run'] = os.urandom(8).hex()
+
+        tasks.append(Task('collect', 'collect', run_collect, (limit, collect_workers, replay, recollect),
+            inputs = [replay] if replay is not None else [], params = params))
+
+    if os.path.isdir('data'):
+        for filename in sorted(os.listdir('data')):
+
+            if not filename.endswith('.zip'):
+                continue
+
+            source = os.path.join('data', filename)
+            with zipfile.ZipFile(source) as archive:
+                members = {member:os.path.join('data', os.path.basename(member)) for member in archive.namelist()
+                    if member.endswith('.json') or member.endswith('.jsonl')}
+
+            tasks.append(Task('unzip:' + filename, 'unzip', run_unzip, (source, members),
+                inputs = [source], outputs = sorted(members.values())))
+
+    return tasks
+
+#file_tasks returns the code, validate, export, and matrix tasks of every data file.
+def file_tasks(lexicons, incremental = False, validate = True, export = True, use_parquet = True, matrix = True):
+
+    tasks = []
+
+    for filename in data_files():
+
+        name = filename.split('.')[0]
+        coded = 'data/coded/' + filename
+
+        tasks.append(Task('code:' + filename, 'code', run_code, (filename, incremental), inputs = ['data/' + filename],
+            outputs = [coded], params = {'lexicons':lexicons}))
+
+        if validate:
+            destination = 'data/validated/' + name + '.json'
+            tasks.append(Task('validate:' + filename, 'validate', run_validate, (coded, destination), inputs = [coded],
+                outputs = [destination], after = ['code:' + filename]))
+
+        if export:
+            destination = os.path.join('data', 'columnar', name)
+            tasks.append(Task('export:' + filename, 'export', run_export, (coded, destination, use_parquet), inputs = [coded],
+                outputs = [destination], params = {'parquet':use_parquet}, after = ['code:' + filename]))
+
+        #The matrices have a column for every term of the term lists, so they depend on the term lists too.
+        if matrix:
+            destination = os.path.join('data', 'matrix', name)
+            tasks.append(Task('matrix:' + filename, 'matrix', run_matrix, (coded, destination), inputs = [coded],
+                outputs = [destination], params = {'lexicons':lexicons}, after = ['code:' + filename]))
+
+    return tasks
+
+"""
+run_tasks runs every task once the tasks it comes after are done, up to jobs tasks at a time, and returns the
+status of each task: cached, restored, ran, failed, or skipped (a task it comes after failed).  With dry_run,
+nothing is run or restored, and tasks that would be are reported as such.
+"""
+def run_tasks(tasks, store, jobs = 1, dry_run = False):
+
+    status = {}
+    pending = list(tasks)
+    running = {}
+
+    def report(task, result):
+        status[task.name] = result
+        print('%-12s %s' % (result, task.name))
+
+    #finish stores the outputs of a task that ran, so the next run can skip it.
+    def finish(task, key, result, error = None):
+
+        if error is not None:
+            print("Task %s failed: %r" % (task.name, error))
+            return report(task, 'failed')
+
+        if not result:
+            return report(task, 'failed')
+
+        outputs = task.outputs if task.outputs is not None else result
+        store.save(key, outputs)
+        report(task, 'ran')
+
+    executor = None
+    if jobs > 1 and not dry_run:
+        executor = concurrent.futures.ProcessPoolExecutor(jobs)
+
+    try:
+        while pending or running:
+
+            for task in list(pending):
+
+                after = [status.get(name) for name in task.after]
+                if None in after:
+                    continue
+
+                pending.remove(task)
+
+                if any(result in ('failed', 'skipped') for result in after):
+                    report(task, 'skipped')
+                    continue
+
+                if any(result.startswith('would') for result in after):
+                    report(task, 'would run')
+                    continue
+
+                missing = [path for path in task.inputs if store.hash(path) is None]
+                if missing:
+                    print("Task %s is missing its input %s" % (task.name, missing[0]))
+                    report(task, 'failed')
+                    continue
+
+                key = task_key(task, store)
+                recorded = store.lookup(key)
+
+                if recorded is not None:
+
+                    if store.is_current(recorded):
+                        report(task, 'cached')
+                        continue
+
+                    if dry_run:
+                        report(task, 'would restore')
+                        continue
+
+                    if store.restore(key, recorded):
+                        report(task, 'restored')
+                        continue
+
+                if dry_run:
+                    report(task, 'would run')
+                    continue
+
+                for path in task.outputs or ():
+                    unshare(path)
+
+                if executor is None:
+                    try:
+                        finish(task, key, task.action(*task.arguments))
+                    except Exception as error:
+                        finish(task, key, None, error)
+                else:
+                    running[executor.submit(task.action, *task.arguments)] = (task, key)
+
+            if running:
+                done, waiting = concurrent.futures.wait(running, return_when = concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    task, key = running.pop(future)
+                    error = future.exception()
+                    finish(task, key, None if error is not None else future.result(), error)
+
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return status
+
+"""
+run_pipeline runs the pipeline in two steps: first the tasks that make data files (collect and unzip), and
+then, once we know every data file, the code, validate, export, and matrix tasks of each file.  It returns the status
+of every task.
+"""
+def run_pipeline(jobs = 1, limit = None, collect_workers = 1, replay = None, recollect = False, incremental = False,
+                 validate = True, export = True, use_parquet = True, matrix = True, dry_run = False):
+
+    import discussion_analysis
+
+    store = Store()
+
+    try:
+        status = run_tasks(first_tasks(limit, collect_workers, replay, recollect), store, jobs, dry_run)
+
+        tasks = file_tasks(discussion_analysis.lexicon_version(), incremental, validate, export, use_parquet, matrix)
+        status.update(run_tasks(tasks, store, jobs, dry_run))
+
+    finally:
+        store.close()
+
+    return status
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Collect, code, validate, export, and make matrices of the CMV data, only redoing what changed.')
+    parser.add_argument('--jobs', type = int, default = 1,
+        help = 'number of tasks to run at the same time (default: 1)')
+    parser.add_argument('--collect', type = int, default = None, metavar = 'LIMIT',
+        help = 'first collect the top LIMIT posts (default: use the data files already in data/)')
+    parser.add_argument('--collect-workers', type = int, default = 1,
+        help = 'number of submissions to collect at the same time (default: 1)')
+    parser.add_argument('--replay', default = None,
+        help = 'collect from a fake Reddit that serves the discussions in this data file')
+    parser.add_argument('--recollect', action = 'store_true',
+        help = 'collect the posts again, even if they were already collected')
+    parser.add_argument('--incremental', action = 'store_true',
+        help = 'when a data file is coded again, reuse the coding of unchanged discussions (see discussion_analysis.py)')
+    parser.add_argument('--no-validate', action = 'store_true', help = 'do not validate the coded files')
+    parser.add_argument('--no-export', action = 'store_true', help = 'do not export the coded files to columnar stores')
+    parser.add_argument('--no-matrix', action = 'store_true', help = 'do not write the document-term matrices of the coded files')
+    parser.add_argument('--npz', action = 'store_true', help = 'export .npz files even if pyarrow is installed')
+    parser.add_argument('--dry-run', action = 'store_true', help = 'only report which tasks would run')
+    args = parser.parse_args()
+
+    status = run_pipeline(jobs = args.jobs, limit = args.collect, collect_workers = args.collect_workers, replay = args.replay,
+        recollect = args.recollect, incremental = args.incremental, validate = not args.no_validate, export = not args.no_export,
+        use_parquet = not args.npz, matrix = not args.no_matrix, dry_run = args.dry_run)
+
+    counts = {}
+    for result in status.values():
+        counts[result] = counts.get(result, 0) + 1
+    print(', '.join('%d %s' % (count, result) for result, count in sorted(counts.items())) or 'Nothing to do')
+
+    sys.exit(1 if 'failed' in counts or 'skipped' in counts else 0)
@@ -0,0 +1,560 @@
+"""
+Project Name: Attitude Change on Change My View (Study 2)
+Name: search_index.py
+
+Description of this script:
+
+    Build an inverted index of coded discussions (the output of
+    discussion_analysis.py), and query it.  To find, e.g., the comments that
+    use stats language in religion discussions and were awarded a delta, we
+    used to walk every coded file in Python.
+
+    Every discussion is a row of the index (its title and selftext, written
+    by the original poster), followed by a row for each of its comments, so
+    a discussion without comments can be found too.  The index maps each key
+    to the rows it applies to:
+
+        is:post, is:comment the row is a discussion, or a comment
+        term:<stem>         the row uses the word (stemmed, as in discussion_analysis.prepare):
+                            in the body of a comment, or the title or selftext of a discussion
+        topic:<category>    the row is (in) a discussion of the topic (e.g., topic:religion)
+        evidence:<category> the comment uses the type of evidence (e.g., evidence:stats)
+        author:<name>       the row was written by the author
+        domain:<domain>     the comment links to the domain (see link_extractor.link_domain)
+
+    and also stores the Delta.count, score, and created_utc of every row, so
+    queries can filter on them (Delta.count is 0 for a discussion).  A query
+    combines keys and filters with AND, OR, NOT, and parentheses (AND is
+    implied between two terms):
+
+        evidence:stats topic:religion delta > 0
+        (domain:wikipedia.org OR domain:ncbi.nlm.nih.gov) AND NOT author:[deleted] score >= 10
+        term:statistics is:comment created_utc < 1534000000
+        is:post term:vaccin
+
+    The words of term: keys are stemmed the same way the comments were.
+
+    The index is a directory of NumPy arrays.  The rows of a key (its
+    postings) are a sorted array of row numbers, or, for a key that applies
+    to more than one in 32 rows, a bitmap with one bit per row.  The arrays
+    are memory mapped when the index is opened, so opening it reads almost
+    nothing, and a query only reads the postings of its keys.  To build an
+    index and query it, run from Study2/:
+
+        python search_index.py build data/coded/20180815182030_posts.json --destination data/index
+        python search_index.py query data/index "evidence:stats topic:religion delta > 0"
+
+    Or, in Python:
+
+        from search_index import SearchIndex
+        index = SearchIndex('data/index')
+        found = index.search('evidence:stats topic:religion delta > 0')
+        index.comment_ids(found), index.post_ids(found)
+
+    (comment_ids returns the ids of the comments found, and post_ids the ids
+    of the discussions they were found in, or that were found themselves.)
+
+Authors: J. Hunter Priniski & Zachary Horne
+"""
+
+#REQUIREMENTS
+import os
+import re
+import sys
+import json
+import time
+import bisect
+import argparse
+import operator
+from array import array
+
+import numpy as np
+
+from json_lines import read_posts
+from link_extractor import link_url, link_domain
+from columnar import pack_strings, PackedStrings
+
+#The format of the index. Changing what is saved must change this.
+FORMAT = 2
+
+#A key that applies to more than one in BITMAP_DENSITY rows is stored as a bitmap, which is then smaller than its array.
+BITMAP_DENSITY = 32
+
+#The fields of a key, and the numeric columns a query can filter on (with the names they can be given in a query).
+FIELDS = ('is', 'term', 'topic', 'evidence', 'author', 'domain')
+COLUMNS = {'delta':'delta', 'Delta.count':'delta', 'score':'score', 'created_utc':'created_utc'}
+
+COMPARISONS = {'<':operator.lt, '<=':operator.le, '>':operator.gt, '>=':operator.ge, '=':operator.eq, '==':operator.eq, '!=':operator.ne}
+
+#row_keys returns every key of a row (a discussion or a comment), given its text and the keys of its discussion (its topics).
+def row_keys(record, text, post_keys, prepare):
+
+    keys = set(post_keys)
+
+    keys.update('term:' + term for term in prepare(text))
+
+    for category, classification in (record.get('evidence_use') or {}).items():
+        if classification['match']:
+            keys.add('evidence:' + category)
+
+    keys.add('author:' + str(record.get('author')))
+
+    for link in record.get('links') or ():
+        url = link_url(link)
+        if url is not None:
+            domain = link_domain(url)
+            if domain:
+                keys.add('domain:' + domain)
+
+    return keys
+
+def number(value, default):
+    return default if value is None else value
+
+"""
+build_index indexes every discussion and comment in the coded data files sources, in order, and saves the
+index in the directory destination.  Each row (a discussion, then each of its comments) is numbered in the
+order it is read, and its keys are added as (key, row number) pairs; the pairs are then sorted by key once,
+so building the index takes one pass over the data and one sort.
+"""
+def build_index(sources, destination):
+
+    #The stemmer is only needed to index the terms, so discussion_analysis is only imported when we build an index.
+    import discussion_analysis
+
+    discussion_analysis.stemmer.load(discussion_analysis.STEM_CACHE)
+
+    keys = {}
+    pair_keys = array('I')
+    pair_rows = array('I')
+
+    row_ids = []
+    post_ids = []
+    row_post = array('I')
+    is_post = array('B')
+    delta = array('q')
+    score = array('q')
+    created_utc = array('d')
+
+    #add_row numbers a row, and adds its keys and columns.
+    def add_row(record, text, post_keys, post_number, kind):
+
+        row_number = len(row_ids)
+        row_ids.append(record['id'])
+        row_post.append(post_number)
+        is_post.append(kind == 'post')
+
+        delta.append(number((record.get('Delta') or {}).get('count'), 0))
+        score.append(number(record.get('score'), 0))
+        created_utc.append(number(record.get('created_utc'), float('nan')))
+
+        for key in row_keys(record, text, post_keys + ['is:' + kind], discussion_analysis.prepare):
+            pair_keys.append(keys.setdefault(key, len(keys)))
+            pair_rows.append(row_number)
+
+    num_comments = 0
+
+    for source in sources:
+        for post in read_posts(source):
+
+            post_number = len(post_ids)
+            post_ids.append(post['id'])
+
+            post_keys = ['topic:' + category for category, classification in (post.get('topic') or {}).items()
+                if classification['match']]
+
+            #The discussion's row has the text it was classified by (see discussion_analysis.code_post).
+            add_row(post, (post.get('title') or '') + ' ' + (post.get('selftext') or ''), post_keys, post_number, 'post')
+
+            for comment in post['_comments']:
+                add_row(comment, comment.get('body') or '', post_keys, post_number, 'comment')
+                num_comments += 1
+
+    discussion_analysis.stemmer.save(discussion_analysis.STEM_CACHE)
+
+    num_rows = len(row_ids)
+
+    #Number the keys in alphabetical order, so a key can be found by binary search.
+    names = sorted(keys)
+    rank = np.empty(len(names), dtype = np.uint32)
+    rank[np.array([keys[name] for name in names], dtype = np.int64)] = np.arange(len(names), dtype = np.uint32)
+
+    key_numbers = rank[np.frombuffer(pair_keys, dtype = np.uint32)] if len(pair_keys) else np.zeros(0, dtype = np.uint32)
+    rows = np.frombuffer(pair_rows, dtype = np.uint32)
+
+    #A stable sort keeps the rows of each key in the order they were numbered.
+    order = np.argsort(key_numbers, kind = 'stable')
+    key_numbers = key_numbers[order]
+    rows = rows[order]
+
+    counts = np.bincount(key_numbers, minlength = len(names)).astype(np.uint32)
+    dense = counts.astype(np.int64) * BITMAP_DENSITY > num_rows
+
+    #Dense keys are saved as bitmaps, and the rest as arrays of row numbers.
+    bitmap_rows = np.full(len(names), -1, dtype = np.int64)
+    bitmap_rows[dense] = np.arange(int(dense.sum()))
+    bitmaps = np.zeros((int(dense.sum()), (num_rows + 7) // 8), dtype = np.uint8)
+
+    ends = np.cumsum(counts.astype(np.int64))
+    for key_number in np.flatnonzero(dense):
+        mask = np.zeros(num_rows, dtype = bool)
+        mask[rows[ends[key_number] - counts[key_number]:ends[key_number]]] = True
+        bitmaps[bitmap_rows[key_number]] = np.packbits(mask)
+
+    sparse_counts = np.where(dense, 0, counts).astype(np.int64)
+    starts = np.zeros(len(names) + 1, dtype = np.int64)
+    starts[1:] = np.cumsum(sparse_counts)
+
+    os.makedirs(destination, exist_ok = True)
+
+    arrays = {'postings':rows[~dense[key_numbers]] if len(rows) else rows,
+              'starts':starts,
+              'counts':counts,
+              'bitmap_rows':bitmap_rows,
+              'bitmaps':bitmaps,
+              'row_post':np.frombuffer(row_post, dtype = np.uint32),
+              'is_post':np.frombuffer(is_post, dtype = np.uint8).astype(bool),
+              'delta':np.frombuffer(delta, dtype = np.int64),
+              'score':np.frombuffer(score, dtype = np.int64),
+              'created_utc':np.frombuffer(created_utc, dtype = np.float64)}
+
+    for name, strings in (('keys', names), ('row_ids', row_ids), ('post_ids', post_ids)):
+        arrays[name], arrays[name + '_offsets'] = pack_strings(strings)
+
+    for name, values in arrays.items():
+        np.save(os.path.join(destination, name + '.npy'), values)
+
+    meta = {'format':FORMAT, 'sources':list(sources), 'rows':num_rows, 'comments':num_comments, 'posts':len(post_ids), 'keys':len(names)}
+    with open(os.path.join(destination, 'meta.json'), 'w') as outfile:
+        json.dump(meta, outfile, indent = 2)
+
+    return meta
+
+#Splits a query into parentheses, comparisons (e.g., delta > 0), and words (keys, AND, OR, and NOT).
+TOKEN = re.compile(r'\(|\)|[A-Za-z_.]+\s*(?:<=|>=|==|!=|<|>|=)\s*-?\d+(?:\.\d+)?|[^\s()]+')
+COMPARISON = re.compile(r'([A-Za-z_.]+)\s*(<=|>=|==|!=|<|>|=)\s*(-?\d+(?:\.\d+)?)$')
+
+"""
+parse turns a query into a tree of tuples:
+    ('key', key)                        the rows of a key
+    ('compare', column, operator, n)    the rows whose column compares to n
+    ('and', a, b, ...), ('or', a, b, ...), ('not', a)
+AND binds tighter than OR, and NOT tightest.  Raises ValueError if the query can't be parsed.
+"""
+def parse(query):
+
+    tokens = TOKEN.findall(query)
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def parse_or():
+
+        children = [parse_and()]
+        while peek() == 'OR':
+            take()
+            children.append(parse_and())
+
+        return children[0] if len(children) == 1 else ('or',) + tuple(children)
+
+    def parse_and():
+
+        children = [parse_not()]
+        while peek() is not None and peek() not in ('OR', ')'):
+            if peek() == 'AND':
+                take()
+            children.append(parse_not())
+
+        return children[0] if len(children) == 1 else ('and',) + tuple(children)
+
+    def parse_not():
+
+        token = peek()
+
+        if token is None:
+            raise ValueError('The query %r ends too early' % query)
+
+        take()
+
+        if token == 'NOT':
+            return ('not', parse_not())
+
+        if token == '(':
+            tree = parse_or()
+            if peek() != ')':
+                raise ValueError('A parenthesis is not closed in the query %r' % query)
+            take()
+            return tree
+
+        comparison = COMPARISON.match(token)
+        if comparison is not None:
+            column, comparator, value = comparison.groups()
+            if column not in COLUMNS:
+                raise ValueError('Can only filter on %s, not %s' % (', '.join(COLUMNS), column))
+            return ('compare', COLUMNS[column], comparator, float(value))
+
+        field, colon, value = token.partition(':')
+        if not colon or field not in FIELDS:
+            raise ValueError('%r is not a key: keys are %s' % (token, ', '.join(field + ':<value>' for field in FIELDS)))
+
+        return ('key', token)
+
+    tree = parse_or()
+
+    if peek() is not None:
+        raise ValueError('Unexpected %r in the query %r' % (peek(), query))
+
+    return tree
+
+class SearchIndex:
+
+    def __init__(self, directory):
+
+        self.directory = directory
+
+        with open(os.path.join(directory, 'meta.json'), 'r') as json_file:
+            self.meta = json.load(json_file)
+
+        if self.meta.get('format') != FORMAT:
+            raise ValueError('The index in %s has format %r, rebuild it with this version of search_index.py'
+                % (directory, self.meta.get('format')))
+
+        self.arrays = {}
+        for filename in os.listdir(directory):
+            if filename.endswith('.npy'):
+                self.arrays[filename[:-4]] = np.load(os.path.join(directory, filename), mmap_mode = 'r')
+
+        self.keys = PackedStrings(self.arrays['keys'], self.arrays['keys_offsets'])
+        self.num_rows = self.meta['rows']
+        self.stem = None
+
+    def __len__(self):
+        return self.num_rows
+
+    #key_number returns the number of a key, or None if no row has it.
+    def key_number(self, key):
+
+        i = bisect.bisect_left(self.keys, key)
+
+        if i < len(self.keys) and self.keys[i] == key:
+            return i
+
+        return None
+
+    #postings returns the sorted numbers of the rows that have a key.
+    def postings(self, key):
+
+        i = self.key_number(key)
+
+        if i is None:
+            return np.zeros(0, dtype = np.uint32)
+
+        row = self.arrays['bitmap_rows'][i]
+        if row >= 0:
+            bits = np.unpackbits(self.arrays['bitmaps'][row], count = self.num_rows)
+            return np.flatnonzero(bits).astype(np.uint32)
+
+        starts = self.arrays['starts']
+        return np.asarray(self.arrays['postings'][starts[i]:starts[i + 1]])
+
+    #term_key returns a key with the word of a term: key stemmed as the comments were (other keys are returned as they are).
+    def term_key(self, key):
+
+        if not key.startswith('term:'):
+            return key
+
+        if self.stem is None:
+            import discussion_analysis
+            discussion_analysis.stemmer.load(discussion_analysis.STEM_CACHE)
+            self.stem = discussion_analysis.prepare
+
+        #prepare removes punctuation before splitting, so a word stays one word.
+        words = self.stem(key[5:])
+
+        return 'term:' + words[0] if words else key
+
+    #is_sparse returns True if a key is stored as an array of row numbers (rather than a bitmap).
+    def is_sparse(self, key):
+
+        i = self.key_number(key)
+        return i is None or self.arrays['bitmap_rows'][i] < 0
+
+    #contains returns, for each of the rows candidates (a sorted array), whether it matches a parsed query.
+    def contains(self, tree, candidates):
+
+        kind = tree[0]
+
+        if kind == 'key':
+
+            key = self.term_key(tree[1])
+            i = self.key_number(key)
+
+            if i is None:
+                return np.zeros(len(candidates), dtype = bool)
+
+            #A bitmap is tested bit by bit, and an array by binary search.
+            row = self.arrays['bitmap_rows'][i]
+            if row >= 0:
+                bits = self.arrays['bitmaps'][row]
+                return (bits[candidates >> 3] & (128 >> (candidates & 7))) > 0
+
+            postings = self.postings(key)
+            places = np.searchsorted(postings, candidates)
+            return postings[np.minimum(places, len(postings) - 1)] == candidates if len(postings) else np.zeros(len(candidates), dtype = bool)
+
+        if kind == 'compare':
+            column, comparator, value = tree[1:]
+            return COMPARISONS[comparator](self.arrays[column][candidates], value)
+
+        if kind == 'not':
+            return ~self.contains(tree[1], candidates)
+
+        if kind == 'and':
+            found = np.ones(len(candidates), dtype = bool)
+            for child in tree[1:]:
+                found &= self.contains(child, candidates)
+            return found
+
+        return self.evaluate(tree)[candidates]
+
+    """
+    evaluate returns a mask of the rows that match a parsed query (True for each row that matches).
+    If an AND has a key stored as an array (a key of few rows), only those rows are tested against
+    the rest of the AND, so a selective query touches little more than the postings of its rarest key.
+    Otherwise, the keys are turned into masks and combined a whole mask at a time.
+    """
+    def evaluate(self, tree):
+
+        kind = tree[0]
+
+        if kind == 'key':
+
+            key = self.term_key(tree[1])
+            i = self.key_number(key)
+            mask = np.zeros(self.num_rows, dtype = bool)
+
+            if i is None:
+                return mask
+
+            row = self.arrays['bitmap_rows'][i]
+            if row >= 0:
+                return np.unpackbits(self.arrays['bitmaps'][row], count = self.num_rows).view(bool)
+
+            mask[self.postings(key)] = True
+            return mask
+
+        if kind == 'compare':
+            column, comparator, value = tree[1:]
+            return COMPARISONS[comparator](self.arrays[column], value)
+
+        if kind == 'not':
+            return ~self.evaluate(tree[1])
+
+        if kind == 'or':
+            mask = self.evaluate(tree[1])
+            for child in tree[2:]:
+                mask |= self.evaluate(child)
+            return mask
+
+        children = tree[1:]
+        sparse = [child for child in children if child[0] == 'key' and self.is_sparse(self.term_key(child[1]))]
+
+        if sparse:
+
+            rarest = min(sparse, key = lambda child: len(self.postings(self.term_key(child[1]))))
+            candidates = self.postings(self.term_key(rarest[1]))
+
+            rest = tuple(child for child in children if child is not rarest)
+            keep = self.contains(('and',) + rest, candidates)
+
+            mask = np.zeros(self.num_rows, dtype = bool)
+            mask[candidates[keep]] = True
+            return mask
+
+        mask = self.evaluate(children[0])
+        for child in children[1:]:
+            mask &= self.evaluate(child)
+        return mask
+
+    #search returns the sorted numbers of the rows that match a query (a string, or a tree made by parse).
+    def search(self, query):
+
+        if isinstance(query, str):
+            query = parse(query)
+
+        return np.flatnonzero(self.evaluate(query)).astype(np.uint32)
+
+    def count(self, query):
+        return len(self.search(query))
+
+    #row_ids returns the ids of the rows found by search (of a discussion, for the row of a discussion).
+    def row_ids(self, found):
+
+        ids = PackedStrings(self.arrays['row_ids'], self.arrays['row_ids_offsets'])
+        return [ids[i] for i in found]
+
+    #comment_ids returns the ids of the comments found by search (leaving out the discussions found).
+    def comment_ids(self, found):
+        return self.row_ids(np.asarray(found)[~self.arrays['is_post'][found]])
+
+    #post_ids returns the ids of the discussions found by search, or of the comments found, without duplicates.
+    def post_ids(self, found):
+
+        ids = PackedStrings(self.arrays['post_ids'], self.arrays['post_ids_offsets'])
+        return [ids[i] for i in np.unique(self.arrays['row_post'][found])]
+
+    #rows returns the kind ('post' or 'comment'), id, discussion, Delta.count, score, and created_utc of the rows found by search.
+    def rows(self, found):
+
+        row_ids = self.row_ids(found)
+        post_ids = PackedStrings(self.arrays['post_ids'], self.arrays['post_ids_offsets'])
+
+        return [{'kind':'post' if self.arrays['is_post'][i] else 'comment', 'id':row_id, 'post_id':post_ids[self.arrays['row_post'][i]],
+                 'Delta.count':int(self.arrays['delta'][i]), 'score':int(self.arrays['score'][i]), 'created_utc':float(self.arrays['created_utc'][i])}
+                for row_id, i in zip(row_ids, found)]
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Build an inverted index of coded discussions, or query it.')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+
+    build = commands.add_parser('build', help = 'index coded data files')
+    build.add_argument('sources', nargs = '+', help = 'coded data files, e.g. data/coded/20180815182030_posts.json')
+    build.add_argument('--destination', default = os.path.join('data', 'index'),
+        help = 'directory to save the index in (default: data/index)')
+
+    query = commands.add_parser('query', help = 'query an index')
+    query.add_argument('index', help = 'directory of the index, e.g. data/index')
+    query.add_argument('query', help = 'e.g. "evidence:stats topic:religion delta > 0"')
+    query.add_argument('--show', type = int, default = 10, help = 'number of rows to print (default: 10)')
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        meta = build_index(args.sources, args.destination)
+        print("Indexed %d discussions and their %d comments (%d keys) in %.1f seconds, saved to directory %s"
+            % (meta['posts'], meta['comments'], meta['keys'], time.perf_counter() - start, args.destination))
+
+    else:
+        index = SearchIndex(args.index)
+        try:
+            tree = parse(args.query)
+        except ValueError as error:
+            sys.exit(str(error))
+
+        start = time.perf_counter()
+        found = index.search(tree)
+        seconds = time.perf_counter() - start
+
+        posts = int(index.arrays['is_post'][found].sum())
+        print("%d rows (%d discussions and %d comments) from %d discussions (%.2f ms)"
+            % (len(found), posts, len(found) - posts, len(index.post_ids(found)), seconds * 1000))
+        for row in index.rows(found[:args.show]):
+            print(json.dumps(row))
@@ -0,0 +1,387 @@
+"""
+Project Name: Attitude Change on Change My View (Study 2)
+Name: sharded.py
+
+Description of this script:
+
+    Store a dataset of discussions (raw or coded) as compressed shards, with
+    an index to read any one discussion by its id without decompressing the
+    rest of the dataset.
+
+    A sharded dataset is a directory, e.g. data/20180815182030_posts.shards/:
+
+        shards.json                 the format, codec, shards, and number of discussions
+        shard-00000.jsonl.gz        the discussions, one JSON line each, in the order they
+        shard-00001.jsonl.gz        were written, a shard at most about --shard-size bytes
+        ...
+        index_ids.npy               the ids of the discussions, sorted (see pack_strings
+        index_ids_offsets.npy       in columnar.py)
+        index_shard.npy             and, for each id, the shard, the offset in the shard,
+        index_offset.npy            and the compressed length of the discussion
+        index_length.npy
+
+    Each discussion is compressed on its own (a gzip member, or a zstd frame if
+    the zstandard package is installed and --codec zstd is given), and the
+    shards are the compressed discussions one after the other.  So a shard
+    decompresses in one pass to a .jsonl file, and one discussion is read by
+    seeking to its offset.  The index is loaded as memory maps, so looking a
+    discussion up only reads the parts of the index it needs.
+
+    json_lines.read_posts reads a sharded dataset like a .jsonl file, so
+    discussion_analysis.py, test.py, pipeline.py, and every script that reads
+    data files take sharded datasets as they are (coded discussions of a
+    sharded dataset are written as a sharded dataset too).  To pack a data
+    file, read one discussion, or unpack a dataset again, run:
+
+        python json_lines.py pack data/20180815182030_posts.jsonl data/20180815182030_posts.shards
+        python sharded.py get data/20180815182030_posts.shards 97z1kj
+        python json_lines.py import data/20180815182030_posts.shards data/20180815182030_posts.jsonl
+
+    In Python:
+
+        from sharded import ShardedDataset
+        with ShardedDataset('data/coded/20180815182030_posts.shards') as dataset:
+            post = dataset['97z1kj']
+
+Authors: J. Hunter Priniski & Zachary Horne
+"""
+
+#REQUIREMENTS
+import io
+import os
+import sys
+import gzip
+import json
+import bisect
+import shutil
+import argparse
+
+#zstandard is optional. Without it, shards are compressed with gzip.
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+#The format of a sharded dataset. Changing what is saved must change this.
+FORMAT = 1
+
+#The file that describes a sharded dataset (and marks a directory as one).
+META = 'shards.json'
+
+#A new shard is started once a shard holds about this many compressed bytes.
+SHARD_SIZE = 64 * 1024 * 1024
+
+#The file extension of the shards of each codec.
+EXTENSIONS = {'gzip':'.jsonl.gz', 'zstd':'.jsonl.zst'}
+
+#is_sharded returns True if directory is a sharded dataset.
+def is_sharded(directory):
+    return os.path.isfile(os.path.join(directory, META))
+
+#read_meta reads the description of a sharded dataset.
+def read_meta(directory):
+
+    with open(os.path.join(directory, META), 'r') as json_file:
+        meta = json.load(json_file)
+
+    if meta.get('format') != FORMAT:
+        raise ValueError('The dataset in %s has format %r, pack it again with this version of sharded.py'
+            % (directory, meta.get('format')))
+
+    if meta['codec'] == 'zstd' and zstandard is None:
+        raise ImportError('The dataset in %s is compressed with zstd, install the zstandard package to read it' % directory)
+
+    return meta
+
+#compress compresses one discussion. gzip's mtime is fixed, so the same discussions always make the same shards.
+def compress(data, codec, level):
+
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level = level if level is not None else 3).compress(data)
+
+    return gzip.compress(data, compresslevel = level if level is not None else 6, mtime = 0)
+
+def decompress(data, codec):
+
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+
+    return gzip.decompress(data)
+
+#open_shard opens a shard to read it in one pass, as the text of a .jsonl file.
+def open_shard(directory, codec):
+
+    if codec == 'zstd':
+        reader = zstandard.ZstdDecompressor().stream_reader(open(directory, 'rb'), read_across_frames = True, closefd = True)
+        return io.TextIOWrapper(io.BufferedReader(reader), encoding = 'utf-8')
+
+    return gzip.open(directory, 'rt', encoding = 'utf-8')
+
+#read_posts lazily yields the discussions of a sharded dataset, one at a time, in the order they were written.
+def read_posts(directory):
+
+    meta = read_meta(directory)
+
+    for shard in meta['shards']:
+        with open_shard(os.path.join(directory, shard), meta['codec']) as json_file:
+            for line in json_file:
+                if line.strip():
+                    yield json.loads(line)
+
+"""
+ShardWriter writes discussions to a sharded dataset as they come, like JsonLinesWriter writes a .jsonl file.
+The dataset is written to directory + '.tmp', and only replaces directory once it is closed, so a crash never
+leaves a half written dataset (or the index of another one) in place.  codec is 'gzip' or 'zstd' (the default
+is zstd if the zstandard package is installed, and gzip otherwise).
+"""
+class ShardWriter:
+
+    def __init__(self, directory, codec = None, shard_size = SHARD_SIZE, level = None):
+
+        if codec is None:
+            codec = 'zstd' if zstandard is not None else 'gzip'
+
+        if codec not in EXTENSIONS:
+            raise ValueError('Unknown codec %r, use one of %s' % (codec, ', '.join(EXTENSIONS)))
+
+        if codec == 'zstd' and zstandard is None:
+            raise ImportError('Install the zstandard package to compress shards with zstd')
+
+        self.directory = directory
+        self.temporary = directory + '.tmp'
+        self.codec = codec
+        self.shard_size = shard_size
+        self.level = level
+
+        remove_dataset(self.temporary)
+        os.makedirs(self.temporary)
+
+        self.shards = []
+        self.outfile = None
+        self.size = 0
+
+        #The id, shard, offset, and compressed length of every discussion, in the order they were written.
+        self.ids = []
+        self.locations = []
+        self.count = 0
+
+    def start_shard(self):
+
+        if self.outfile is not None:
+            self.outfile.close()
+
+        self.shards.append('shard-%05d%s' % (len(self.shards), EXTENSIONS[self.codec]))
+        self.outfile = open(os.path.join(self.temporary, self.shards[-1]), 'wb')
+        self.size = 0
+
+    def write(self, post):
+
+        data = compress((json.dumps(post) + '\n').encode('utf-8'), self.codec, self.level)
+
+        if self.outfile is None or (self.size > 0 and self.size + len(data) > self.shard_size):
+            self.start_shard()
+
+        self.outfile.write(data)
+
+        self.ids.append(str(post['id']))
+        self.locations.append((len(self.shards) - 1, self.size, len(data)))
+        self.size += len(data)
+        self.count += 1
+
+        return True
+
+    #close writes the index and the description of the dataset, and moves the dataset into place.
+    def close(self):
+
+        import numpy as np
+        from columnar import pack_strings
+
+        if self.outfile is not None:
+            self.outfile.close()
+
+        #The index is sorted by id. The sort is stable, so if two discussions share an id, the first one is found.
+        order = sorted(range(len(self.ids)), key = self.ids.__getitem__)
+        locations = np.array(self.locations, dtype = np.int64).reshape(-1, 3)[order]
+
+        arrays = {}
+        arrays['index_ids'], arrays['index_ids_offsets'] = pack_strings([self.ids[i] for i in order])
+        arrays['index_shard'] = locations[:, 0].astype(np.int32)
+        arrays['index_offset'] = locations[:, 1]
+        arrays['index_length'] = locations[:, 2]
+
+        for name, values in arrays.items():
+            np.save(os.path.join(self.temporary, name + '.npy'), values)
+
+        #The description is written last, so a directory without one is never taken for a dataset.
+        with open(os.path.join(self.temporary, META), 'w') as outfile:
+            json.dump({'format':FORMAT, 'codec':self.codec, 'shards':self.shards, 'posts':self.count}, outfile, indent = 2)
+
+        remove_dataset(self.directory)
+        os.replace(self.temporary, self.directory)
+
+    #abort throws away what was written, and leaves the dataset at directory as it was.
+    def abort(self):
+
+        if self.outfile is not None:
+            self.outfile.close()
+
+        remove_dataset(self.temporary)
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def remove_dataset(directory):
+
+    if os.path.isdir(directory):
+        shutil.rmtree(directory)
+    elif os.path.exists(directory):
+        os.remove(directory)
+
+#pack writes the discussions of posts (e.g., json_lines.read_posts of a data file) to a sharded dataset, and returns how many it wrote.
+def pack(posts, directory, codec = None, shard_size = SHARD_SIZE, level = None):
+
+    with ShardWriter(directory, codec, shard_size, level) as writer:
+        for post in posts:
+            writer.write(post)
+
+    return writer.count
+
+"""
+A ShardedDataset reads single discussions of a sharded dataset by id.  The index is memory mapped, so opening
+a dataset reads almost nothing, and a lookup reads the few parts of the index its binary search needs, and
+then only the compressed discussion itself.
+"""
+class ShardedDataset:
+
+    def __init__(self, directory):
+
+        import numpy as np
+        from columnar import PackedStrings
+
+        self.directory = directory
+        self.meta = read_meta(directory)
+        self.codec = self.meta['codec']
+
+        def load(name):
+            return np.load(os.path.join(directory, name + '.npy'), mmap_mode = 'r')
+
+        self.ids = PackedStrings(load('index_ids'), load('index_ids_offsets'))
+        self.shard = load('index_shard')
+        self.offset = load('index_offset')
+        self.length = load('index_length')
+
+        #Shards are opened the first time a discussion is read from them, and kept open.
+        self.files = {}
+
+    def __len__(self):
+        return self.meta['posts']
+
+    #position returns the position of post_id in the index, or None if the dataset has no such discussion.
+    def position(self, post_id):
+
+        i = bisect.bisect_left(self.ids, post_id)
+
+        if i < len(self.ids) and self.ids[i] == post_id:
+            return i
+
+        return None
+
+    def __contains__(self, post_id):
+        return self.position(post_id) is not None
+
+    #locate returns the shard, offset, and compressed length of a discussion, or None if the dataset has no such discussion.
+    def locate(self, post_id):
+
+        i = self.position(post_id)
+
+        if i is None:
+            return None
+
+        return self.meta['shards'][self.shard[i]], int(self.offset[i]), int(self.length[i])
+
+    #read_bytes returns the compressed discussion at offset in shard.
+    def read_bytes(self, shard, offset, length):
+
+        if shard not in self.files:
+            self.files[shard] = open(os.path.join(self.directory, shard), 'rb')
+
+        shard_file = self.files[shard]
+        shard_file.seek(offset)
+
+        return shard_file.read(length)
+
+    def __getitem__(self, post_id):
+
+        location = self.locate(post_id)
+
+        if location is None:
+            raise KeyError(post_id)
+
+        return json.loads(decompress(self.read_bytes(*location), self.codec))
+
+    def get(self, post_id, default = None):
+
+        try:
+            return self[post_id]
+        except KeyError:
+            return default
+
+    #post_ids returns the ids of the discussions in the dataset, sorted.
+    def post_ids(self):
+        return [self.ids[i] for i in range(len(self.ids))]
+
+    def __iter__(self):
+        return read_posts(self.directory)
+
+    def close(self):
+
+        for shard_file in self.files.values():
+            shard_file.close()
+
+        self.files = {}
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc_info):
+
+        self.close()
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Read discussions of a sharded dataset by id.')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+
+    get_parser = commands.add_parser('get', help = 'print discussions, as JSON lines')
+    get_parser.add_argument('dataset', help = 'a sharded dataset, e.g. data/20180815182030_posts.shards')
+    get_parser.add_argument('ids', nargs = '+', help = 'the ids of the discussions')
+
+    info_parser = commands.add_parser('info', help = 'print the description of a sharded dataset')
+    info_parser.add_argument('dataset')
+
+    args = parser.parse_args()
+
+    if args.command == 'info':
+        print(json.dumps(read_meta(args.dataset), indent = 2))
+        sys.exit(0)
+
+    missing = 0
+    with ShardedDataset(args.dataset) as dataset:
+        for post_id in args.ids:
+            post = dataset.get(post_id)
+            if post is None:
+                print('No discussion %s in %s' % (post_id, args.dataset), file = sys.stderr)
+                missing += 1
+            else:
+                print(json.dumps(post))
+
+    sys.exit(1 if missing else 0)
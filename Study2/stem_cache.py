@@ -0,0 +1,152 @@
+"""
+Project Name: Attitude Change on Change My View (Study 2)
+Name: stem_cache.py
+
+Description of this script:
+
+    A memoizing wrapper around the NLTK stemmers used in both studies.
+
+    Reddit vocabulary is heavily Zipfian: a few thousand words make up most
+    of every comment.  Instead of running the Snowball algorithm on the same
+    word again and again, CachedStemmer remembers the stem of the words it has
+    seen most recently (up to maxsize words, evicting the least recently used
+    word first).  It counts hits and misses so we can see how much time the
+    cache saves on a full corpus, and it can be saved to and warmed from a
+    JSON file between runs.
+
+    CachedStemmer has the same stem() method as an NLTK stemmer, so it can be
+    used wherever a stemmer is used, e.g.:
+
+        stemmer = CachedStemmer(SnowballStemmer('english'))
+        stemmer.stem('running')
+
+Authors: J. Hunter Priniski & Zachary Horne
+"""
+
+#REQUIREMENTS
+import os
+import json
+from collections import OrderedDict
+
+#nltk_version returns the version of NLTK that is installed.
+def nltk_version():
+
+    from importlib import metadata
+
+    try:
+        return metadata.version('nltk')
+    except metadata.PackageNotFoundError:
+        import nltk
+        return nltk.__version__
+
+class CachedStemmer:
+
+    def __init__(self, stemmer = None, maxsize = 100000):
+
+        #By default we stem with the same SnowballStemmer the studies have always used. It is only
+        #made (and NLTK, which takes a second or more to import, only imported) when a word is first
+        #missing from the cache, so a warm cache never imports NLTK at all.
+        self._stemmer = stemmer
+        self.maxsize = maxsize
+
+        #The cache maps each word to its stem. The least recently used word is first.
+        self.cache = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def stemmer(self):
+
+        if self._stemmer is None:
+            from nltk.stem.snowball import SnowballStemmer
+            self._stemmer = SnowballStemmer('english')
+
+        return self._stemmer
+
+    def stem(self, word):
+
+        cache = self.cache
+
+        try:
+            stem = cache[word]
+
+        #We have not seen this word recently, so we stem it and remember the stem.
+        except KeyError:
+            self.misses += 1
+            stem = self.stemmer.stem(word)
+            cache[word] = stem
+
+            #If the cache is full, we forget the least recently used word.
+            if len(cache) > self.maxsize:
+                cache.popitem(last = False)
+                self.evictions += 1
+
+            return stem
+
+        self.hits += 1
+        cache.move_to_end(word)
+        return stem
+
+    #A cache saved by one stemmer (or one version of NLTK) must not be used by another.
+    #The version of NLTK is read from its package metadata, so we don't have to import it.
+    def version(self):
+
+        if self._stemmer is None:
+            name, language = 'SnowballStemmer', ''
+        else:
+            name, language = type(self._stemmer).__name__, getattr(self._stemmer, 'language', '')
+
+        return '%s:%s:%s' % (name, language, nltk_version())
+
+    def cache_info(self):
+
+        lookups = self.hits + self.misses
+
+        return {'hits':self.hits,
+                'misses':self.misses,
+                'evictions':self.evictions,
+                'size':len(self.cache),
+                'maxsize':self.maxsize,
+                'hit_rate':self.hits / lookups if lookups > 0 else 0.0}
+
+    #Warm the cache from a file written by save(). Returns the number of stems loaded.
+    def load(self, directory):
+
+        if not os.path.exists(directory):
+            return 0
+
+        with open(directory, 'r') as json_file:
+            saved = json.load(json_file)
+
+        #If the file was written by a different stemmer, its stems may be wrong for us.
+        if saved.get('version') != self.version():
+            return 0
+
+        #The saved stems are in least to most recently used order, so the most recently
+        #used words are the last to be evicted.
+        for word, stem in saved['stems'][-self.maxsize:]:
+            self.cache[word] = stem
+            self.cache.move_to_end(word)
+
+        while len(self.cache) > self.maxsize:
+            self.cache.popitem(last = False)
+
+        return len(saved['stems'][-self.maxsize:])
+
+    #Save the cache to a file. We write to a temporary file and then move it into place,
+    #so a crash while saving never leaves a broken cache behind.
+    def save(self, directory):
+
+        saved = {'version':self.version(),
+                 'stems':list(self.cache.items())}
+
+        #Several processes may save at once (see pipeline.py), so each writes its own temporary file.
+        temporary = '%s.%d.tmp' % (directory, os.getpid())
+        with open(temporary, 'w') as outfile:
+            json.dump(saved, outfile)
+
+        os.replace(temporary, directory)
+
+        return True
@@ -0,0 +1,324 @@
+"""
+Project Name: Attitude Change on Change My View (Study 2)
+Name: synthetic_data.py
+
+Description of this script:
+
+    Write synthetic Change My View discussions, in the same format as the
+    discussions collect_posts.py saves, so discussion_analysis.py can be run
+    and timed without collecting real data (see benchmark.py).
+
+    Each synthetic discussion has:
+
+        - a post and its comments with every field collect_posts.py saves
+          (SUBMISSION_FIELDS and COMMENT_FIELDS), in the breadth-first order
+          the collector saves them in, and the discussion's _tree;
+        - deep reply trees: most comments reply to one of the latest comments
+          in the discussion, so long back-and-forth threads form;
+        - deltas: a user replies to a comment with !delta and a reason, and
+          DeltaBot confirms the delta (and sometimes rejects one);
+        - markdown links in the body, rendered as <a> tags in body_html;
+        - words drawn from our topic and evidence language term lists
+          (topics/ and evidence-language/), mixed with everyday words;
+        - a few deleted comments, which are in the _tree but not in _comments.
+
+    Discussions are generated one at a time from a seed, so the same seed
+    always gives the same dataset, and a dataset of any size can be written
+    without holding it in memory.  To write 30 discussions of 10 to 100,000
+    comments each, run:
+
+        python synthetic_data.py data/synthetic_posts.jsonl --posts 30 --comments 10 100000
+
+Authors: J. Hunter Priniski & Zachary Horne
+"""
+
+#REQUIREMENTS
+import os
+import html
+import json
+import math
+import random
+import argparse
+
+from json_lines import JsonLinesWriter
+from comment_tree import tree_from_comments
+from collect_posts import SUBMISSION_FIELDS, COMMENT_FIELDS
+
+#Everyday words that make up most of a comment. Terms from our term lists are mixed in with them.
+FILLER = ('the be to of and a in that have i it for not on with he as you do at this but his by from they '
+    'we say her she or an will my one all would there their what so up out if about who get which go me '
+    'when make can like time no just him know take people into year your good some could them see other '
+    'than then now look only come its over think also back after use two how our work first well way even '
+    'new want because any these give day most us view change point argument agree disagree believe reason '
+    'true false why really mean right wrong example fact sure actually probably').split()
+
+#Sites our synthetic users cite, and the share of links that point back to Reddit.
+DOMAINS = ('en.wikipedia.org', 'www.nytimes.com', 'www.cdc.gov', 'www.ncbi.nlm.nih.gov', 'www.pewresearch.org',
+    'www.bls.gov', 'www.theguardian.com', 'www.youtube.com', 'plato.stanford.edu', 'www.census.gov')
+
+REDDIT_LINK_RATE = 0.1
+
+#How often the things that make a discussion look like a CMV discussion happen (per comment).
+RATES = {
+    'top_level':0.3,        #a comment replies to the post rather than to another comment
+    'link':0.12,            #a comment cites a link
+    'term':0.15,            #a word is drawn from our term lists
+    'quote':0.1,            #a comment quotes the comment it replies to
+    'delta':0.02,           #a comment is awarded a delta
+    'op_delta':0.6,         #a delta is awarded by the author of the post
+    'rejected':0.1,         #DeltaBot rejects a !delta
+    'deleted':0.02,         #a comment is deleted
+}
+
+#THREAD_MEMORY is how far back (on average) a reply looks for the comment it replies to.
+THREAD_MEMORY = 4.0
+
+#read_vocabulary reads every term in our topic and evidence language term lists (unstemmed).
+def read_vocabulary(directory = '.'):
+
+    terms = []
+
+    for folder in ('topics', 'evidence-language'):
+        for name in sorted(os.listdir(os.path.join(directory, folder))):
+            if name.endswith('.txt'):
+                with open(os.path.join(directory, folder, name), 'r') as text_file:
+                    terms.extend(line.strip() for line in text_file if line.strip())
+
+    return terms
+
+#to_base36 writes a number the way Reddit writes ids (e.g., 96ffrx).
+def to_base36(number):
+
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    text = ''
+
+    while True:
+        number, digit = divmod(number, 36)
+        text = digits[digit] + text
+        if number == 0:
+            return text
+
+#make_sentence writes a sentence of words drawn from the term lists and FILLER.
+def make_sentence(rng, terms, rates, length):
+
+    words = [rng.choice(terms) if rng.random() < rates['term'] else rng.choice(FILLER) for i in range(length)]
+    return ' '.join(words).capitalize() + rng.choice('..?!')
+
+#make_link returns a markdown link and the same link as Reddit renders it in body_html.
+def make_link(rng, number):
+
+    if rng.random() < REDDIT_LINK_RATE:
+        url = 'https://www.reddit.com/r/changemyview/comments/%s/' % to_base36(number)
+    else:
+        url = 'https://%s/%s/%d' % (rng.choice(DOMAINS), rng.choice(FILLER), number)
+
+    text = rng.choice(('source', 'here', 'this study', 'link', 'data'))
+
+    return '[%s](%s)' % (text, url), '<a href="%s">%s</a>' % (html.escape(url), html.escape(text, quote = False))
+
+"""
+make_body writes the body of a comment, and body_html, the body as Reddit renders it: each paragraph in
+a <p>, quotes in a <blockquote>, and links as <a> tags.  The comment has about words words.
+"""
+def make_body(rng, terms, rates, words, quote = None):
+
+    body = []
+    body_html = []
+
+    if quote is not None:
+        body.append('> ' + quote)
+        body_html.append('<blockquote>\n<p>%s</p>\n</blockquote>' % html.escape(quote, quote = False))
+
+    while words > 0:
+
+        length = min(words, rng.randint(5, 25))
+        paragraph = make_sentence(rng, terms, rates, length)
+        paragraph_html = html.escape(paragraph, quote = False)
+        words -= length
+
+        if rng.random() < rates['link']:
+            link, link_html = make_link(rng, rng.getrandbits(30))
+            paragraph += ' ' + link
+            paragraph_html += ' ' + link_html
+
+        body.append(paragraph)
+        body_html.append('<p>%s</p>' % paragraph_html)
+
+    return '\n\n'.join(body), '<div class="md">%s\n</div>' % '\n\n'.join(body_html)
+
+#make_comment fills in every field collect_posts.py saves for a comment.
+def make_comment(post, comment_id, parent_id, author, body, body_html, created):
+
+    comment = dict.fromkeys(COMMENT_FIELDS)
+
+    comment.update({
+        'id':comment_id, 'name':'t1_' + comment_id, 'parent_id':parent_id, 'link_id':post['name'],
+        'author':author, 'body':body, 'body_html':body_html,
+        'score':1, 'ups':1, 'downs':0, 'gilded':0, 'controversiality':0,
+        'created':created, 'created_utc':created, 'edited':False,
+        'is_submitter':author == post['author'],
+        'subreddit_id':post['subreddit_id'], 'subreddit_name_prefixed':'r/changemyview', 'subreddit_type':'public',
+        'permalink':'/r/changemyview/comments/%s/_/%s/' % (post['id'], comment_id),
+        'archived':False, 'collapsed':False, 'stickied':False, 'saved':False, 'no_follow':True,
+        'send_replies':True, 'can_gild':True, 'can_mod_post':False, 'score_hidden':False,
+        'author_flair_richtext':[], 'author_flair_type':'text', 'user_reports':[], 'mod_reports':[],
+        '_fetched':True, '_info_params':{},
+    })
+
+    return comment
+
+#make_post fills in every field collect_posts.py saves for a post.
+def make_post(post_id, author, title, selftext, selftext_html, created):
+
+    post = dict.fromkeys(SUBMISSION_FIELDS)
+
+    post.update({
+        'id':post_id, 'name':'t3_' + post_id, 'author':author, 'title':title,
+        'selftext':selftext, 'selftext_html':selftext_html,
+        'score':1, 'ups':1, 'downs':0, 'gilded':0, 'num_crossposts':0, 'view_count':None,
+        'created':created, 'created_utc':created, 'edited':False,
+        'subreddit_id':'t5_2w2s8', 'subreddit_name_prefixed':'r/changemyview', 'subreddit_type':'public',
+        'domain':'self.changemyview', 'is_self':True, 'is_video':False, 'over_18':False,
+        'permalink':'/r/changemyview/comments/%s/_/' % post_id,
+        'url':'https://www.reddit.com/r/changemyview/comments/%s/_/' % post_id,
+        'archived':False, 'locked':False, 'stickied':False, 'hidden':False, 'saved':False, 'clicked':False,
+        'link_flair_richtext':[], 'author_flair_richtext':[], 'user_reports':[], 'mod_reports':[],
+        'media_embed':{}, 'secure_media_embed':{}, 'comment_limit':2048, 'comment_sort':'best',
+        '_fetched':True, '_info_params':{}, '_flair':None, '_mod':None,
+    })
+
+    return post
+
+"""
+make_discussion writes the number'th discussion of the dataset made from seed, with about num_comments
+comments (a delta adds two comments: the !delta and DeltaBot's reply).  terms are the words drawn from
+our term lists (see read_vocabulary).  Comments are returned in breadth-first order, as collect_posts.py
+saves them, and the discussion's _tree is built from their parent_id (see comment_tree.py).
+"""
+def make_discussion(number, num_comments, terms, seed = 0, rates = RATES):
+
+    rng = random.Random('%s:%d' % (seed, number))
+
+    post_id = to_base36(36 ** 5 + number)
+    users = ['user_%d' % i for i in range(max(10, int(math.sqrt(num_comments)) * 3))]
+    created = 1.5e9 + number * 3600.0
+
+    selftext, selftext_html = make_body(rng, terms, rates, rng.randint(50, 300))
+    title = 'CMV: ' + make_sentence(rng, terms, rates, rng.randint(6, 14))[:-1]
+    post = make_post(post_id, rng.choice(users), title, selftext, selftext_html, created)
+
+    comments = []
+    deleted = set()
+    comment_number = [0]
+
+    def add_comment(parent, author, body, body_html):
+        comment_number[0] += 1
+        comment_id = post_id + to_base36(comment_number[0])
+        parent_id = post['name'] if parent is None else parent['name']
+        comment = make_comment(post, comment_id, parent_id, author, body, body_html, created + comment_number[0])
+        comment['depth'] = 0 if parent is None else parent['depth'] + 1
+        comments.append(comment)
+        return comment
+
+    while len(comments) < num_comments:
+
+        #Reply to the post, or to one of the latest comments, so threads grow deep.
+        if not comments or rng.random() < rates['top_level']:
+            parent = None
+        else:
+            back = min(len(comments) - 1, int(rng.expovariate(1.0 / THREAD_MEMORY)))
+            parent = comments[len(comments) - 1 - back]
+
+        quote = None
+        if parent is not None and rng.random() < rates['quote']:
+            quote = parent['body'].split('\n')[-1][:120]
+
+        author = rng.choice(users)
+        body, body_html = make_body(rng, terms, rates, int(min(400, 1 + rng.lognormvariate(3.0, 0.8))), quote)
+        comment = add_comment(parent, author, body, body_html)
+
+        if rng.random() < rates['deleted']:
+            deleted.add(comment['id'])
+
+        #Someone awards the comment a delta, and DeltaBot confirms (or rejects) it.
+        if rng.random() < rates['delta'] and author != post['author']:
+
+            awarder = post['author'] if rng.random() < rates['op_delta'] else rng.choice(users)
+            reason = make_sentence(rng, terms, rates, rng.randint(5, 30))
+            signal = add_comment(comment, awarder, '!delta ' + reason, '<div class="md"><p>!delta %s</p>\n</div>' % html.escape(reason, quote = False))
+
+            if rng.random() < rates['rejected']:
+                reply = "This delta has been rejected. You can't award OP a delta."
+            else:
+                reply = 'Confirmed: 1 delta awarded to /u/%s (1∆).' % author
+
+            add_comment(signal, 'DeltaBot', reply, '<div class="md"><p>%s</p>\n</div>' % html.escape(reply, quote = False))
+
+    #The collector saves comments breadth first, and leaves out deleted comments (but keeps them in the tree).
+    tree = tree_from_comments(comments)
+    by_id = {comment['id']:comment for comment in comments}
+    replies = {comment['name']:[] for comment in comments}
+
+    for comment in comments:
+        if comment['parent_id'] in replies:
+            replies[comment['parent_id']].append(comment['id'])
+
+    post['_comments'] = []
+    for comment_id in tree['ids']:
+        comment = by_id[comment_id]
+        comment['_replies'] = replies[comment['name']]
+        if comment_id not in deleted:
+            post['_comments'].append(comment)
+
+    post['num_comments'] = len(comments)
+    post['_tree'] = {key:list(val) for key, val in tree.items()}
+
+    return post
+
+"""
+generate yields num_posts discussions made from seed.  The number of comments in each discussion is
+drawn between min_comments and max_comments, evenly on a log scale, so a dataset has both small
+and very large discussions.
+"""
+def generate(num_posts, min_comments, max_comments, seed = 0, terms = None, rates = RATES):
+
+    if terms is None:
+        terms = read_vocabulary()
+
+    sizes = random.Random('%s:sizes' % seed)
+
+    for number in range(num_posts):
+        num_comments = int(round(math.exp(sizes.uniform(math.log(min_comments), math.log(max_comments)))))
+        yield make_discussion(number, num_comments, terms, seed, rates)
+
+#write_dataset writes discussions to a .jsonl file one at a time, or to a legacy .json file as one list.
+def write_dataset(destination, posts):
+
+    if destination.endswith('.jsonl'):
+        with JsonLinesWriter(destination) as writer:
+            for post in posts:
+                writer.write(post)
+            return writer.count
+
+    posts = list(posts)
+    with open(destination, 'w') as outfile:
+        json.dump(posts, outfile)
+
+    return len(posts)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Write synthetic Change My View discussions in the collect_posts.py format.')
+    parser.add_argument('destination', help = 'a .jsonl (or .json) file, e.g. data/synthetic_posts.jsonl')
+    parser.add_argument('--posts', type = int, default = 30, help = 'number of discussions (default: 30)')
+    parser.add_argument('--comments', type = int, nargs = 2, default = [10, 1000], metavar = ('MIN', 'MAX'),
+        help = 'fewest and most comments in a discussion (default: 10 1000)')
+    parser.add_argument('--seed', default = '0', help = 'the same seed always writes the same discussions (default: 0)')
+    parser.add_argument('--delta-rate', type = float, default = RATES['delta'],
+        help = 'share of comments awarded a delta (default: %.2f)' % RATES['delta'])
+    args = parser.parse_args()
+
+    rates = dict(RATES, delta = args.delta_rate)
+    count = write_dataset(args.destination, generate(args.posts, args.comments[0], args.comments[1], args.seed, rates = rates))
+
+    print("%d synthetic discussions written to file %s" % (count, os.path.basename(args.destination)))
@@ -0,0 +1,480 @@
+"""
+Project Name: Attitude Change on Change My View (Study 2)
+Name: term_matrix.py
+
+Description of this script:
+
+    Turn the classifications of a coded data file into sparse document-term
+    matrices, so the statistics of the analysis are matrix operations instead
+    of walks over the nested {'match': ..., 'terms': [...]} dictionaries that
+    classify_text returns.
+
+    There are two tables, one row per discussion and one row per comment:
+
+        posts       the terms of the topics found in each discussion (topic)
+        comments    the terms of the evidence language found in each comment (evidence_use)
+
+    Each table is a CSR matrix of rows x terms, where entry (i, j) counts term
+    j in row i (prepare keeps each token of a text once, so a term found in a
+    text counts 1), along with:
+
+        terms           the terms (stemmed tokens joined by spaces), in the order of the term lists
+        categories      the topics or kinds of evidence
+        aggregation     a terms x categories matrix, 1 where a term belongs to a category, so
+                        matrix @ aggregation counts the terms of each category in each row
+        ids             the id of each row (and, for comments, the row of its discussion
+                        in the posts table and its Delta.count)
+
+    A category matches a text when it finds one of its terms, or, for a
+    category with 'number' in its name, when the text has a digit (see
+    classify_text); the digit is the term '#digit'.  So category_matches()
+    is exactly the match of every classification.
+
+    The matrices are written a discussion at a time, and the rows are saved
+    to disk every --buffer-size entries, so a matrix of any size is built in
+    bounded memory.  To write the matrices of a coded file to data/matrix/<name>/, run:
+
+        python term_matrix.py data/coded/20180815182030_posts.json
+
+    and to use them (the matrix is a scipy.sparse CSR matrix when scipy is
+    installed):
+
+        from term_matrix import TermMatrix
+        comments = TermMatrix('data/matrix/20180815182030_posts', 'comments')
+        comments.rates()                            # share of comments that use each kind of evidence
+        comments.term_frequencies()                 # number of comments that use each term
+        comments.matrix[comments.delta > 0].sum(axis = 0)   # term counts in comments that got a delta
+
+Authors: J. Hunter Priniski & Zachary Horne
+"""
+
+#REQUIREMENTS
+import os
+import json
+import shutil
+import argparse
+from array import array
+
+import numpy as np
+
+import discussion_analysis
+from json_lines import read_posts
+from columnar import term_string, pack_strings, unpack_strings
+from sharded import remove_dataset
+
+#scipy is optional. Without it, the matrices are returned as their CSR arrays (see CSRArrays).
+try:
+    import scipy.sparse
+except ImportError:
+    scipy = None
+
+#The format of the saved matrices. Changing what is saved must change this.
+FORMAT = 1
+
+#The term of a digit in a category with 'number' in its name (prepare removes '#', so no term of a term list is this).
+DIGIT = '#digit'
+
+#The rows are saved to disk once this many numbers are held in memory.
+BUFFER_SIZE = 1 << 22
+
+#The classification of each table, and the columns each of its rows has besides its terms.
+TABLES = {
+    'posts':{'classification':'topic', 'columns':()},
+    'comments':{'classification':'evidence_use', 'columns':('post', 'delta')},
+}
+
+#The CSR arrays of a matrix, for when scipy is not installed.
+class CSRArrays:
+
+    def __init__(self, data, indices, indptr, shape):
+        self.data = data
+        self.indices = indices
+        self.indptr = indptr
+        self.shape = shape
+
+"""
+A Vocabulary numbers the terms and categories of a table.  It starts with every term of the term lists (so
+terms that are never found still have a column), and adds any other term it is given, e.g. a term that was
+in the term lists when a file was coded and has since been removed.
+"""
+class Vocabulary:
+
+    def __init__(self, lexicon = None):
+
+        self.terms = []
+        self.term_index = {}
+        self.categories = []
+        self.category_index = {}
+        self.pairs = set()
+
+        for category, terms in (lexicon or {}).items():
+
+            self.category(category)
+
+            for term in terms:
+                #An empty line in a term file is never matched (see compile_terms).
+                if len(term) > 0:
+                    self.add(term_string(term), category)
+
+            if 'number' in category.lower():
+                self.add(DIGIT, category)
+
+    def category(self, name):
+
+        if name not in self.category_index:
+            self.category_index[name] = len(self.categories)
+            self.categories.append(name)
+
+        return self.category_index[name]
+
+    #add returns the column of term, and records that it belongs to category.
+    def add(self, term, category):
+
+        column = self.term_index.get(term)
+
+        if column is None:
+            column = self.term_index[term] = len(self.terms)
+            self.terms.append(term)
+
+        self.pairs.add((column, self.category(category)))
+
+        return column
+
+    #aggregation returns the terms x categories matrix, 1 where a term belongs to a category.
+    def aggregation(self):
+
+        matrix = np.zeros((len(self.terms), len(self.categories)), dtype = np.int32)
+
+        for column, category in self.pairs:
+            matrix[column, category] = 1
+
+        return matrix
+
+"""
+A Column is an array that is written to a file as it grows, and is saved as a .npy file at the end.  Only
+the values appended since the last flush are held in memory.
+"""
+class Column:
+
+    def __init__(self, path, typecode):
+
+        self.path = path
+        self.values = array(typecode)
+        self.outfile = open(path + '.part', 'wb')
+        self.length = 0
+
+    def __len__(self):
+        return self.length + len(self.values)
+
+    def flush(self):
+
+        self.values.tofile(self.outfile)
+        self.length += len(self.values)
+        self.values = array(self.values.typecode)
+
+    #save writes the .npy header, and then copies the values after it, without loading them.
+    def save(self):
+
+        self.flush()
+        self.outfile.close()
+
+        dtype = np.dtype(self.values.typecode)
+        header = {'descr':np.lib.format.dtype_to_descr(dtype), 'fortran_order':False, 'shape':(self.length,)}
+
+        with open(self.path + '.npy', 'wb') as outfile, open(self.path + '.part', 'rb') as in_file:
+            np.lib.format.write_array_header_1_0(outfile, header)
+            shutil.copyfileobj(in_file, outfile)
+
+        os.remove(self.path + '.part')
+
+#A Table is the rows of one matrix (posts or comments) as they are written.
+class Table:
+
+    def __init__(self, directory, name, vocabulary):
+
+        self.name = name
+        self.vocabulary = vocabulary
+
+        def column(suffix, typecode):
+            return Column(os.path.join(directory, name + '_' + suffix), typecode)
+
+        self.columns = {'indptr':column('indptr', 'q'), 'indices':column('indices', 'i'), 'data':column('data', 'i'),
+                        'ids':column('ids', 'B'), 'ids_offsets':column('ids_offsets', 'q')}
+
+        for extra in TABLES[name]['columns']:
+            self.columns[extra] = column(extra, 'q')
+
+        self.columns['indptr'].values.append(0)
+        self.columns['ids_offsets'].values.append(0)
+        self.rows = 0
+
+    #add adds a row of the terms found by a classification of text. extras are the other columns of the row.
+    def add(self, row_id, classification, text, matcher, **extras):
+
+        counts = {}
+
+        for category, result in (classification or {}).items():
+
+            for term in found_terms(category, result, text, matcher):
+                column = self.vocabulary.add(term, category)
+                #A term in the term lists of two categories is one term of the text, so it is only counted once.
+                counts[column] = 1
+
+        columns = sorted(counts)
+        self.columns['indices'].values.extend(columns)
+        self.columns['data'].values.extend(counts[column] for column in columns)
+        self.columns['indptr'].values.append(len(self.columns['indices']))
+
+        encoded = str(row_id).encode('utf-8')
+        self.columns['ids'].values.frombytes(encoded)
+        self.columns['ids_offsets'].values.append(len(self.columns['ids']))
+
+        for extra, value in extras.items():
+            self.columns[extra].values.append(value)
+
+        self.rows += 1
+
+    def buffered(self):
+        return sum(len(column.values) for column in self.columns.values())
+
+    def flush(self):
+
+        for column in self.columns.values():
+            column.flush()
+
+    def save(self, directory):
+
+        for column in self.columns.values():
+            column.save()
+
+        terms, terms_offsets = pack_strings(self.vocabulary.terms)
+        np.save(os.path.join(directory, self.name + '_terms.npy'), terms)
+        np.save(os.path.join(directory, self.name + '_terms_offsets.npy'), terms_offsets)
+        np.save(os.path.join(directory, self.name + '_aggregation.npy'), self.vocabulary.aggregation())
+
+        return {'rows':self.rows, 'terms':len(self.vocabulary.terms), 'categories':self.vocabulary.categories}
+
+"""
+found_terms returns the terms (as strings) a classification found in text.  classify_text replaces the terms
+of a 'number' category with None when the text has a digit, so those terms are found again with the matcher.
+"""
+def found_terms(category, result, text, matcher):
+
+    terms = result['terms']
+
+    if terms is None:
+
+        if matcher is None or category not in matcher['terms']:
+            raise ValueError('The terms of %s were not saved, so the term lists are needed to find them again' % category)
+
+        terms = discussion_analysis.match_compiled(discussion_analysis.prepare(text), matcher)[category][1]
+
+    found = [term_string(term) for term in terms]
+
+    if 'number' in category.lower() and any(char.isdigit() for char in text):
+        found.append(DIGIT)
+
+    return found
+
+"""
+TermMatrixWriter writes the matrices of coded discussions to directory, a discussion at a time.  lexicons are
+the term lists (see load_lexicons), which give every term a column.  Like ShardWriter (see sharded.py), it
+writes to directory + '.tmp', and only replaces directory once it is closed.
+"""
+class TermMatrixWriter:
+
+    def __init__(self, directory, lexicons = None, buffer_size = BUFFER_SIZE):
+
+        topics, evidence, matcher = lexicons if lexicons is not None else (None, None, None)
+
+        self.directory = directory
+        self.temporary = directory + '.tmp'
+        self.matcher = matcher
+        self.buffer_size = buffer_size
+
+        remove_dataset(self.temporary)
+        os.makedirs(self.temporary)
+
+        self.tables = {'posts':Table(self.temporary, 'posts', Vocabulary(topics)),
+                       'comments':Table(self.temporary, 'comments', Vocabulary(evidence))}
+
+    def write(self, post):
+
+        posts, comments = self.tables['posts'], self.tables['comments']
+        number = posts.rows
+
+        posts.add(post['id'], post.get('topic'), post['title'] + ' ' + post['selftext'], self.matcher)
+
+        for comment in post['_comments']:
+            comments.add(comment['id'], comment.get('evidence_use'), comment['body'], self.matcher,
+                post = number, delta = (comment.get('Delta') or {}).get('count', 0))
+
+        if posts.buffered() + comments.buffered() > self.buffer_size:
+            posts.flush()
+            comments.flush()
+
+        return True
+
+    def close(self):
+
+        meta = {'format':FORMAT}
+        for name, table in self.tables.items():
+            meta[name] = table.save(self.temporary)
+
+        #The description is written last, so a directory without one is never taken for a finished matrix.
+        with open(os.path.join(self.temporary, 'meta.json'), 'w') as outfile:
+            json.dump(meta, outfile, indent = 2)
+
+        remove_dataset(self.directory)
+        os.replace(self.temporary, self.directory)
+
+    def abort(self):
+
+        for table in self.tables.values():
+            for column in table.columns.values():
+                column.outfile.close()
+
+        remove_dataset(self.temporary)
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+#build_matrix writes the matrices of the coded data file source to destination, and returns True.
+def build_matrix(source, destination, lexicons = None, buffer_size = BUFFER_SIZE):
+
+    if lexicons is None:
+        lexicons = discussion_analysis.load_lexicons()
+
+    with TermMatrixWriter(destination, lexicons, buffer_size) as writer:
+        for post in read_posts(source):
+            writer.write(post)
+
+    return True
+
+"""
+A TermMatrix is one saved table (posts or comments).  Its arrays are memory mapped, so loading a table reads
+almost nothing until it is used.
+"""
+class TermMatrix:
+
+    def __init__(self, directory, table = 'comments'):
+
+        with open(os.path.join(directory, 'meta.json'), 'r') as json_file:
+            meta = json.load(json_file)
+
+        if meta.get('format') != FORMAT:
+            raise ValueError('The matrices in %s have format %r, build them again with this version of term_matrix.py'
+                % (directory, meta.get('format')))
+
+        def load(suffix):
+            return np.load(os.path.join(directory, table + '_' + suffix + '.npy'), mmap_mode = 'r')
+
+        self.table = table
+        self.shape = (meta[table]['rows'], meta[table]['terms'])
+        self.indptr = load('indptr')
+        self.indices = load('indices')
+        self.data = load('data')
+
+        self.terms = list(unpack_strings(load('terms'), load('terms_offsets')))
+        self.term_index = {term:column for column, term in enumerate(self.terms)}
+        self.categories = meta[table]['categories']
+        self.category_index = {category:number for number, category in enumerate(self.categories)}
+        self.aggregation_array = np.array(load('aggregation'))
+
+        self.ids_data = load('ids')
+        self.ids_offsets = load('ids_offsets')
+
+        #The row of each comment's discussion in the posts table, and its Delta.count.
+        if table == 'comments':
+            self.post = load('post')
+            self.delta = load('delta')
+
+    def __len__(self):
+        return self.shape[0]
+
+    #matrix is the rows x terms matrix: a scipy.sparse CSR matrix, or its CSR arrays if scipy is not installed.
+    @property
+    def matrix(self):
+
+        if scipy is None:
+            return CSRArrays(self.data, self.indices, self.indptr, self.shape)
+
+        return scipy.sparse.csr_matrix((self.data, self.indices, self.indptr), shape = self.shape)
+
+    #aggregation is the terms x categories matrix, 1 where a term belongs to a category.
+    @property
+    def aggregation(self):
+
+        if scipy is None:
+            return self.aggregation_array
+
+        return scipy.sparse.csr_matrix(self.aggregation_array)
+
+    #ids returns the id of every row.
+    def ids(self):
+        return list(unpack_strings(self.ids_data, self.ids_offsets))
+
+    #term_frequencies returns the number of rows each term was found in.
+    def term_frequencies(self):
+        return np.bincount(self.indices, weights = self.data, minlength = self.shape[1]).astype(np.int64)
+
+    #category_counts returns a rows x categories array of the number of terms of each category found in each row.
+    def category_counts(self):
+
+        if scipy is not None:
+            return (self.matrix @ self.aggregation).toarray()
+
+        counts = np.zeros((self.shape[0], len(self.categories)), dtype = np.int64)
+        rows = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+
+        #The entries are added a block at a time, so at most a block of them is expanded to every category.
+        for start in range(0, len(self.indices), 1 << 20):
+            block = slice(start, start + (1 << 20))
+            np.add.at(counts, rows[block], self.aggregation_array[self.indices[block]] * self.data[block, None])
+
+        return counts
+
+    #category_matches returns a rows x categories array, True where the category matched the row (see classify_text).
+    def category_matches(self):
+        return self.category_counts() > 0
+
+    #rates returns the share of rows each category matched.
+    def rates(self):
+
+        matches = self.category_matches()
+        shares = matches.mean(axis = 0) if len(matches) else np.zeros(len(self.categories))
+
+        return dict(zip(self.categories, shares.tolist()))
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Write the document-term matrices of a coded data file.')
+    parser.add_argument('source', help = 'a coded data file, e.g. data/coded/20180815182030_posts.json')
+    parser.add_argument('--destination', default = None, help = 'directory to write to (default: data/matrix/<name>)')
+    parser.add_argument('--buffer-size', type = int, default = BUFFER_SIZE,
+        help = 'numbers held in memory before the rows are saved to disk (default: %d)' % BUFFER_SIZE)
+    args = parser.parse_args()
+
+    destination = args.destination
+    if destination is None:
+        destination = os.path.join('data', 'matrix', os.path.basename(args.source.rstrip('/')).split('.')[0])
+
+    discussion_analysis.stemmer.load(discussion_analysis.STEM_CACHE)
+    build_matrix(args.source, destination, buffer_size = args.buffer_size)
+    discussion_analysis.stemmer.save(discussion_analysis.STEM_CACHE)
+
+    for table in TABLES:
+        matrix = TermMatrix(destination, table)
+        print('%s: %d rows x %d terms, %d entries' % (table, matrix.shape[0], matrix.shape[1], len(matrix.indices)))
+        for category, share in matrix.rates().items():
+            print('    %-14s %.3f' % (category, share))
+
+    print("Matrices written to directory %s" % destination)
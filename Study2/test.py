@@ -10,13 +10,28 @@ Description of this script:
 Authors: J. Hunter Priniski & Zachary Horne
 
 To check the tests, run: python test.py
+To check that a killed coding run resumes, run: python test.py --resume data/<file>
 """
 
+import os
+import sys
 import json
+import shutil
 import random
+import argparse
+import tempfile
+
+from link_extractor import extract_links, soup_links
+from compact_model import load_posts
+from json_lines import read_posts
+from sharded import is_sharded
 
 # We will use json_reader to read in our JSON object. 
 def json_reader(directory):
+
+    # A sharded dataset (see sharded.py) is read one discussion at a time. 
+    if is_sharded(directory):
+        return list(read_posts(directory))
     
     with open(directory, 'r') as json_file:
 
@@ -24,18 +39,22 @@ def json_reader(directory):
 
     return data
 
-def main():
-	
-	# Read in data. If you are testing for a new data set, input the directory to the file here. 
-	data = json_reader('data/coded/20180815182030_posts.json')
+"""
+run_tests runs the tests over a dataset (a list of coded discussions), and returns a list of 
+(description, passed) pairs.  If expected_posts is None, the number of discussions isn't tested. 
+"""
+def run_tests(data, expected_posts = 29):
+
+	tests = []
 
 	# TEST 1. Right number of discussions. 
-	if len(data) == 29:
-		PASS_1 = True
-	else:
-		PASS_1 = False
+	if expected_posts is not None:
+		if len(data) == expected_posts:
+			PASS_1 = True
+		else:
+			PASS_1 = False
 
-	print("TEST 1: proper number of discussions.  %r" % PASS_1) 
+		tests.append(("TEST 1: proper number of discussions.  ", PASS_1))
 	
 	# Test 2. Every discussion has a topic. 
 	PASS_2 = True
@@ -43,7 +62,7 @@ def main():
 		if not('topic' in post.keys()):
 			PASS_2 = False
 	
-	print("TEST 2: Every discussion has a topic classification. %r" % PASS_2) 
+	tests.append(("TEST 2: Every discussion has a topic classification. ", PASS_2))
 
 
 	# Test 3. Every comment has evidence classification.
@@ -55,8 +74,7 @@ def main():
 			if not ('evidence_use' in comment.keys()): 
 				PASS_3 = False
 
-	print("TEST 3: Every comment has a evidence use classification.  %r" % PASS_3)
-
+	tests.append(("TEST 3: Every comment has a evidence use classification.  ", PASS_3))
 
 	# Test 4. Every comment has evidence classification.
 
@@ -67,7 +85,98 @@ def main():
 			if not ('Delta' in comment.keys()): 
 				PASS_4 = False
 
-	print("TEST 3: Every comment has a delta attribute.  %r" % PASS_4)
+	tests.append(("TEST 3: Every comment has a delta attribute.  ", PASS_4))
+
+	# Test 5. The links found by extract_links are the ones BeautifulSoup finds. 
+	# To also time the two, run: python link_extractor.py data/coded/20180815182030_posts.json
+
+	PASS_5 = True
+
+	for post in data:
+		for comment in post['_comments']:
+			if extract_links(comment['body_html']) != soup_links(comment['body_html']):
+				PASS_5 = False
+
+	tests.append(("TEST 5: Links match the BeautifulSoup links.  ", PASS_5))
+
+	return tests
+
+"""
+check_resume codes a data file with discussion_analysis.py --incremental, kills the run after interrupt_after
+discussions (leaving a half written line at the end of the partial file and of the manifest, as a crash would),
+and resumes it.  It returns a (description, passed) pair: passed if the resumed run reused the discussions coded
+before the crash, and wrote the same coded file as a run that was never interrupted.  The runs are made in a
+temporary directory, so the data in data/ is left alone.
+"""
+def check_resume(directory, interrupt_after = 2):
+
+	import discussion_analysis
+
+	lexicons = discussion_analysis.load_lexicons()
+	filename = os.path.basename(directory).replace('.json', '.jsonl') if directory.endswith('.json') else os.path.basename(directory)
+	here = os.getcwd()
+	scratch = tempfile.mkdtemp()
+
+	try:
+		for name in ('topics', 'evidence-language'):
+			os.symlink(os.path.abspath(name), os.path.join(scratch, name))
+		os.makedirs(os.path.join(scratch, 'data', 'coded'))
+
+		with open(os.path.join(scratch, 'data', filename), 'w') as outfile:
+			for post in read_posts(directory):
+				outfile.write(json.dumps(post) + '\n')
+
+		os.chdir(scratch)
+
+		# The run that is never interrupted. 
+		discussion_analysis.code_file(filename, lexicons)
+		os.replace('data/coded/' + filename, 'expected.jsonl')
+
+		# The run that is killed after interrupt_after discussions. 
+		code_posts = discussion_analysis.code_posts
+
+		def interrupted(*args, **kwargs):
+			for number, post in enumerate(code_posts(*args, **kwargs)):
+				if number == interrupt_after:
+					raise KeyboardInterrupt
+				yield post
+
+		discussion_analysis.code_posts = interrupted
+		try:
+			discussion_analysis.code_file(filename, lexicons, incremental = True)
+		except KeyboardInterrupt:
+			pass
+		finally:
+			discussion_analysis.code_posts = code_posts
+
+		destination = 'data/coded/' + filename
+		for path in (destination + '.partial.jsonl', destination + '.manifest.jsonl'):
+			with open(path, 'a') as outfile:
+				outfile.write('{"id": "half a li')
+
+		# The resumed run. 
+		discussion_analysis.code_file(filename, lexicons, incremental = True)
+
+		with open(destination, 'r') as resumed, open('expected.jsonl', 'r') as expected:
+			passed = resumed.read() == expected.read()
+
+		hashes, stamp = discussion_analysis.read_manifest(destination + '.manifest.jsonl')
+		passed = passed and stamp is not None and not os.path.exists(destination + '.partial.jsonl')
+
+	finally:
+		os.chdir(here)
+		shutil.rmtree(scratch)
+
+	return ("TEST 6: A coding run killed after %d discussions resumes.  " % interrupt_after, passed)
+
+def main(directory = 'data/coded/20180815182030_posts.json'):
+	
+	# Read in data. If you are testing for a new data set, input the directory to the file here. 
+	# The discussions are loaded compactly (see compact_model.py), so large data sets fit in memory. 
+	data = list(load_posts(directory))
+
+	for description, passed in run_tests(data):
+		print("%s%r" % (description, passed))
 
 	# View the delta count in 10 random post. Not a formal test, but just to make sure things look alright.  
 	print("10 random delta attributes. They will mostly be 0.")
@@ -108,4 +217,18 @@ def main():
 	#				print('\n was awarded this many deltas:\n')
 	#				print(comment['Delta']['count'])
 
-main()
\ No newline at end of file
+# The tests are also run by pipeline.py, which imports run_tests without running main.
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(description = 'Check the coded data, or that a killed coding run resumes.')
+	parser.add_argument('directory', nargs = '?', default = 'data/coded/20180815182030_posts.json', help = 'a coded data file')
+	parser.add_argument('--resume', default = None, metavar = 'DATA_FILE',
+		help = 'instead, check that coding this (uncoded) data file resumes after a crash')
+	args = parser.parse_args()
+
+	if args.resume is not None:
+		description, passed = check_resume(args.resume)
+		print("%s%r" % (description, passed))
+		sys.exit(0 if passed else 1)
+
+	main(args.directory)